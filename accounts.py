@@ -0,0 +1,248 @@
+"""Account deletion.
+
+Deleting an account marks the user deleted (hidden from then on: they
+can't log in, and profiles, listings and feeds skip them) and queues a
+background purge. The purge removes the account's rows with set-based
+DELETEs of at most ACCOUNT_PURGE_BATCH_SIZE rows, in this order:
+
+    feed       the user's inbox, and entries in others' inboxes for
+               notifications by or about the user
+    notify     notifications by or about the user
+    closet     closet rows
+    wishlist   wishlist rows
+    follows    follows in either direction
+    user       the user row itself
+
+Each purge job runs at most ACCOUNT_PURGE_BATCHES batches in one
+transaction, then queues the next job ACCOUNT_PURGE_PAUSE seconds later,
+so a huge account never holds long locks or crowds out other writes.
+Progress is kept in ``account_deletions``:
+
+    python accounts.py status
+    python accounts.py resume     # requeue unfinished purges (e.g. dead jobs)
+    python accounts.py migrate    # add the new column, table and indexes
+"""
+
+import argparse
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import delete, inspect, or_, select, text, tuple_, update
+
+import closets
+import follow_graph
+import jobs
+import usercache
+from models import (db, AccountDeletion, Closet, FeedCursor, FeedEntry, Follows,
+                    Notification, User, Wishlist)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCHES = 5
+DEFAULT_PAUSE = 0.5
+
+STEPS = ('feed', 'notify', 'closet', 'wishlist', 'follows', 'user')
+
+# Filter for users that haven't been deleted.
+ACTIVE = User.deleted_at.is_(None)
+
+
+def active_users():
+    return User.query.filter(ACTIVE)
+
+
+def get_active_or_404(user_id):
+    """The user, unless they don't exist or have been deleted."""
+
+    user = db.session.get(User, user_id)
+    if user is None or user.deleted_at is not None:
+        abort(404)
+    return user
+
+
+def request_deletion(user_id):
+    """Hide the account now and purge it in the background, in the
+    caller's transaction. False if it was already deleted."""
+
+    now = datetime.utcnow()
+    marked = db.session.execute(
+        update(User).where(User.id == user_id, ACTIVE).values(deleted_at=now)
+        .execution_options(synchronize_session=False)).rowcount
+    if not marked:
+        return False
+
+    db.session.add(AccountDeletion(user_id=user_id, requested_at=now, step=STEPS[0]))
+    db.session.flush()
+    jobs.enqueue('accounts.purge', {'user_id': user_id}, key=f"account-purge:{user_id}:0")
+    jobs.on_commit(lambda: usercache.invalidate(user_id))
+    return True
+
+
+##############################################################################
+# Purging
+
+def _about(user_id):
+    return or_(Notification.user_id == user_id, Notification.target_id == user_id)
+
+
+def _batch(model, keys, condition, limit, returning=()):
+    """DELETE at most `limit` rows of `model` matching `condition`."""
+
+    chosen = select(*keys).where(condition).limit(limit)
+    target = keys[0] if len(keys) == 1 else tuple_(*keys)
+    statement = (delete(model).where(target.in_(chosen))
+                 .execution_options(synchronize_session=False))
+    if returning:
+        return db.session.execute(statement.returning(*returning)).all()
+    return db.session.execute(statement).rowcount
+
+
+def purge_batch(step, user_id, limit):
+    """Run one batch of `step`; returns (rows deleted, sneaker ids touched,
+    follow pairs removed)."""
+
+    if step == 'feed':
+        about = select(Notification.id).where(_about(user_id))
+        deleted = _batch(FeedEntry, (FeedEntry.id,),
+                         FeedEntry.notification_id.in_(about), limit)
+        deleted += _batch(FeedEntry, (FeedEntry.id,), FeedEntry.user_id == user_id,
+                          limit - deleted)
+        if deleted < limit:
+            deleted += db.session.execute(
+                delete(FeedCursor).where(FeedCursor.user_id == user_id)).rowcount
+        return deleted, [], []
+
+    if step == 'notify':
+        return _batch(Notification, (Notification.id,), _about(user_id), limit), [], []
+
+    if step in ('closet', 'wishlist'):
+        model = Closet if step == 'closet' else Wishlist
+        rows = _batch(model, (model.id,), model.user_id == user_id, limit,
+                      returning=(model.sneaker_id,))
+        return len(rows), [row.sneaker_id for row in rows], []
+
+    if step == 'follows':
+        keys = (Follows.user_following_id, Follows.user_being_followed_id)
+        rows = _batch(Follows, keys,
+                      or_(Follows.user_following_id == user_id,
+                          Follows.user_being_followed_id == user_id),
+                      limit, returning=keys)
+        return len(rows), [], [tuple(row) for row in rows]
+
+    return db.session.execute(delete(User).where(User.id == user_id)).rowcount, [], []
+
+
+def purge_pass(user_id, limit=DEFAULT_BATCH_SIZE, batches=DEFAULT_BATCHES, pause=DEFAULT_PAUSE):
+    """Run up to `batches` batches of an account's purge, in the caller's
+    transaction, and queue the next pass `pause` seconds later until done."""
+
+    deletion = db.session.get(AccountDeletion, user_id)
+    if deletion is None or deletion.finished_at is not None:
+        return
+
+    step = deletion.step or STEPS[0]
+    sneaker_ids, follows = set(), []
+    for _ in range(batches):
+        deleted, touched, unfollowed = purge_batch(step, user_id, limit)
+        deletion.rows_deleted += deleted
+        sneaker_ids.update(touched)
+        follows.extend(unfollowed)
+        if deleted < limit:
+            # This step is done
+            if step == STEPS[-1]:
+                deletion.finished_at = datetime.utcnow()
+                break
+            step = STEPS[STEPS.index(step) + 1]
+
+    deletion.step = step
+    deletion.passes += 1
+    deletion.updated_at = datetime.utcnow()
+
+    # Like bulk updates, big batches leave recommendations to the rebuild
+    if len(sneaker_ids) <= closets.BULK_REFRESH_LIMIT:
+        jobs.enqueue_many('recommendations.refresh',
+                          [{'sneaker_id': sneaker_id} for sneaker_id in sneaker_ids])
+
+    if deletion.finished_at is None:
+        jobs.enqueue('accounts.purge', {'user_id': user_id},
+                     key=f"account-purge:{user_id}:{deletion.passes}", delay=pause)
+
+    def committed():
+        for follower_id, followed_id in follows:
+            follow_graph.remove_follow(follower_id, followed_id)
+        usercache.invalidate(user_id, *{other for pair in follows for other in pair})
+    jobs.on_commit(committed)
+
+
+def progress():
+    """Unfinished purges and the most recently finished ones."""
+
+    def describe(deletion):
+        return {'user_id': deletion.user_id, 'step': deletion.step,
+                'rows_deleted': deletion.rows_deleted, 'passes': deletion.passes,
+                'requested_at': deletion.requested_at.isoformat(),
+                'finished_at': deletion.finished_at and deletion.finished_at.isoformat()}
+
+    unfinished = db.session.scalars(
+        select(AccountDeletion).where(AccountDeletion.finished_at.is_(None))
+        .order_by(AccountDeletion.requested_at)).all()
+    finished = db.session.scalars(
+        select(AccountDeletion).where(AccountDeletion.finished_at.isnot(None))
+        .order_by(AccountDeletion.finished_at.desc()).limit(10)).all()
+    return {'pending': [describe(deletion) for deletion in unfinished],
+            'recent': [describe(deletion) for deletion in finished]}
+
+
+def resume():
+    """Queue a fresh pass for every unfinished purge; returns how many."""
+
+    resumed = 0
+    for deletion in db.session.scalars(
+            select(AccountDeletion).where(AccountDeletion.finished_at.is_(None))):
+        # Skip a pass whose key already exists (e.g. dead); a new one is
+        # keyed past it.
+        deletion.passes += 1
+        resumed += jobs.enqueue('accounts.purge', {'user_id': deletion.user_id},
+                                key=f"account-purge:{deletion.user_id}:{deletion.passes}")
+    db.session.commit()
+    return resumed
+
+
+def migrate():
+    """Add users.deleted_at, the progress table and the purge indexes."""
+
+    columns = {column['name'] for column in inspect(db.engine).get_columns('users')}
+    with db.engine.begin() as connection:
+        if 'deleted_at' not in columns:
+            connection.execute(text("ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP"))
+        AccountDeletion.__table__.create(connection, checkfirst=True)
+        for index in (*Notification.__table__.indexes, *FeedEntry.__table__.indexes):
+            index.create(connection, checkfirst=True)
+
+
+def init_app(app):
+    """Read purge settings from `app.config`."""
+
+    app.config.setdefault('ACCOUNT_PURGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    app.config.setdefault('ACCOUNT_PURGE_BATCHES', DEFAULT_BATCHES)
+    app.config.setdefault('ACCOUNT_PURGE_PAUSE', DEFAULT_PAUSE)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect and resume account purges.")
+    parser.add_argument('command', choices=['status', 'resume', 'migrate'])
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        if args.command == 'status':
+            for state, deletions in progress().items():
+                print(f"{state}:")
+                for deletion in deletions:
+                    print(f"  {deletion}")
+        elif args.command == 'resume':
+            print(f"Resumed {resume()} account purges.")
+        else:
+            migrate()
+            print("Account deletion column, table and indexes ready.")
@@ -0,0 +1,326 @@
+"""Versioned JSON API under ``/api/v1``.
+
+main.js uses it to add, move and remove sneakers, toggle the rotation and
+follow users without reloading the page; the same endpoints serve anything
+else that wants the catalog or a collection as data.
+
+    GET          /api/v1/sneakers?q=&after=&before=&limit=
+    GET          /api/v1/sneakers/<id>
+    GET          /api/v1/users/<id>/closet     (with the rotation)
+    GET          /api/v1/users/<id>/wishlist
+    GET          /api/v1/notifications?before=&after=
+    PUT, DELETE  /api/v1/closet/<sneaker_id>
+    PUT, DELETE  /api/v1/wishlist/<sneaker_id>
+    PUT, DELETE  /api/v1/rotation/<sneaker_id>
+    PUT, DELETE  /api/v1/follows/<user_id>
+
+Payloads are kept small: sneakers are ``{id, name, brand, price, image}``
+from the catalog snapshot, and a mutation answers with only the new state
+of what it changed. Catalog reads carry a weak ETag derived from the catalog
+version and answer 304 before running any query; per-user reads carry a
+strong ETag of the body. Mutations need an ``X-Requested-With`` header,
+which a cross-site form can't send. Bodies are serialized with orjson when
+it is installed.
+"""
+
+import hashlib
+import json
+
+from flask import Blueprint, current_app, g, request
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+
+import catalog
+import closets
+import feed
+import images
+import push
+import recommendations
+import search as sneaker_search
+import social
+from models import db, Closet, Sneaker, User, Wishlist
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+LISTS = {'closet': Closet, 'wishlist': Wishlist}
+
+
+def _dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def _json(payload, status=200):
+    return current_app.response_class(_dumps(payload), status=status,
+                                      mimetype='application/json')
+
+
+def _error(message, status, **extra):
+    return _json({'error': message, **extra}, status)
+
+
+@api.errorhandler(HTTPException)
+def _http_error(error):
+    return _error(error.description, error.code)
+
+
+def _sneaker(row):
+    return {'id': row.id, 'name': row.sneaker_name, 'brand': row.brand,
+            'price': row.retail_price, 'image': images.sneaker_image_url(row, 'card')}
+
+
+##############################################################################
+# Auth
+
+@api.before_request
+def _check_request():
+    if request.method in ('GET', 'HEAD'):
+        return None
+    if not request.headers.get('X-Requested-With'):
+        return _error("Missing X-Requested-With header.", 403)
+    if not g.user:
+        return _error("Access unauthorized.", 401)
+    return None
+
+
+def _require_user():
+    if not g.user:
+        return _error("Access unauthorized.", 401)
+    return None
+
+
+##############################################################################
+# Conditional reads
+
+def _catalog_not_modified(*extra):
+    """Weak ETag from the catalog version (plus `extra`); returns
+    (etag, updated_at, a 304 response or None)."""
+
+    version, updated_at = catalog.version()
+    etag = hashlib.sha1(repr([version, *extra]).encode()).hexdigest()[:16]
+    if is_resource_modified(request.environ, etag=etag, last_modified=updated_at):
+        return etag, updated_at, None
+    return etag, updated_at, _catalog_headers(current_app.response_class(status=304),
+                                              etag, updated_at)
+
+
+def _catalog_headers(response, etag, updated_at):
+    # The same for every user, so shared caches may keep it, but they
+    # must revalidate since the catalog can change at any time.
+    response.set_etag(etag, weak=True)
+    response.last_modified = updated_at
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _private(payload):
+    response = _json(payload)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+##############################################################################
+# Catalog
+
+@api.get('/sneakers')
+def sneakers():
+    """A page of the catalog, or of search results for 'q'."""
+
+    etag, updated_at, not_modified = _catalog_not_modified()
+    if not_modified is not None:
+        return not_modified
+
+    config = current_app.config
+    limit = catalog.page_size(request.args.get('limit', type=int),
+                              config['CATALOG_PAGE_SIZE'], config['CATALOG_MAX_PAGE_SIZE'])
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    search = request.args.get('q')
+
+    if search:
+        ranked_ids = sneaker_search.search(search, limit=config['SEARCH_MAX_RESULTS'],
+                                           threshold=config['SEARCH_FUZZY_THRESHOLD'])
+        page = catalog.RankedPage(ranked_ids, after=after, before=before, limit=limit)
+    else:
+        page = catalog.snapshot().page(after=after, before=before, limit=limit)
+
+    payload = {'sneakers': [_sneaker(row) for row in page],
+               'next': page.next_cursor, 'prev': page.prev_cursor}
+    return _catalog_headers(_json(payload), etag, updated_at)
+
+
+@api.get('/sneakers/<int:sneaker_id>')
+def sneaker(sneaker_id):
+    """One sneaker, with the ids of its recommendations."""
+
+    similar = recommendations.ids_for_sneaker(sneaker_id)
+    etag, updated_at, not_modified = _catalog_not_modified(*similar)
+    if not_modified is not None:
+        return not_modified
+
+    row = catalog.snapshot().get(sneaker_id)
+    if row is None:
+        return _error("Sneaker not found.", 404)
+
+    payload = {**_sneaker(row), 'url': row.url, 'recommendations': similar}
+    return _catalog_headers(_json(payload), etag, updated_at)
+
+
+##############################################################################
+# Collections
+
+def _user_exists(user_id):
+    return db.session.scalar(select(User.id).where(User.id == user_id,
+                                                 User.deleted_at.is_(None))) is not None
+
+
+@api.get('/users/<int:user_id>/closet')
+def user_closet(user_id):
+    """The sneakers in a user's closet, and which are in their rotation."""
+
+    denied = _require_user()
+    if denied:
+        return denied
+    if not _user_exists(user_id):
+        return _error("User not found.", 404)
+
+    entries = db.session.execute(
+        select(Closet.sneaker_id, Closet.is_liked)
+        .where(Closet.user_id == user_id)
+        .order_by(Closet.id)).all()
+    rows = catalog.snapshot().get_many([entry.sneaker_id for entry in entries])
+    return _private({'sneakers': [_sneaker(row) for row in rows],
+                     'rotation': [entry.sneaker_id for entry in entries if entry.is_liked],
+                     'limit': closets.ROTATION_LIMIT})
+
+
+@api.get('/users/<int:user_id>/wishlist')
+def user_wishlist(user_id):
+    """The sneakers on a user's wishlist."""
+
+    denied = _require_user()
+    if denied:
+        return denied
+    if not _user_exists(user_id):
+        return _error("User not found.", 404)
+
+    rows = catalog.snapshot().get_many(db.session.scalars(
+        select(Wishlist.sneaker_id)
+        .where(Wishlist.user_id == user_id)
+        .order_by(Wishlist.id)))
+    return _private({'sneakers': [_sneaker(row) for row in rows]})
+
+
+def _listed(user_id, sneaker_id):
+    """Which of the user's lists the sneaker is in, or None."""
+
+    for name, model in LISTS.items():
+        if db.session.scalar(select(model.id).where(model.user_id == user_id,
+                                                    model.sneaker_id == sneaker_id)):
+            return name
+    return None
+
+
+def _change_list(name, sneaker_id):
+    model = LISTS[name]
+    if request.method == 'PUT':
+        if db.session.get(Sneaker, sneaker_id) is None:
+            return _error("Sneaker not found.", 404)
+        closets.add_and_notify(g.user.id, sneaker_id, model)
+        listed = name
+    elif closets.remove_and_refresh(g.user.id, sneaker_id, model):
+        listed = None
+    else:
+        listed = _listed(g.user.id, sneaker_id)
+    db.session.commit()
+    return _json({'sneaker_id': sneaker_id, 'list': listed})
+
+
+@api.route('/closet/<int:sneaker_id>', methods=['PUT', 'DELETE'])
+def closet(sneaker_id):
+    """Add a sneaker to the closet (moving it off the wishlist) or remove it."""
+
+    return _change_list('closet', sneaker_id)
+
+
+@api.route('/wishlist/<int:sneaker_id>', methods=['PUT', 'DELETE'])
+def wishlist(sneaker_id):
+    """Add a sneaker to the wishlist (moving it out of the closet) or remove it."""
+
+    return _change_list('wishlist', sneaker_id)
+
+
+@api.route('/rotation/<int:sneaker_id>', methods=['PUT', 'DELETE'])
+def rotation(sneaker_id):
+    """Put a closet sneaker in or take it out of the rotation.
+
+    409 with the current rotation if it is already full.
+    """
+
+    failed = closets.set_rotation(g.user.id, sneaker_id, request.method == 'PUT')
+    if failed == 'missing':
+        db.session.rollback()
+        return _error("Sneaker not found in your closet.", 404)
+
+    db.session.commit()
+    payload = {'sneaker_id': sneaker_id, 'rotation': closets.rotation_ids(g.user.id),
+               'limit': closets.ROTATION_LIMIT}
+    if failed == 'full':
+        return _error(f"You can only like up to {closets.ROTATION_LIMIT} sneakers.", 409, **payload)
+    return _json(payload)
+
+
+##############################################################################
+# Social
+
+@api.route('/follows/<int:user_id>', methods=['PUT', 'DELETE'])
+def follow(user_id):
+    """Follow or unfollow a user."""
+
+    if request.method == 'PUT':
+        if user_id == g.user.id:
+            return _error("You can't follow yourself.", 400)
+        if not _user_exists(user_id):
+            return _error("User not found.", 404)
+        social.follow(g.user.id, user_id)
+    else:
+        social.unfollow(g.user.id, user_id)
+    db.session.commit()
+    return _json({'user_id': user_id, 'following': request.method == 'PUT'})
+
+
+@api.get('/notifications')
+def notifications():
+    """A page of the user's feed, newest first, and their unread count.
+
+    Reading it doesn't mark anything read; opening /notifications does.
+    """
+
+    denied = _require_user()
+    if denied:
+        return denied
+
+    page = feed.get_page(g.user.id,
+                         before=request.args.get('before', type=int),
+                         after=request.args.get('after', type=int),
+                         limit=current_app.config['FEED_PAGE_SIZE'])
+    return _private({'notifications': [push.notification_event(notification)
+                                       for notification in page.notifications],
+                     'older': page.older, 'newer': page.newer,
+                     'unread': feed.unread_count(g.user.id)})
+
+
+def init_app(app):
+    """Register the API blueprint."""
+
+    app.register_blueprint(api)
@@ -0,0 +1,140 @@
+"""Benchmark the catalog snapshot against ORM Sneaker objects.
+
+Loads `--sneakers` generated sneakers into in-memory SQLite and reads them
+back three ways: as ORM `Sneaker` objects (what the pages used to build),
+as column rows, and as a `catalog.CatalogSnapshot`. Reports the memory
+each holds (traced Python allocations, also scaled to 1M sneakers) and
+load time, then the cost of a lookup by id and of a 60-sneaker page:
+
+    python benchmarks/catalog_benchmark.py
+    python benchmarks/catalog_benchmark.py --sneakers 1000000
+"""
+
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BATCH_SIZE = 10_000
+PAGE_SIZE = 60
+
+
+def fill(sneakers):
+    from sqlalchemy import insert
+
+    from generate_dataset import DatasetGenerator
+    from models import db, Sneaker
+
+    db.create_all()
+    generator = DatasetGenerator(sneakers=sneakers, users=0)
+    batch = []
+    for row in generator.sneaker_rows():
+        batch.append({**row, 'retail_price': float(row['retail_price'].strip('$'))})
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(insert(Sneaker), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Sneaker), batch)
+    db.session.commit()
+
+
+def traced(load):
+    """(result of `load`, bytes it holds, seconds it took). Timed on a
+    separate untraced run, since tracing slows allocation down."""
+
+    from models import db
+
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+    db.session.expunge_all()
+
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, held, elapsed
+
+
+def timed(operation, arguments):
+    """Median microseconds of `operation` over `arguments`."""
+
+    timings = []
+    for argument in arguments:
+        start = time.perf_counter()
+        operation(argument)
+        timings.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sneakers', type=int, default=200_000)
+    parser.add_argument('--lookups', type=int, default=2_000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite://'
+    from sqlalchemy import select
+
+    import catalog
+    from app import create_app
+    from models import db, Sneaker
+
+    app = create_app('testing')
+    with app.app_context():
+        fill(args.sneakers)
+        columns = (Sneaker.id, Sneaker.sneaker_name, Sneaker.brand, Sneaker.sneaker_image,
+                   Sneaker.retail_price, Sneaker.url)
+
+        objects, orm_bytes, orm_seconds = traced(lambda: Sneaker.query.all())
+        del objects
+        db.session.expunge_all()
+        column_rows, column_bytes, column_seconds = traced(
+            lambda: db.session.execute(select(*columns)).all())
+        del column_rows
+        snapshot, snapshot_bytes, snapshot_seconds = traced(
+            lambda: catalog.CatalogSnapshot.load(1))
+
+        results = [('ORM Sneaker objects', orm_bytes, orm_seconds),
+                   ('column rows', column_bytes, column_seconds),
+                   ('catalog snapshot', snapshot_bytes, snapshot_seconds)]
+        print(f"{args.sneakers:,} sneakers")
+        print(f"{'structure':<22} {'bytes/sneaker':>14} {'MiB per 1M':>11} {'load s':>8}")
+        for name, held, seconds in results:
+            per_sneaker = held / args.sneakers
+            print(f"{name:<22} {per_sneaker:>14.0f} {per_sneaker * 1_000_000 / 2**20:>11.0f} "
+                  f"{seconds:>8.2f}")
+
+        rng = random.Random(0)
+        ids = [rng.randrange(1, args.sneakers + 1) for _ in range(args.lookups)]
+
+        def orm_get(sneaker_id):
+            db.session.expunge_all()
+            return db.session.get(Sneaker, sneaker_id)
+
+        def snapshot_page(after):
+            return list(snapshot.page(after=after, limit=PAGE_SIZE))
+
+        def orm_page(after):
+            db.session.expunge_all()
+            return (Sneaker.query.filter(Sneaker.id > after)
+                    .order_by(Sneaker.id).limit(PAGE_SIZE).all())
+
+        print(f"\n{'operation':<22} {'ORM us':>10} {'snapshot us':>12}")
+        print(f"{'get by id':<22} {timed(orm_get, ids):>10.1f} "
+              f"{timed(snapshot.get, ids):>12.1f}")
+        print(f"{'page of ' + str(PAGE_SIZE):<22} {timed(orm_page, ids[:200]):>10.1f} "
+              f"{timed(snapshot_page, ids[:200]):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
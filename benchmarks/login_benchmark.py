@@ -0,0 +1,80 @@
+"""Benchmark login throughput through the password hashing pool.
+
+Simulates a login burst: `--clients` request threads each verify a
+password `--logins` times through a PasswordHasher, for each pool size.
+Reports logins per second, p50 / p95 latency of the admitted logins and
+how many were turned away as busy:
+
+    python benchmarks/login_benchmark.py
+    python benchmarks/login_benchmark.py --workers 1 2 4 8 --rounds 12 --max-queue 8
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import Busy, PasswordHasher, _hash  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+
+
+def run(workers, clients, logins, rounds, max_queue, timeout):
+    hasher = PasswordHasher(rounds, workers, max_queue, timeout)
+    hashed = _hash(PASSWORD, rounds)
+    latencies = []
+    busy = [0]
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(logins):
+            start = time.perf_counter()
+            try:
+                hasher.verify(hashed, PASSWORD)
+            except Busy:
+                with lock:
+                    busy[0] += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+
+    latencies.sort()
+    p50 = statistics.median(latencies) if latencies else 0
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] if latencies else 0
+    return len(latencies) / elapsed, p50, p95, busy[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--logins', type=int, default=4, help="logins per client")
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--max-queue', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.logins} logins, bcrypt rounds={args.rounds}, "
+          f"max queue={args.max_queue}, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'busy':>6}")
+    for workers in args.workers:
+        throughput, p50, p95, busy = run(workers, args.clients, args.logins, args.rounds,
+                                         args.max_queue, args.timeout)
+        print(f"{workers:>8} {throughput:>9.1f} {p50:>8.1f} {p95:>8.1f} {busy:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark the batch recommendation build on synthetic closets.
+
+Generates closet rows with power-law collection sizes and sneaker
+popularity, then times the sparse matrix build and the top-K pass:
+
+    python benchmarks/recommendation_benchmark.py
+    python benchmarks/recommendation_benchmark.py --rows 100000 --sneakers 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommendations import DEFAULT_K, build_matrix, similar_sneakers  # noqa: E402
+
+
+def synthetic_pairs(rows, users, sneakers, seed=0):
+    """(user_id, sneaker_id) pairs: a few heavy collectors, a few grails."""
+
+    rng = random.Random(seed)
+    user_ids = range(1, users + 1)
+    sneaker_ids = range(1, sneakers + 1)
+    user_weights = [1 / rank ** 0.6 for rank in user_ids]
+    sneaker_weights = [1 / rank ** 0.9 for rank in sneaker_ids]
+
+    chunk = 100_000
+    for start in range(0, rows, chunk):
+        size = min(chunk, rows - start)
+        yield from zip(rng.choices(user_ids, user_weights, k=size),
+                       rng.choices(sneaker_ids, sneaker_weights, k=size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--sneakers', type=int, default=20_000)
+    parser.add_argument('--k', type=int, default=DEFAULT_K)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sneaker_users, user_sneakers = build_matrix(
+        synthetic_pairs(args.rows, args.users, args.sneakers))
+    built = time.perf_counter()
+
+    stored = sum(len(similar) for _, similar in
+                 similar_sneakers(sneaker_users, user_sneakers, args.k))
+    done = time.perf_counter()
+
+    nonzero = sum(len(users) for users in sneaker_users.values())
+    print(f"closet rows:          {args.rows:,} ({nonzero:,} distinct pairs)")
+    print(f"users / sneakers:     {len(user_sneakers):,} / {len(sneaker_users):,}")
+    print(f"matrix build:         {built - start:.1f}s")
+    print(f"top-{args.k} similarities: {done - built:.1f}s ({stored:,} rows)")
+
+
+if __name__ == '__main__':
+    main()
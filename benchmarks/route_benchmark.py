@@ -0,0 +1,315 @@
+"""Route-level benchmarks for the Flask app.
+
+Seeds a SQLite database per data scale with generate_dataset.py (cached
+under benchmarks/.data/ per version of models.py, and copied fresh for
+every run, so runs don't see each other's writes), then drives the key routes through the Flask
+test client as the busiest user and reports p50 / p95 latency, SQL
+queries per request and peak Python memory per route.
+
+    python benchmarks/route_benchmark.py --scales small medium
+    python benchmarks/route_benchmark.py --save-baseline
+    python benchmarks/route_benchmark.py --compare    # exit 1 on regression
+
+Each scale runs in its own process, since the app's caches (search index,
+follow graph, ...) live in module globals. Set BENCH_DATABASE_URL to a
+PostgreSQL URL template (with a {scale} placeholder) to benchmark against
+PostgreSQL instead.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'benchmarks', '.data')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'route_baseline.json')
+
+SCALES = {
+    'small': {'sneakers': 2_000, 'users': 300},
+    'medium': {'sneakers': 20_000, 'users': 3_000},
+    'large': {'sneakers': 200_000, 'users': 20_000},
+}
+
+# Allowed slowdown before --compare fails: each percentile may grow by its
+# factor (and by at least LATENCY_SLACK_MS, so millisecond routes don't
+# flap on timer noise); query counts may not grow at all.
+LATENCY_TOLERANCE = {'p50_ms': 1.25, 'p95_ms': 1.5}
+LATENCY_SLACK_MS = 2.0
+
+
+##############################################################################
+# Worker: runs inside the per-scale process
+
+def seed(scale, seed_value):
+    from app import create_app
+    from generate_dataset import DatabaseSink, DatasetGenerator, PASSWORD, generate, hash_password
+    from models import db, User
+    import feed
+    import recommendations
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        if db.session.query(User.id).first():
+            return
+        generator = DatasetGenerator(seed=seed_value, **SCALES[scale])
+        generate(generator, DatabaseSink(), hash_password(PASSWORD, seed_value))
+        feed.rebuild_inbox(1)
+        db.session.commit()
+        recommendations.rebuild()
+        check_new_ids()
+
+
+def check_new_ids():
+    """Insert (and roll back) rows into loaded tables, so a database whose
+    id sequences lag the seeded ids fails here rather than mid-benchmark.
+    Only PostgreSQL can fail this; SQLite assigns max(id) + 1."""
+
+    from models import db, EventType, Notification, Sneaker
+
+    db.session.add_all([
+        Sneaker(sneaker_name='Sequence check', brand='Nike'),
+        Notification(event_type=EventType.FOLLOW, user_id=1, target_id=2),
+    ])
+    try:
+        db.session.flush()
+    finally:
+        db.session.rollback()
+
+
+def routes(client, user_id, closet_sneaker, other_user):
+    """(name, request, setup, teardown) for each benchmarked route.
+
+    `setup` and `teardown` run untimed around every request, so state
+    changing routes such as follow / unfollow can be repeated.
+    """
+
+    follow = lambda: client.post(f'/users/follow/{other_user}')
+    unfollow = lambda: client.post(f'/users/stop-following/{other_user}')
+    return [
+        ('catalog list', lambda: client.get('/sneakers'), None, None),
+        ('catalog search', lambda: client.get('/sneakers?q=jordan+4+bred'), None, None),
+        ('catalog fuzzy search', lambda: client.get('/sneakers?q=jordn+4+bredd'), None, None),
+        ('sneaker detail', lambda: client.get(f'/sneakers/{closet_sneaker}'), None, None),
+        ('closet', lambda: client.get(f'/users/{user_id}/closet'), None, None),
+        ('wishlist', lambda: client.get(f'/users/{user_id}/wishlist'), None, None),
+        ('rotation toggle', lambda: client.post(f'/sneakers/{closet_sneaker}/rotation'),
+         None, None),
+        ('follow', follow, None, unfollow),
+        ('unfollow', unfollow, follow, None),
+        ('notifications', lambda: client.get('/notifications'), None, None),
+        ('followers', lambda: client.get(f'/users/{user_id}/followers'), None, None),
+        ('profile', lambda: client.get(f'/users/{user_id}'), None, None),
+    ]
+
+
+def measure(name, request, iterations, queries, setup=None, teardown=None):
+    """Time `request` `iterations` times; returns its latency / query / memory row."""
+
+    def call():
+        response = request()
+        response.get_data()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name}: HTTP {response.status_code}")
+
+    timings = []
+    query_counts = []
+    for iteration in range(iterations + 1):
+        if setup:
+            setup()
+        before = queries[0]
+        start = time.perf_counter()
+        call()
+        if iteration:  # the first call warms caches and indexes
+            timings.append((time.perf_counter() - start) * 1000)
+            query_counts.append(queries[0] - before)
+        if teardown:
+            teardown()
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if teardown:
+        teardown()
+
+    timings.sort()
+    return {
+        'p50_ms': statistics.median(timings),
+        'p95_ms': timings[max(0, int(len(timings) * 0.95) - 1)],
+        'queries': max(query_counts),
+        'peak_kb': peak / 1024,
+    }
+
+
+def worker(iterations):
+    from sqlalchemy import event
+
+    from app import create_app
+    from generate_dataset import PASSWORD
+    from models import db, Closet, Follows, User
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        queries = [0]
+        # Only the test client's thread: background job workers and index
+        # rebuilds share the engine.
+        request_thread = threading.get_ident()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count_query(*args):
+            if threading.get_ident() == request_thread:
+                queries[0] += 1
+
+        user = db.session.get(User, 1)
+        closet_sneaker = (db.session.query(Closet.sneaker_id)
+                          .filter_by(user_id=user.id).limit(1).scalar())
+        followed = db.session.query(Follows.user_being_followed_id).filter_by(
+            user_following_id=user.id)
+        other_user = (db.session.query(User.id)
+                      .filter(User.id != user.id, User.id.not_in(followed))
+                      .order_by(User.id).limit(1).scalar())
+        username = user.username
+
+    client = app.test_client()
+    results = {}
+
+    login = lambda: client.post('/login', data={'username': username, 'password': PASSWORD})
+    results['login'] = measure('login', login, max(3, iterations // 10), queries)
+
+    for name, request, setup, teardown in routes(client, 1, closet_sneaker, other_user):
+        results[name] = measure(name, request, iterations, queries, setup, teardown)
+    return results
+
+
+##############################################################################
+# Driver
+
+def run_worker(database_url, *args):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    return subprocess.run([sys.executable, __file__, *args], env=env, cwd=ROOT, check=True,
+                          stdout=subprocess.PIPE, text=True).stdout
+
+
+def schema_version():
+    """Short hash of models.py, so a schema change reseeds the cache."""
+
+    with open(os.path.join(ROOT, 'models.py'), 'rb') as models:
+        return hashlib.sha256(models.read()).hexdigest()[:8]
+
+
+def pristine_database(scale, seed_value):
+    """Path of the cached SQLite dataset for `scale`, seeding it if needed."""
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    pristine = os.path.join(DATA_DIR, f"{scale}-seed{seed_value}-{schema_version()}.db")
+    if not os.path.exists(pristine):
+        print(f"Seeding {scale} dataset...", file=sys.stderr)
+        run_worker(f"sqlite:///{pristine}.tmp", '--seed-only', scale, '--seed', str(seed_value))
+        os.replace(f"{pristine}.tmp", pristine)
+    return pristine
+
+
+def run_scale(scale, iterations, seed_value):
+    template = os.environ.get('BENCH_DATABASE_URL')
+    if template:
+        # An external database is seeded once and benchmarked as is.
+        database_url = template.format(scale=scale)
+        run_worker(database_url, '--seed-only', scale, '--seed', str(seed_value))
+        return json.loads(run_worker(database_url, '--worker', '--iterations', str(iterations)))
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = shutil.copy(pristine_database(scale, seed_value), os.path.join(scratch, 'bench.db'))
+        return json.loads(run_worker(f"sqlite:///{path}", '--worker',
+                                     '--iterations', str(iterations)))
+
+
+def compare(results, baseline):
+    """Return regression messages for results that fall behind `baseline`."""
+
+    regressions = []
+    for scale, routes_ in results.items():
+        for route, current in routes_.items():
+            previous = baseline.get(scale, {}).get(route)
+            if previous is None:
+                continue
+            for percentile, tolerance in LATENCY_TOLERANCE.items():
+                allowed = max(previous[percentile] * tolerance,
+                              previous[percentile] + LATENCY_SLACK_MS)
+                if current[percentile] > allowed:
+                    regressions.append(f"{scale} / {route}: {percentile} "
+                                       f"{previous[percentile]:.1f} -> {current[percentile]:.1f}")
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{scale} / {route}: queries {previous['queries']} -> "
+                                   f"{current['queries']}")
+    return regressions
+
+
+def print_results(results):
+    print(f"{'scale':<8} {'route':<22} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'peak KB':>9}")
+    for scale, routes_ in results.items():
+        for route, row in routes_.items():
+            print(f"{scale:<8} {route:<22} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                  f"{row['queries']:>8} {row['peak_kb']:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALES), default=['small', 'medium'])
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true',
+                        help="fail if slower than the stored baseline")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--seed-only', choices=sorted(SCALES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed_only or args.worker:
+        sys.path.insert(0, ROOT)
+        if args.seed_only:
+            seed(args.seed_only, args.seed)
+        else:
+            json.dump(worker(args.iterations), sys.stdout)
+        return
+
+    # Baselines are per machine, so none is committed; fail before the run.
+    if args.compare and not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}; run with --save-baseline first")
+
+    results = {scale: run_scale(scale, args.iterations, args.seed) for scale in args.scales}
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline))
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark the in-process sneaker search index.
+
+Builds a TrigramIndex over synthetic catalogs and reports build time and
+query latency (p50 / p95) for exact and typo-tolerant queries:
+
+    python benchmarks/search_benchmark.py
+    python benchmarks/search_benchmark.py --sizes 10000 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import TrigramIndex  # noqa: E402
+
+BRANDS = ['Jordan', 'Nike', 'Adidas', 'New Balance', 'Asics', 'Puma', 'Reebok', 'Converse']
+MODELS = ['Air Jordan 1 Retro High OG', 'Jordan 4 Retro', 'Dunk Low', 'Air Max 90',
+          'Yeezy Boost 350 V2', 'Samba OG', '550', 'Gel-Lyte III', 'Suede Classic',
+          'Club C 85', 'Chuck 70', 'Air Force 1 Low', 'Jordan 11 Retro', 'Gazelle']
+COLORWAYS = ['Oreo', 'Bred', 'Chicago', 'Military Blue', 'Pine Green', 'University Blue',
+             'Black Cat', 'Panda', 'Triple White', 'Zebra', 'Sail', 'Infrared', 'Mocha',
+             'Pollen', 'Thunder', 'Lightning', 'Cement', 'Shadow', 'Volt', 'Cream']
+SUFFIXES = ['', ' (GS)', ' (PS)', ' (W)', ' (2021)', ' (2024)', ' SE', ' SP']
+
+QUERIES = {
+    'exact': ['jordan 4 oreo', 'dunk low panda', 'yeezy', 'samba', 'military blue'],
+    'fuzzy': ['jordn 4 oreo', 'dnuk low pnda', 'yezy boost', 'gazele', 'chcago'],
+}
+
+
+def synthetic_rows(count, seed=0):
+    rng = random.Random(seed)
+    for sneaker_id in range(1, count + 1):
+        name = (f"{rng.choice(MODELS)} {rng.choice(COLORWAYS)} "
+                f"{rng.choice(COLORWAYS)}{rng.choice(SUFFIXES)} {sneaker_id}")
+        yield sneaker_id, name, rng.choice(BRANDS)
+
+
+def time_queries(index, queries, fuzzy, repeat):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, fuzzy=fuzzy, limit=60)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'sneakers':>10} {'build s':>8} {'mode':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in args.sizes:
+        index = TrigramIndex()
+        start = time.perf_counter()
+        index.build(synthetic_rows(size))
+        build = time.perf_counter() - start
+
+        for mode, queries in QUERIES.items():
+            p50, p95 = time_queries(index, queries, mode == 'fuzzy', args.repeat)
+            print(f"{size:>10} {build:>8.1f} {mode:>6} {p50:>8.2f} {p95:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
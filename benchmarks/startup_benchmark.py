@@ -0,0 +1,128 @@
+"""Benchmark worker startup: import time and time to first response.
+
+Each run is a fresh process against a copy of the route benchmark's
+dataset, in one of three modes:
+
+    cold       create_app, then the first requests compile templates and
+               build the search index (a worker without preloading)
+    cached     the same, with the production profile's bytecode cache
+               already filled by an earlier process
+    preforked  create_app and warmup in a parent, then fork; only the
+               child's after_fork and first requests are timed
+
+and reports the median import, create_app and warmup times and how long
+the first request of each route takes:
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 10 --scale medium
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from route_benchmark import ROOT, SCALES, pristine_database
+
+MODES = ('cold', 'cached', 'preforked')
+ROUTES = ('/sneakers', '/sneakers?q=jordan', '/sneakers/1', '/login')
+
+
+def _ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def first_responses(app):
+    timings = {}
+    client = app.test_client()
+    for route in ROUTES:
+        start = time.perf_counter()
+        response = client.get(route)
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{route}: HTTP {response.status_code}")
+        timings[route] = _ms(start)
+    return timings
+
+
+def worker(mode):
+    start = time.perf_counter()
+    import app as factory
+    result = {'import_ms': _ms(start)}
+
+    start = time.perf_counter()
+    app = factory.create_app('development' if mode == 'cold' else 'production')
+    result['create_ms'] = _ms(start)
+
+    if mode != 'preforked':
+        result.update(first_responses(app))
+        return result
+
+    start = time.perf_counter()
+    factory.warmup(app)
+    result['warmup_ms'] = _ms(start)
+
+    read, write = os.pipe()
+    if os.fork() == 0:
+        os.close(read)
+        start = time.perf_counter()
+        factory.after_fork(app)
+        timings = {'after_fork_ms': _ms(start), **first_responses(app)}
+        with os.fdopen(write, 'w') as pipe:
+            json.dump(timings, pipe)
+        os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        result.update(json.load(pipe))
+    os.wait()
+    return result
+
+
+def run(mode, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url, FLASK_DEBUG='0')
+    if mode == 'cold':
+        env.pop('JINJA_BYTECODE_CACHE', None)
+    output = subprocess.run([sys.executable, __file__, '--worker', mode], env=env, cwd=ROOT,
+                            check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, ROOT)
+        json.dump(worker(args.worker), sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = shutil.copy(pristine_database(args.scale, args.seed),
+                           os.path.join(scratch, 'bench.db'))
+        # A private bytecode cache, filled once before the timed runs.
+        os.environ['JINJA_BYTECODE_CACHE'] = os.path.join(scratch, 'jinja-cache')
+        run('cached', f"sqlite:///{path}")
+
+        columns = ('import_ms', 'create_ms', 'warmup_ms', 'after_fork_ms', *ROUTES)
+        print(f"{'mode':<10} " + ' '.join(f"{column:>18}" for column in columns))
+        for mode in args.modes:
+            runs = [run(mode, f"sqlite:///{path}") for _ in range(args.runs)]
+            medians = [statistics.median(result[column] for result in runs)
+                       if column in runs[0] else None for column in columns]
+            print(f"{mode:<10} " + ' '.join(f"{'-' if value is None else f'{value:.1f}':>18}"
+                                            for value in medians))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""Sneaker catalog listing helpers, the catalog version and the in-memory
+catalog snapshot.
+
+The catalog version is a counter in ``catalog_version`` bumped in the same
+transaction as any change to ``sneakers`` (ORM edits via mapper events,
+ingest once per batch). Readers cache it per process for
+CATALOG_VERSION_TTL seconds.
+
+Pages that show sneakers read them from `snapshot()`: every sneaker,
+loaded once per worker into parallel arrays ordered by id and replaced
+whole when the catalog version moves on, so listings, detail pages and
+closets never build ORM objects for the catalog. `Sneaker` is for writes.
+"""
+
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from sqlalchemy import event, insert, select, update
+
+from models import db, CatalogVersion, Sneaker
+
+DEFAULT_PAGE_SIZE = 60
+MAX_PAGE_SIZE = 240
+DEFAULT_VERSION_TTL = 5
+
+_version_ttl = DEFAULT_VERSION_TTL
+_version = None  # (expires, (version, updated_at))
+
+
+class RankedPage:
+    """One page of sneakers in a precomputed (e.g. relevance) order.
+
+    Ranked results have no seekable key, so the cursors here are positions
+    in `ranked_ids`: `after` starts the page at that offset, `before` ends
+    it there. Exposes the same cursor attributes as SnapshotPage.
+    """
+
+    def __init__(self, ranked_ids, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        if before is not None:
+            start = max(before - limit, 0)
+        else:
+            start = after or 0
+        end = start + limit
+
+        self.ids = ranked_ids[start:end]
+        self.prev_cursor = start or None
+        self.next_cursor = end if end < len(ranked_ids) else None
+
+    def __iter__(self):
+        return iter(snapshot().get_many(self.ids))
+
+
+def page_size(requested, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a requested page size to [1, maximum], falling back to `default`."""
+
+    if not requested:
+        return default
+    return max(1, min(requested, maximum))
+
+
+##############################################################################
+# Catalog version
+
+def bump_version(connection):
+    """Record a catalog change, inside the caller's transaction."""
+
+    global _version
+    now = datetime.utcnow().replace(microsecond=0)
+    result = connection.execute(update(CatalogVersion)
+                                .where(CatalogVersion.id == 1)
+                                .values(version=CatalogVersion.version + 1, updated_at=now))
+    if not result.rowcount:
+        connection.execute(insert(CatalogVersion).values(id=1, version=1, updated_at=now))
+    _version = None
+
+
+def version():
+    """(version, updated_at) of the catalog, cached for a few seconds."""
+
+    global _version
+    if _version is None or _version[0] < time.monotonic():
+        row = db.session.execute(
+            select(CatalogVersion.version, CatalogVersion.updated_at)
+            .where(CatalogVersion.id == 1)).one_or_none()
+        current = tuple(row) if row else (0, datetime(2000, 1, 1))
+        _version = (time.monotonic() + _version_ttl, current)
+    return _version[1]
+
+
+@event.listens_for(Sneaker, 'after_insert')
+@event.listens_for(Sneaker, 'after_update')
+@event.listens_for(Sneaker, 'after_delete')
+def _sneaker_changed(mapper, connection, sneaker):
+    bump_version(connection)
+
+
+##############################################################################
+# In-memory snapshot
+
+SNAPSHOT_BATCH = 10_000
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+class SneakerRecord:
+    """A read-only sneaker from the snapshot, with Sneaker's column names."""
+
+    __slots__ = ('id', 'sneaker_name', 'brand', 'sneaker_image', 'retail_price', 'url')
+
+    def __init__(self, id, sneaker_name, brand, sneaker_image, retail_price, url):
+        self.id = id
+        self.sneaker_name = sneaker_name
+        self.brand = brand
+        self.sneaker_image = sneaker_image
+        self.retail_price = retail_price
+        self.url = url
+
+    def __repr__(self):
+        return f"<SneakerRecord #{self.id}: {self.sneaker_name}>"
+
+
+class PackedStrings:
+    """Strings appended into one UTF-8 buffer, with an array of end offsets."""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._ends = array('Q')
+
+    def append(self, value):
+        if value:
+            self._data += value.encode()
+        self._ends.append(len(self._data))
+
+    def freeze(self):
+        self._data = bytes(self._data)
+
+    def __getitem__(self, position):
+        start = self._ends[position - 1] if position else 0
+        return self._data[start:self._ends[position]].decode()
+
+    def __len__(self):
+        return len(self._ends)
+
+    @property
+    def nbytes(self):
+        return len(self._data) + self._ends.itemsize * len(self._ends)
+
+
+class CatalogSnapshot:
+    """Every sneaker at one catalog version, read-only once built.
+
+    Columns are parallel arrays in id order: ids and prices in typed
+    arrays (NaN for no price), brands as indexes into a tuple of interned
+    names, the text columns packed with `PackedStrings`. Nothing in it is
+    a Python object per sneaker, so it stays small and its pages stay
+    shared with forked workers (reading it bumps no reference counts).
+    Records are built on access.
+    """
+
+    def __init__(self, version, rows):
+        """`rows` are (id, name, brand, image, price, url) in id order."""
+
+        self.version = version
+        self.ids = array('q')
+        self.prices = array('d')
+        self.brand_codes = array('I')
+        self.names = PackedStrings()
+        self.images = PackedStrings()
+        self.urls = PackedStrings()
+
+        codes = {}
+        for sneaker_id, name, brand, image, price, url in rows:
+            self.ids.append(sneaker_id)
+            self.prices.append(math.nan if price is None else price)
+            code = codes.get(brand)
+            if code is None:
+                code = codes[brand] = len(codes)
+            self.brand_codes.append(code)
+            self.names.append(name)
+            self.images.append(image)
+            self.urls.append(url)
+        self.brands = tuple(codes)
+        for strings in (self.names, self.images, self.urls):
+            strings.freeze()
+
+    @classmethod
+    def load(cls, version):
+        rows = db.session.execute(
+            select(Sneaker.id, Sneaker.sneaker_name, Sneaker.brand, Sneaker.sneaker_image,
+                   Sneaker.retail_price, Sneaker.url)
+            .order_by(Sneaker.id)
+            .execution_options(yield_per=SNAPSHOT_BATCH))
+        return cls(version, rows)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns (the brand names aside)."""
+
+        return (sum(column.itemsize * len(column)
+                    for column in (self.ids, self.prices, self.brand_codes))
+                + self.names.nbytes + self.images.nbytes + self.urls.nbytes)
+
+    def position(self, sneaker_id):
+        """Index of `sneaker_id` in the columns, or None."""
+
+        ids = self.ids
+        if not ids:
+            return None
+        # Ids are usually dense, so try the direct offset before searching.
+        guess = sneaker_id - ids[0]
+        if 0 <= guess < len(ids) and ids[guess] == sneaker_id:
+            return guess
+        found = bisect_left(ids, sneaker_id)
+        if found < len(ids) and ids[found] == sneaker_id:
+            return found
+        return None
+
+    def record(self, position):
+        price = self.prices[position]
+        return SneakerRecord(self.ids[position], self.names[position],
+                             self.brands[self.brand_codes[position]],
+                             self.images[position] or None,
+                             None if math.isnan(price) else price,
+                             self.urls[position] or None)
+
+    def get(self, sneaker_id):
+        """The sneaker with `sneaker_id`, or None."""
+
+        position = self.position(sneaker_id)
+        return None if position is None else self.record(position)
+
+    def get_many(self, sneaker_ids):
+        """Sneakers for `sneaker_ids`, in that order, skipping unknown ids."""
+
+        positions = (self.position(sneaker_id) for sneaker_id in sneaker_ids)
+        return [self.record(position) for position in positions if position is not None]
+
+    def page(self, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        return SnapshotPage(self, after=after, before=before, limit=limit)
+
+
+class SnapshotPage:
+    """One page of a snapshot in id order, with a KeysetPage's cursors
+    (`after` / `before` are sneaker ids)."""
+
+    def __init__(self, source, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+        ids = source.ids
+        self.source = source
+        self.prev_cursor = self.next_cursor = None
+
+        if before is not None:
+            stop = bisect_left(ids, before)
+            start = max(stop - limit, 0)
+            if start:
+                self.prev_cursor = ids[start]
+            if stop > start:
+                self.next_cursor = ids[stop - 1]
+        else:
+            start = bisect_right(ids, after) if after is not None else 0
+            stop = min(start + limit, len(ids))
+            if after is not None and stop > start:
+                self.prev_cursor = ids[start]
+            if stop < len(ids):
+                self.next_cursor = ids[stop - 1]
+        self.positions = range(start, stop)
+
+    def __iter__(self):
+        return (self.source.record(position) for position in self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def snapshot():
+    """This worker's catalog snapshot at the current catalog version.
+
+    A new version loads a new snapshot and swaps it in whole; whoever
+    holds the old one keeps a consistent view. While one thread loads,
+    the others carry on with the old snapshot instead of waiting.
+    """
+
+    global _snapshot
+    current, _ = version()
+    loaded = _snapshot
+    if loaded is not None and loaded.version == current:
+        return loaded
+
+    if not _snapshot_lock.acquire(blocking=loaded is None):
+        return loaded
+    try:
+        if _snapshot is None or _snapshot.version != current:
+            _snapshot = CatalogSnapshot.load(current)
+        return _snapshot
+    finally:
+        _snapshot_lock.release()
+
+
+def snapshot_stats():
+    """Version, size and bytes of the loaded snapshot, without loading one."""
+
+    loaded = _snapshot
+    if loaded is None:
+        return None
+    return {'version': loaded.version, 'sneakers': len(loaded), 'bytes': loaded.nbytes,
+            'brands': len(loaded.brands)}
+
+
+def init_app(app):
+    """Read catalog settings from `app.config`."""
+
+    global _version_ttl
+    app.config.setdefault('CATALOG_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    app.config.setdefault('CATALOG_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    _version_ttl = app.config.setdefault('CATALOG_VERSION_TTL', DEFAULT_VERSION_TTL)
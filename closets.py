@@ -0,0 +1,252 @@
+"""Closet, wishlist and rotation mutations.
+
+A sneaker is in at most one of a user's closet or wishlist, once. Unique
+(user_id, sneaker_id) indexes enforce the "once"; every add here is a
+single INSERT ... ON CONFLICT DO NOTHING plus a DELETE from the other
+list, so concurrent clicks can't create duplicates.
+
+Databases created before those indexes existed need their duplicates
+cleaned up first:
+
+    python closets.py migrate
+"""
+
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+import jobs
+import ownership
+import usercache
+from models import db, Closet, EventType, Notification, Sneaker, User, Wishlist
+
+ROTATION_LIMIT = 5
+
+BULK_MAX_ITEMS = 1000
+
+# Bulk updates touching more sneakers than this skip the per-sneaker
+# recommendation refresh; `recommendations.py rebuild` catches them up.
+BULK_REFRESH_LIMIT = 50
+
+
+def _insert(connection, model):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model.__table__).on_conflict_do_nothing(
+        index_elements=['user_id', 'sneaker_id'])
+
+
+def _other(model):
+    return Wishlist if model is Closet else Closet
+
+
+def add(user_id, sneaker_id, model):
+    """Put a sneaker in the user's closet or wishlist (`model`), moving it
+    out of the other one. Returns False if it was already there."""
+
+    connection = db.session.connection()
+    inserted = connection.execute(_insert(connection, model),
+                                  {'user_id': user_id, 'sneaker_id': sneaker_id}).rowcount
+    other = _other(model)
+    db.session.execute(delete(other).where(other.user_id == user_id,
+                                           other.sneaker_id == sneaker_id))
+    return bool(inserted)
+
+
+def remove(user_id, sneaker_id, model):
+    """Take a sneaker out of the user's closet or wishlist; False if absent."""
+
+    return bool(db.session.execute(
+        delete(model).where(model.user_id == user_id, model.sneaker_id == sneaker_id)
+    ).rowcount)
+
+
+def _collection_changed(user_id):
+    jobs.on_commit(ownership.invalidate)
+    jobs.on_commit(lambda: usercache.invalidate(user_id))
+
+
+def add_and_notify(user_id, sneaker_id, model):
+    """`add`, plus a notification for the user's followers. Fanning it out
+    and refreshing the sneaker's recommendations happen in the background.
+    Returns False if the sneaker was already there."""
+
+    if not add(user_id, sneaker_id, model):
+        return False
+
+    event_type = EventType.CLOSET_ADD if model is Closet else EventType.WISHLIST_ADD
+    notification = Notification(event_type=event_type, user_id=user_id, sneaker_id=sneaker_id,
+                                timestamp=datetime.utcnow())
+    db.session.add(notification)
+    db.session.flush()
+
+    jobs.enqueue('notifications.fan_out', {'notification_id': notification.id},
+                 key=f"fan-out:{notification.id}")
+    jobs.enqueue('recommendations.refresh', {'sneaker_id': sneaker_id})
+    _collection_changed(user_id)
+    return True
+
+
+def remove_and_refresh(user_id, sneaker_id, model):
+    """`remove`, refreshing the sneaker's recommendations in the background."""
+
+    if not remove(user_id, sneaker_id, model):
+        return False
+    jobs.enqueue('recommendations.refresh', {'sneaker_id': sneaker_id})
+    _collection_changed(user_id)
+    return True
+
+
+def rotation_ids(user_id):
+    """Ids of the sneakers in the user's rotation."""
+
+    return db.session.scalars(
+        select(Closet.sneaker_id)
+        .where(Closet.user_id == user_id, Closet.is_liked.is_(True))
+        .order_by(Closet.id)).all()
+
+
+def set_rotation(user_id, sneaker_id, liked):
+    """Put a closet sneaker in or out of the user's rotation.
+
+    Returns None on success, else why not: 'missing' if the sneaker isn't
+    in the closet, 'full' if the rotation already has ROTATION_LIMIT. The
+    limit is checked in the UPDATE itself. On PostgreSQL the user's row is
+    locked first: likes of different sneakers update different rows, so
+    at READ COMMITTED each would otherwise count the rotation before the
+    other commits and both could fit under the limit. (SQLite runs one
+    write transaction at a time.)
+    """
+
+    if liked and db.session.get_bind().dialect.name == 'postgresql':
+        # NO KEY UPDATE still lets other transactions insert rows that
+        # reference this user.
+        db.session.execute(select(User.id).where(User.id == user_id)
+                           .with_for_update(key_share=True))
+
+    statement = (update(Closet)
+                 .where(Closet.user_id == user_id, Closet.sneaker_id == sneaker_id)
+                 .values(is_liked=liked)
+                 .execution_options(synchronize_session=False))
+    if liked:
+        in_rotation = (select(func.count()).select_from(Closet)
+                       .where(Closet.user_id == user_id, Closet.is_liked.is_(True),
+                              Closet.sneaker_id != sneaker_id)
+                       .scalar_subquery())
+        statement = statement.where(in_rotation < ROTATION_LIMIT)
+
+    if db.session.execute(statement).rowcount:
+        return None
+    exists = db.session.scalar(select(Closet.id).where(Closet.user_id == user_id,
+                                                       Closet.sneaker_id == sneaker_id))
+    return 'full' if exists else 'missing'
+
+
+class BulkResult:
+    """What one bulk update changed, by sneaker id."""
+
+    def __init__(self):
+        self.closet_added = []
+        self.wishlist_added = []
+        self.removed = []
+        self.unknown = []
+
+    @property
+    def touched(self):
+        return [*self.closet_added, *self.wishlist_added, *self.removed]
+
+    def to_dict(self):
+        return {'closet_added': self.closet_added, 'wishlist_added': self.wishlist_added,
+                'removed': self.removed, 'unknown': self.unknown}
+
+
+def bulk(user_id, closet_ids=(), wishlist_ids=(), remove_ids=()):
+    """Add (or move) sneakers into the closet / wishlist and remove others,
+    in the caller's transaction. Ids that aren't in the catalog are skipped
+    and reported in `unknown`. Each id belongs in one list only; callers
+    reject overlaps."""
+
+    result = BulkResult()
+    requested = {*closet_ids, *wishlist_ids, *remove_ids}
+    known = set(db.session.scalars(select(Sneaker.id).where(Sneaker.id.in_(requested))))
+    result.unknown = sorted(requested - known)
+
+    connection = db.session.connection()
+    for model, ids, added in ((Closet, closet_ids, result.closet_added),
+                              (Wishlist, wishlist_ids, result.wishlist_added)):
+        ids = sorted(known.intersection(ids))
+        if not ids:
+            continue
+        present = set(db.session.scalars(
+            select(model.sneaker_id).where(model.user_id == user_id, model.sneaker_id.in_(ids))))
+        new = [sneaker_id for sneaker_id in ids if sneaker_id not in present]
+        if new:
+            connection.execute(_insert(connection, model),
+                               [{'user_id': user_id, 'sneaker_id': sneaker_id} for sneaker_id in new])
+        other = _other(model)
+        db.session.execute(delete(other).where(other.user_id == user_id,
+                                               other.sneaker_id.in_(ids)))
+        added.extend(new)
+
+    ids = sorted(known.intersection(remove_ids))
+    if ids:
+        for model in (Closet, Wishlist):
+            removed = db.session.scalars(
+                delete(model).where(model.user_id == user_id, model.sneaker_id.in_(ids))
+                .returning(model.sneaker_id)).all()
+            result.removed.extend(removed)
+
+    return result
+
+
+##############################################################################
+# Migration
+
+def dedupe(connection):
+    """Delete duplicate closet / wishlist rows; returns rows deleted.
+
+    Of duplicate closet rows the one in rotation (is_liked) is kept, else
+    the oldest. A sneaker in both lists stays in the closet only.
+    """
+
+    keep = (select(func.coalesce(func.min(Closet.id).filter(Closet.is_liked.is_(True)),
+                                 func.min(Closet.id)))
+            .group_by(Closet.user_id, Closet.sneaker_id))
+    deleted = connection.execute(delete(Closet).where(Closet.id.not_in(keep))).rowcount
+
+    keep = select(func.min(Wishlist.id)).group_by(Wishlist.user_id, Wishlist.sneaker_id)
+    deleted += connection.execute(delete(Wishlist).where(Wishlist.id.not_in(keep))).rowcount
+
+    owned = select(Closet.id).where(Closet.user_id == Wishlist.user_id,
+                                    Closet.sneaker_id == Wishlist.sneaker_id)
+    deleted += connection.execute(delete(Wishlist).where(owned.exists())).rowcount
+    return deleted
+
+
+def ensure_indexes(connection):
+    for model in (Closet, Wishlist):
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def migrate():
+    with db.engine.begin() as connection:
+        deleted = dedupe(connection)
+        ensure_indexes(connection)
+    return deleted
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        sys.exit("usage: python closets.py migrate")
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        started = time.perf_counter()
+        deleted = migrate()
+        print(f"Removed {deleted} duplicate closet / wishlist rows and created the unique "
+              f"indexes in {time.perf_counter() - started:.1f}s")
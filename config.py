@@ -0,0 +1,127 @@
+"""Configuration profiles for `app.create_app`.
+
+A profile is a class of defaults, picked by name (APP_PROFILE, else
+``development``):
+
+    development   the debug toolbar when FLASK_DEBUG=1
+    production    Jinja bytecode cache in the instance folder
+    testing       in-memory SQLite, no CSRF, jobs run inline, cheap bcrypt
+
+Settings not listed here default in the ``init_app`` of the module that
+reads them. Environment variables named in ENVIRONMENT override both.
+"""
+
+import os
+
+import feed
+import recommendations
+import social
+
+
+def _flag(value):
+    return value == '1'
+
+
+def _list(value):
+    return [item for item in value.split(',') if item]
+
+
+def _names(value):
+    return frozenset(_list(value))
+
+
+# Settings read from the environment, and how to parse them.
+ENVIRONMENT = {
+    'SECRET_KEY': str,
+    'DATABASE_REPLICA_URLS': _list,
+    'DATABASE_POOL_SIZE': int,
+    'DATABASE_MAX_OVERFLOW': int,
+    'DATABASE_POOL_TIMEOUT': int,
+    'DATABASE_POOL_RECYCLE': int,
+    'DATABASE_POOL_PRE_PING': _flag,
+    'DATABASE_STATEMENT_TIMEOUT': int,
+    'DATABASE_STICKY_SECONDS': int,
+    'CATALOG_PAGE_SIZE': int,
+    'CATALOG_MAX_PAGE_SIZE': int,
+    'CATALOG_STREAM': _flag,
+    'FOLLOW_PAGE_SIZE': int,
+    'RECOMMENDATIONS_K': int,
+    'FEED_PAGE_SIZE': int,
+    'FEED_INBOX_LIMIT': int,
+    'INSTRUMENTATION': _flag,
+    'N_PLUS_ONE_THRESHOLD': int,
+    'FRAGMENT_CACHE_MAX_BYTES': int,
+    'FRAGMENT_CACHE_URL': str,
+    'PUSH_BROKER_URL': str,
+    'PUSH_MAX_STREAMS': int,
+    'PASSWORD_BCRYPT_ROUNDS': int,
+    'PASSWORD_WORKERS': int,
+    'PASSWORD_MAX_QUEUE': int,
+    'ACCOUNT_PURGE_BATCH_SIZE': int,
+    'ACCOUNT_PURGE_BATCHES': int,
+    'ACCOUNT_PURGE_PAUSE': float,
+    'JOBS_EAGER': _flag,
+    'JOBS_WORKERS': int,
+    'IMAGE_ORIGIN': str,
+    'IMAGE_CACHE_DIR': str,
+    'IMAGE_CACHE_MAX_BYTES': int,
+    'METRICS_ADMINS': _names,
+    'JINJA_BYTECODE_CACHE': str,
+    'BUILD_ID': str,
+}
+
+# Environment variables whose setting has a different name.
+RENAMED = {'DATABASE_URL': 'SQLALCHEMY_DATABASE_URI'}
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///sneaker-closet'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = "it's a secret"
+
+    CATALOG_STREAM = False
+    FOLLOW_PAGE_SIZE = social.DEFAULT_PAGE_SIZE
+    RECOMMENDATIONS_K = recommendations.DEFAULT_K
+    FEED_PAGE_SIZE = feed.DEFAULT_PAGE_SIZE
+    FEED_INBOX_LIMIT = feed.DEFAULT_INBOX_LIMIT
+
+    # Directory (relative to the instance folder) for compiled templates,
+    # kept across restarts; None compiles them afresh in every process.
+    JINJA_BYTECODE_CACHE = None
+    DEBUG_TOOLBAR = False
+
+
+class DevelopmentConfig(Config):
+    # Only loaded when FLASK_DEBUG=1 as well.
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+
+class ProductionConfig(Config):
+    JINJA_BYTECODE_CACHE = 'jinja-cache'
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    JOBS_EAGER = True
+    PASSWORD_BCRYPT_ROUNDS = 4
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+def from_environ(config, environ=os.environ):
+    """Override `config` with the settings set in `environ`."""
+
+    for name, value in environ.items():
+        if name in RENAMED:
+            config[RENAMED[name]] = value
+        elif name in ENVIRONMENT and value != '':
+            config[name] = ENVIRONMENT[name](value)
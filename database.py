@@ -0,0 +1,183 @@
+"""Engine and pool options, and read-replica routing for ``db.session``.
+
+Pool sizing comes from the DATABASE_* settings (see `init_app`), applied
+to the primary and to every replica. DATABASE_STATEMENT_TIMEOUT (ms) is
+set per connection on PostgreSQL; SQLite has no equivalent.
+
+With DATABASE_REPLICA_URLS set, `RoutingSession` sends plain SELECTs to a
+replica during GET / HEAD requests, and everything else to the primary:
+writes, flushes, SELECT ... FOR UPDATE, `session.connection()` callers
+and anything outside a request (job workers, CLIs). Once a request has
+written, the rest of it reads from the primary too.
+
+Read-your-writes: a request that wrote marks the browser session, and
+that user's GETs read from the primary for DATABASE_STICKY_SECONDS
+afterwards, long enough for the replicas to catch up.
+
+Locally, two SQLite files stand in for a primary and a replica, with a
+copy as "replication":
+
+    DATABASE_URL=sqlite:////tmp/primary.db \\
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db flask run
+    python database.py sync      # copy the primary into the SQLite replicas
+    python database.py pools     # pool status per engine
+"""
+
+import argparse
+import random
+import sqlite3
+import time
+
+from flask import request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 30 * 60
+DEFAULT_STICKY_SECONDS = 10
+
+STICKY_KEY = 'db_primary_until'
+REPLICA_PREFIX = 'replica-'
+
+
+def _is_read(clause):
+    return (clause is not None and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None)
+
+
+class RoutingSession(Session):
+    """A Flask-SQLAlchemy session that reads from a replica when allowed.
+
+    `info['replica']` is the bind key of the replica chosen for this
+    request; `info['wrote']` records that the session has used the
+    primary for anything but a SELECT.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if bind is None and replica is not None:
+            if _is_read(clause) and not self._flushing:
+                return self._db.engines[replica]
+            # Writes stick this session to the primary from here on.
+            self.info['replica'] = None
+            self.info['wrote'] = True
+        elif bind is None and not _is_read(clause):
+            self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+##############################################################################
+# Engine options
+
+def _pooled(url):
+    # In-memory SQLite gets a StaticPool, which takes no sizing options.
+    url = make_url(url)
+    return not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'))
+
+
+def engine_options(url, config):
+    """Engine options for `url` from the DATABASE_* settings."""
+
+    options = {'pool_pre_ping': config['DATABASE_POOL_PRE_PING']}
+    if _pooled(url):
+        options.update(pool_size=config['DATABASE_POOL_SIZE'],
+                       max_overflow=config['DATABASE_MAX_OVERFLOW'],
+                       pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+                       pool_recycle=config['DATABASE_POOL_RECYCLE'])
+    timeout = config['DATABASE_STATEMENT_TIMEOUT']
+    if timeout and make_url(url).get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f"-c statement_timeout={int(timeout)}"}
+    return options
+
+
+def pool_status(db):
+    """Checked-out / idle / overflow connections for each engine."""
+
+    status = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        status[key or 'primary'] = {
+            'class': type(pool).__name__,
+            'size': pool.size() if hasattr(pool, 'size') else None,
+            'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+        }
+    return status
+
+
+def sync_sqlite_replicas(db):
+    """Copy a SQLite primary into each SQLite replica; returns the number
+    copied. A local stand-in for replication."""
+
+    primary = make_url(str(db.engine.url))
+    if primary.get_backend_name() != 'sqlite':
+        raise RuntimeError("sync only copies SQLite databases; use real replication")
+
+    copied = 0
+    with sqlite3.connect(primary.database) as source:
+        for key, engine in db.engines.items():
+            if key is None or engine.url.get_backend_name() != 'sqlite':
+                continue
+            engine.dispose()
+            with sqlite3.connect(engine.url.database) as target:
+                source.backup(target)
+            copied += 1
+    return copied
+
+
+def init_app(app, db):
+    """Apply engine options and register replicas as binds. Must run
+    before `db.init_app`, which creates the engines."""
+
+    config = app.config
+    config.setdefault('DATABASE_POOL_SIZE', DEFAULT_POOL_SIZE)
+    config.setdefault('DATABASE_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW)
+    config.setdefault('DATABASE_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+    config.setdefault('DATABASE_POOL_RECYCLE', DEFAULT_POOL_RECYCLE)
+    config.setdefault('DATABASE_POOL_PRE_PING', True)
+    config.setdefault('DATABASE_STATEMENT_TIMEOUT', None)
+    config.setdefault('DATABASE_REPLICA_URLS', ())
+    config.setdefault('DATABASE_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+
+    options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    for name, value in engine_options(config['SQLALCHEMY_DATABASE_URI'], config).items():
+        options.setdefault(name, value)
+
+    binds = config.setdefault('SQLALCHEMY_BINDS', {})
+    replicas = []
+    for number, url in enumerate(config['DATABASE_REPLICA_URLS']):
+        key = f"{REPLICA_PREFIX}{number}"
+        binds[key] = {'url': url, **engine_options(url, config)}
+        replicas.append(key)
+    if not replicas:
+        return
+
+    @app.before_request
+    def _route_reads():
+        if request.method in ('GET', 'HEAD') and session.get(STICKY_KEY, 0) <= time.time():
+            db.session.info['replica'] = random.choice(replicas)
+
+    @app.after_request
+    def _read_your_writes(response):
+        if db.session.info.get('wrote'):
+            session[STICKY_KEY] = time.time() + config['DATABASE_STICKY_SECONDS']
+        return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect database engines and replicas.")
+    parser.add_argument('command', choices=['sync', 'pools'])
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+    app = create_app()
+
+    with app.app_context():
+        if args.command == 'sync':
+            print(f"Copied the primary into {sync_sqlite_replicas(db)} SQLite replicas.")
+        else:
+            for key, status in pool_status(db).items():
+                print(key, status)
@@ -0,0 +1,366 @@
+"""Materialized notification feeds.
+
+Notifications are copied into per-user inboxes (``feed_entries``) when they
+are created, so reading ``/notifications`` is a single indexed query instead
+of walking every followed user's notifications. A per-user read cursor
+(``feed_cursors``) marks where the unread entries start.
+
+Notifications themselves are compact events (see models.Notification). A
+periodic job keeps the table bounded by folding bursts of adds into one
+event and purging old ones:
+
+    python feed.py compact [--burst-minutes 10] [--retention-days 90]
+    python feed.py rebuild     # rebuild every inbox
+    python feed.py migrate     # convert message-string notifications to events,
+                               # add the read-cursor table, dedupe inboxes
+"""
+
+import argparse
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, delete, func, inspect, insert, literal, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased, joinedload
+
+from models import db, AccountDeletion, EventType, FeedCursor, FeedEntry, Follows, Notification
+
+DEFAULT_PAGE_SIZE = 10
+DEFAULT_INBOX_LIMIT = 500
+DEFAULT_BURST_WINDOW = timedelta(minutes=10)
+DEFAULT_COMPACT_LOOKBACK = timedelta(days=1)
+DEFAULT_RETENTION = timedelta(days=90)
+BATCH_SIZE = 1000
+
+BURSTABLE = (EventType.CLOSET_ADD, EventType.WISHLIST_ADD, EventType.COLLECTION_ADD)
+
+FeedPage = namedtuple('FeedPage', ['notifications', 'older', 'newer'])
+
+
+def _insert_entries():
+    # Inboxes that already hold the notification are skipped, so delivering
+    # it again (a job rerun after its lease ran out) adds nothing.
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(FeedEntry).on_conflict_do_nothing(
+        index_elements=['notification_id', 'user_id'])
+
+
+def fan_out_to_followers(notification, inbox_limit=DEFAULT_INBOX_LIMIT):
+    """Deliver `notification` to the inbox of everyone following its author.
+
+    The notification must already be flushed so it has an id. Returns the
+    ids of the users it was newly delivered to.
+    """
+
+    followers = (select(Follows.user_following_id)
+                 .where(Follows.user_being_followed_id == notification.user_id))
+
+    recipients = db.session.scalars(
+        _insert_entries().from_select(
+            ['user_id', 'notification_id'],
+            followers.add_columns(literal(notification.id)))
+        .returning(FeedEntry.user_id)).all()
+
+    trim_inboxes(followers, inbox_limit)
+    return recipients
+
+
+def deliver(notification, user_id, inbox_limit=DEFAULT_INBOX_LIMIT):
+    """Deliver `notification` to a single user's inbox."""
+
+    db.session.execute(_insert_entries().values(user_id=user_id,
+                                                 notification_id=notification.id))
+
+    trim_inboxes([user_id], inbox_limit)
+
+
+def trim_inboxes(user_ids, inbox_limit=DEFAULT_INBOX_LIMIT):
+    """Drop everything but the newest `inbox_limit` entries of each inbox.
+
+    `user_ids` may be a list or a select of user ids; the trim is one
+    set-based DELETE either way.
+    """
+
+    newer = aliased(FeedEntry)
+    cutoff = (select(newer.id)
+              .where(newer.user_id == FeedEntry.user_id)
+              .order_by(newer.id.desc())
+              .offset(inbox_limit - 1)
+              .limit(1)
+              .scalar_subquery())
+
+    db.session.execute(
+        delete(FeedEntry)
+        .where(FeedEntry.user_id.in_(user_ids), FeedEntry.id < cutoff)
+        .execution_options(synchronize_session=False))
+
+
+def get_page(user_id, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """Return one page of `user_id`'s feed, newest first.
+
+    `before` / `after` are feed entry ids taken from a previous page's
+    `older` / `newer` cursors. Returns a FeedPage whose cursors are None when
+    there is nothing further in that direction.
+    """
+
+    query = (db.session.query(FeedEntry.id, Notification)
+             .join(Notification, FeedEntry.notification_id == Notification.id)
+             .options(joinedload(Notification.actor), joinedload(Notification.sneaker))
+             .filter(FeedEntry.user_id == user_id,
+                     # Deleted accounts vanish before the purge reaches their events
+                     Notification.user_id.not_in(
+                         select(AccountDeletion.user_id)
+                         .where(AccountDeletion.finished_at.is_(None)))))
+
+    if after is not None:
+        query = query.filter(FeedEntry.id > after).order_by(FeedEntry.id.asc())
+    else:
+        if before is not None:
+            query = query.filter(FeedEntry.id < before)
+        query = query.order_by(FeedEntry.id.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if after is not None:
+        rows.reverse()
+        older = rows[-1][0] if rows else after + 1
+        newer = rows[0][0] if has_more else None
+    else:
+        older = rows[-1][0] if has_more else None
+        newer = rows[0][0] if before is not None and rows else None
+
+    return FeedPage([notification for _, notification in rows], older, newer)
+
+
+##############################################################################
+# Unread counts
+
+def unread_count(user_id):
+    """Inbox entries newer than the user's read cursor."""
+
+    seen = (select(FeedCursor.seen_id).where(FeedCursor.user_id == user_id)
+            .scalar_subquery())
+    return db.session.scalar(
+        select(func.count()).select_from(FeedEntry)
+        .where(FeedEntry.user_id == user_id, FeedEntry.id > func.coalesce(seen, 0)))
+
+
+def mark_read(user_id):
+    """Move the user's read cursor to their newest inbox entry."""
+
+    newest = db.session.scalar(select(func.max(FeedEntry.id)).where(FeedEntry.user_id == user_id))
+    if newest is None:
+        return
+    connection = db.session.connection()
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(FeedCursor).values(user_id=user_id, seen_id=newest)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['user_id'], set_={'seen_id': statement.excluded.seen_id}))
+
+
+def rebuild_inbox(user_id, inbox_limit=DEFAULT_INBOX_LIMIT):
+    """Rebuild a user's inbox from the notifications table.
+
+    Useful for backfilling feeds created before fan-out existed: sneaker
+    activity by followed users plus follows of this user.
+    """
+
+    db.session.execute(delete(FeedEntry).where(FeedEntry.user_id == user_id))
+
+    followed = (select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == user_id))
+    newest = (select(Notification.id)
+              .where(or_(and_(Notification.user_id.in_(followed),
+                              Notification.event_type != EventType.FOLLOW),
+                         and_(Notification.target_id == user_id,
+                              Notification.event_type == EventType.FOLLOW)))
+              .order_by(Notification.id.desc())
+              .limit(inbox_limit))
+
+    # Insert oldest first so entry ids follow notification order.
+    notification_ids = db.session.scalars(newest).all()
+    if notification_ids:
+        db.session.execute(
+            insert(FeedEntry),
+            [{'user_id': user_id, 'notification_id': notification_id}
+             for notification_id in reversed(notification_ids)])
+
+
+##############################################################################
+# Compaction and retention
+
+def _delete_notifications(notification_ids):
+    for start in range(0, len(notification_ids), BATCH_SIZE):
+        chunk = notification_ids[start:start + BATCH_SIZE]
+        db.session.execute(delete(FeedEntry).where(FeedEntry.notification_id.in_(chunk)))
+        db.session.execute(delete(Notification).where(Notification.id.in_(chunk)))
+
+
+def collapse_bursts(since, until, burst_window=DEFAULT_BURST_WINDOW):
+    """Fold runs of the same user's adds, each within `burst_window` of the
+    last, into the run's newest event ("@x added 12 sneakers to Closet").
+
+    Only events between `since` and `until` are looked at; `until` should
+    be at least `burst_window` ago so no burst is still growing. Returns
+    the number of events removed.
+    """
+
+    rows = db.session.execute(
+        select(Notification.id, Notification.user_id, Notification.event_type,
+               Notification.timestamp, Notification.count)
+        .where(Notification.event_type.in_(BURSTABLE),
+               Notification.timestamp >= since, Notification.timestamp < until)
+        .order_by(Notification.user_id, Notification.event_type,
+                  Notification.timestamp, Notification.id)
+    ).yield_per(BATCH_SIZE)
+
+    folded = []
+    counts = []
+    burst = []
+
+    def close_burst():
+        if len(burst) > 1:
+            folded.extend(row.id for row in burst[:-1])
+            counts.append({'notification_id': burst[-1].id,
+                           'new_count': sum(row.count for row in burst)})
+
+    for row in rows:
+        if burst and ((row.user_id, row.event_type) != (burst[-1].user_id, burst[-1].event_type)
+                      or row.timestamp - burst[-1].timestamp > burst_window):
+            close_burst()
+            burst = []
+        burst.append(row)
+    close_burst()
+
+    if counts:
+        db.session.execute(
+            update(Notification.__table__)
+            .where(Notification.__table__.c.id == bindparam('notification_id'))
+            .values(count=bindparam('new_count')),
+            counts)
+    _delete_notifications(folded)
+    return len(folded)
+
+
+def purge(older_than):
+    """Delete notifications (and their feed entries) from before `older_than`,
+    a batch per transaction. Returns the number deleted."""
+
+    deleted = 0
+    while True:
+        notification_ids = db.session.scalars(
+            select(Notification.id)
+            .where(Notification.timestamp < older_than)
+            .limit(BATCH_SIZE)).all()
+        if not notification_ids:
+            return deleted
+        _delete_notifications(notification_ids)
+        db.session.commit()
+        deleted += len(notification_ids)
+
+
+def compact(burst_window=DEFAULT_BURST_WINDOW, lookback=DEFAULT_COMPACT_LOOKBACK,
+            retention=DEFAULT_RETENTION):
+    """Collapse recent bursts and purge expired events; run periodically,
+    more often than `lookback`. Returns (collapsed, purged)."""
+
+    now = datetime.utcnow()
+    collapsed = collapse_bursts(now - lookback, now - burst_window, burst_window)
+    db.session.commit()
+    return collapsed, purge(now - retention)
+
+
+##############################################################################
+# Migration from message-string notifications
+
+def migrate():
+    """Convert notifications stored as formatted messages into events.
+
+    Follows become FOLLOW events with the follower (parsed from the
+    message) as actor; follows whose follower is gone are dropped. Needs
+    SQLite 3.35+ for DROP COLUMN. Also creates the read-cursor table, and
+    drops duplicate feed entries to make (notification, user) unique.
+    """
+
+    FeedCursor.__table__.create(db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            "DELETE FROM feed_entries WHERE id NOT IN "
+            "(SELECT min(id) FROM feed_entries GROUP BY notification_id, user_id)"))
+        connection.execute(text("DROP INDEX IF EXISTS ix_feed_entries_notification_id"))
+        for index in FeedEntry.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+    columns = {column['name'] for column in inspect(db.engine).get_columns('notifications')}
+    if 'event_type' in columns:
+        return False
+
+    with db.engine.begin() as connection:
+        connection.execute(text("ALTER TABLE notifications ADD COLUMN event_type SMALLINT"))
+        connection.execute(text(
+            "ALTER TABLE notifications ADD COLUMN target_id INTEGER REFERENCES users (id)"))
+        connection.execute(text(
+            "ALTER TABLE notifications ADD COLUMN count INTEGER NOT NULL DEFAULT 1"))
+
+        for event_type, label in ((EventType.CLOSET_ADD, 'Closet'),
+                                  (EventType.WISHLIST_ADD, 'Wishlist')):
+            connection.execute(text(
+                "UPDATE notifications SET event_type = :event_type "
+                "WHERE sneaker_id IS NOT NULL AND message LIKE :pattern"),
+                {'event_type': int(event_type), 'pattern': f"% to {label}"})
+
+        connection.execute(text(
+            "UPDATE notifications SET event_type = :event_type, target_id = user_id, "
+            "user_id = (SELECT users.id FROM users "
+            "           WHERE '@' || users.username || ' followed you' = notifications.message) "
+            "WHERE sneaker_id IS NULL AND EXISTS ("
+            "    SELECT 1 FROM users "
+            "    WHERE '@' || users.username || ' followed you' = notifications.message)"),
+            {'event_type': int(EventType.FOLLOW)})
+
+        connection.execute(text(
+            "DELETE FROM feed_entries WHERE notification_id IN "
+            "(SELECT id FROM notifications WHERE event_type IS NULL)"))
+        connection.execute(text("DELETE FROM notifications WHERE event_type IS NULL"))
+
+        connection.execute(text("ALTER TABLE notifications DROP COLUMN message"))
+        connection.execute(text("ALTER TABLE notifications DROP COLUMN sneaker_image"))
+        for index in Notification.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain notification feeds.")
+    parser.add_argument('command', nargs='?', default='rebuild',
+                        choices=['rebuild', 'compact', 'migrate'])
+    parser.add_argument('--burst-minutes', type=int,
+                        default=int(DEFAULT_BURST_WINDOW.total_seconds() // 60))
+    parser.add_argument('--lookback-hours', type=int,
+                        default=int(DEFAULT_COMPACT_LOOKBACK.total_seconds() // 3600))
+    parser.add_argument('--retention-days', type=int, default=DEFAULT_RETENTION.days)
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import User
+    app = create_app()
+
+    with app.app_context():
+        started = time.perf_counter()
+        if args.command == 'rebuild':
+            for (user_id,) in db.session.query(User.id):
+                rebuild_inbox(user_id)
+            db.session.commit()
+            print("Feed inboxes rebuilt.")
+        elif args.command == 'compact':
+            collapsed, purged = compact(timedelta(minutes=args.burst_minutes),
+                                        timedelta(hours=args.lookback_hours),
+                                        timedelta(days=args.retention_days))
+            print(f"Collapsed {collapsed} events into bursts and purged {purged} expired "
+                  f"in {time.perf_counter() - started:.1f}s")
+        else:
+            print("Notifications migrated to events." if migrate()
+                  else "Notifications are already events.")
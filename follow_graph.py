@@ -0,0 +1,341 @@
+"""In-memory follow graph for mutuals and "suggested collectors".
+
+The follows table is loaded into compressed sparse row (CSR) arrays from
+the stdlib ``array`` module, indexed directly by user id: ``offsets[u]`` to
+``offsets[u + 1]`` slices ``targets`` to give u's neighbours. Both
+directions (who u follows, who follows u) are kept, along with a
+user -> sneaker CSR of closets for closet-similarity suggestions.
+
+Follows and unfollows made in this process are applied to a small overlay
+on top of the arrays and folded in when it grows. Each worker rebuilds
+in the background after FOLLOW_GRAPH_TTL seconds, and can start warm from
+a snapshot file:
+
+    python follow_graph.py snapshot follow_graph.snapshot
+"""
+
+import os
+import pickle
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from flask import current_app
+
+from models import db, Closet, Follows
+
+DEFAULT_TTL = 600
+COMPACT_AFTER = 10_000
+SNAPSHOT_VERSION = 1
+
+
+class CSR:
+    """Immutable adjacency lists for node ids 0..len(offsets) - 2."""
+
+    __slots__ = ('offsets', 'targets')
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build from (source, target) pairs already sorted by source."""
+
+        offsets = array('q', [0])
+        targets = array('i')
+        for source, target in pairs:
+            while len(offsets) <= source:
+                offsets.append(len(targets))
+            targets.append(target)
+        offsets.append(len(targets))
+        return cls(offsets, targets)
+
+    def neighbours(self, node):
+        if node < 0 or node + 1 >= len(self.offsets):
+            return self.targets[0:0]
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def degree(self, node):
+        if node < 0 or node + 1 >= len(self.offsets):
+            return 0
+        return self.offsets[node + 1] - self.offsets[node]
+
+    def pairs(self):
+        for node in range(len(self.offsets) - 1):
+            for target in self.neighbours(node):
+                yield node, target
+
+
+class FollowGraph:
+    """Follow edges plus closets, with incremental follow updates."""
+
+    def __init__(self, following=None, followers=None, closets=None, owners=None):
+        empty = CSR(array('q', [0]), array('i'))
+        self.following = following or empty
+        self.followers = followers or empty
+        self.closets = closets or empty
+        self.owners = owners or empty
+        self._added = defaultdict(set)
+        self._added_reverse = defaultdict(set)
+        self._removed = set()
+        self._lock = threading.RLock()
+        self.built_at = time.monotonic()
+
+    ##########################################################################
+    # Building, snapshots
+
+    @classmethod
+    def from_db(cls):
+        """Load follows and closets with one ordered query per direction."""
+
+        session = db.session
+
+        def pairs(source, target):
+            return session.execute(
+                db.select(source, target).order_by(source, target)
+            ).yield_per(50_000)
+
+        return cls(
+            following=CSR.from_pairs(pairs(Follows.user_following_id,
+                                           Follows.user_being_followed_id)),
+            followers=CSR.from_pairs(pairs(Follows.user_being_followed_id,
+                                           Follows.user_following_id)),
+            closets=CSR.from_pairs(pairs(Closet.user_id, Closet.sneaker_id)),
+            owners=CSR.from_pairs(pairs(Closet.sneaker_id, Closet.user_id)),
+        )
+
+    def save(self, path):
+        """Write the graph to `path` (atomically) for other workers to load."""
+
+        self.compact()
+        data = {'version': SNAPSHOT_VERSION}
+        for name in ('following', 'followers', 'closets', 'owners'):
+            csr = getattr(self, name)
+            data[name] = (csr.offsets, csr.targets)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as snapshot:
+            pickle.dump(data, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as snapshot:
+            data = pickle.load(snapshot)
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported follow graph snapshot: {path}")
+        return cls(**{name: CSR(*data[name])
+                      for name in ('following', 'followers', 'closets', 'owners')})
+
+    ##########################################################################
+    # Incremental follow updates
+
+    def add_follow(self, follower_id, followed_id):
+        with self._lock:
+            self._removed.discard((follower_id, followed_id))
+            if followed_id not in self.following.neighbours(follower_id):
+                self._added[follower_id].add(followed_id)
+                self._added_reverse[followed_id].add(follower_id)
+            self._maybe_compact()
+
+    def remove_follow(self, follower_id, followed_id):
+        with self._lock:
+            self._added[follower_id].discard(followed_id)
+            self._added_reverse[followed_id].discard(follower_id)
+            self._removed.add((follower_id, followed_id))
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if len(self._removed) + sum(map(len, self._added.values())) > COMPACT_AFTER:
+            self.compact()
+
+    def compact(self):
+        """Fold the overlay back into fresh CSR arrays."""
+
+        with self._lock:
+            if not self._added and not self._removed:
+                return
+            edges = sorted(
+                {(source, target) for source, target in self.following.pairs()
+                 if (source, target) not in self._removed}
+                | {(source, target) for source, targets in self._added.items()
+                   for target in targets})
+            self.following = CSR.from_pairs(edges)
+            self.followers = CSR.from_pairs(sorted((target, source) for source, target in edges))
+            self._added.clear()
+            self._added_reverse.clear()
+            self._removed.clear()
+
+    ##########################################################################
+    # Queries
+
+    def following_of(self, user_id):
+        """Set of ids `user_id` follows."""
+
+        with self._lock:
+            ids = set(self.following.neighbours(user_id))
+            ids |= self._added.get(user_id, set())
+            if self._removed:
+                ids = {target for target in ids if (user_id, target) not in self._removed}
+            return ids
+
+    def followers_of(self, user_id):
+        """Set of ids following `user_id`."""
+
+        with self._lock:
+            ids = set(self.followers.neighbours(user_id))
+            ids |= self._added_reverse.get(user_id, set())
+            if self._removed:
+                ids = {source for source in ids if (source, user_id) not in self._removed}
+            return ids
+
+    def mutuals(self, viewer_id, user_id):
+        """Ids of people `viewer_id` follows who also follow `user_id`."""
+
+        return self.following_of(viewer_id) & self.followers_of(user_id)
+
+    def suggested(self, user_id, limit=10):
+        """Followers-of-follows ranked by overlap: [(user id, shared follows)].
+
+        Suggests accounts followed by the people `user_id` follows, ranked by
+        how many of them do.
+        """
+
+        following = self.following_of(user_id)
+        counts = Counter()
+        for followed_id in following:
+            counts.update(self.following_of(followed_id))
+
+        for seen in following | {user_id}:
+            counts.pop(seen, None)
+        return counts.most_common(limit)
+
+    def similar_closets(self, user_id, limit=10):
+        """Users whose closets overlap most with `user_id`'s: [(user id, jaccard)]."""
+
+        with self._lock:
+            closet = self.closets.neighbours(user_id)
+            if not closet:
+                return []
+
+            shared = Counter()
+            for sneaker_id in closet:
+                shared.update(self.owners.neighbours(sneaker_id))
+            shared.pop(user_id, None)
+
+            size = len(closet)
+            scores = {other: count / (size + self.closets.degree(other) - count)
+                      for other, count in shared.items()}
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+##############################################################################
+# Per-worker graph
+
+_graph = None
+_graph_lock = threading.Lock()     # held while a new graph is being built
+_changes = None                    # follows made here during that build
+_changes_lock = threading.Lock()
+_ttl = DEFAULT_TTL
+_snapshot_path = None
+
+
+def get_graph():
+    """This worker's graph: from the snapshot file at first, else the DB.
+
+    Once the graph is older than FOLLOW_GRAPH_TTL, a background thread
+    builds a new one and swaps it in whole; until then readers carry on
+    with the old graph instead of waiting.
+    """
+
+    built = _graph
+    if built is not None and time.monotonic() - built.built_at <= _ttl:
+        return built
+
+    if not _graph_lock.acquire(blocking=built is None):
+        return built
+    if built is None:
+        _rebuild(None)
+        return _graph
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_rebuild, args=(app,), name='follow-graph', daemon=True).start()
+    return built
+
+
+def _rebuild(app):
+    """Build a graph and swap it in; releases `_graph_lock`."""
+
+    global _graph, _changes
+    try:
+        with _changes_lock:
+            _changes = []
+        if app is None:
+            if _snapshot_path and os.path.exists(_snapshot_path):
+                graph = FollowGraph.load(_snapshot_path)
+            else:
+                graph = FollowGraph.from_db()
+        else:
+            with app.app_context():
+                graph = FollowGraph.from_db()
+
+        # Follows committed while loading may be missing from what was read.
+        with _changes_lock:
+            for follow, follower_id, followed_id in _changes:
+                if follow:
+                    graph.add_follow(follower_id, followed_id)
+                else:
+                    graph.remove_follow(follower_id, followed_id)
+            _graph = graph
+    finally:
+        with _changes_lock:
+            _changes = None
+        _graph_lock.release()
+
+
+def _record(follow, follower_id, followed_id):
+    with _changes_lock:
+        if _graph is not None:
+            if follow:
+                _graph.add_follow(follower_id, followed_id)
+            else:
+                _graph.remove_follow(follower_id, followed_id)
+        if _changes is not None:
+            _changes.append((follow, follower_id, followed_id))
+
+
+def add_follow(follower_id, followed_id):
+    _record(True, follower_id, followed_id)
+
+
+def remove_follow(follower_id, followed_id):
+    _record(False, follower_id, followed_id)
+
+
+def init_app(app):
+    """Read follow graph settings from `app.config`."""
+
+    global _ttl, _snapshot_path
+    _ttl = app.config.setdefault('FOLLOW_GRAPH_TTL', DEFAULT_TTL)
+    _snapshot_path = app.config.setdefault('FOLLOW_GRAPH_SNAPSHOT',
+                                           os.environ.get('FOLLOW_GRAPH_SNAPSHOT'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'snapshot':
+        sys.exit("usage: python follow_graph.py snapshot PATH")
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        started = time.perf_counter()
+        graph = FollowGraph.from_db()
+        graph.save(sys.argv[2])
+        print(f"Follow graph snapshot written to {sys.argv[2]} "
+              f"({len(graph.following.targets)} follows, "
+              f"{len(graph.closets.targets)} closet rows) "
+              f"in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,189 @@
+"""Rendered HTML fragment cache for sneaker cards and profile headers.
+
+Templates call the `sneaker_card` / `profile_header` globals with a
+``{% call %}`` block:
+
+    {% call sneaker_card(sneaker) %}...per-user buttons...{% endcall %}
+
+The fragment (templates/fragments/) is rendered once and cached under
+the build (`httpcache.build_id`) and the entity id together with a
+version: the catalog version for sneaker cards (bumped by ingest and
+sneaker edits), a digest of the rendered fields for profile headers (and
+`invalidate_profile` on edit). The call
+block's body is spliced into the cached markup on every render, so
+per-viewer content never lands in the cache.
+
+Fragments live in a per-process LRU bounded by bytes. Setting
+FRAGMENT_CACHE_URL (``redis://...``, needs the redis package) adds a
+shared store behind it, so workers render each fragment once between them.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from markupsafe import Markup
+
+import catalog
+import httpcache
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_SHARED_TTL = 24 * 60 * 60
+
+SLOT = '<!--fragment-overlay-->'
+
+
+class FragmentCache:
+    """LRU of key -> (version, html), bounded by the size of the html."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, shared=None, shared_ttl=DEFAULT_SHARED_TTL):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, version):
+        """Cached html for `key` at `version`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                shared_version, _, html = value.decode().partition('\n')
+                if shared_version == str(version):
+                    self._store(key, version, html)
+                    with self._lock:
+                        self.hits += 1
+                    return html
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, version, html):
+        self._store(key, version, html)
+        if self.shared is not None:
+            self.shared.set(key, f"{version}\n{html}".encode(), self.shared_ttl)
+
+    def _store(self, key, version, html):
+        size = len(html.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old[2]
+            self._entries[key] = (version, html, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old[2]
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'shared': self.shared is not None}
+
+
+class RedisStorage:
+    """Shared fragment store in Redis."""
+
+    def __init__(self, url, prefix='fragment:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("FRAGMENT_CACHE_URL needs the redis package installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+cache = FragmentCache()
+
+
+##############################################################################
+# Template globals
+
+def _key(name):
+    # Keyed by build, so a deploy that changes the fragment templates never
+    # reads the old markup from the shared store, even mid-rollout.
+    return f"{httpcache.build_id()}:{name}"
+
+
+def _render(name, version, template, caller, **context):
+    key = _key(name)
+    html = cache.get(key, version)
+    if html is None:
+        html = current_app.jinja_env.get_template(template).render(
+            overlay=Markup(SLOT), **context)
+        cache.set(key, version, html)
+    overlay = caller() if caller else ''
+    return Markup(html.replace(SLOT, overlay, 1))
+
+
+def sneaker_card(sneaker, caller=None):
+    """A sneaker's catalog card; the call block fills in per-user actions."""
+
+    version, _ = catalog.version()
+    return _render(f"sneaker:{sneaker.id}", version, 'fragments/sneaker_card.html',
+                   caller, sneaker=sneaker)
+
+
+def profile_header(user, caller=None):
+    """A user's profile header; the call block fills in per-viewer details."""
+
+    fields = (user.username, user.first_name, user.last_name, user.image_url)
+    version = hashlib.sha1(repr(fields).encode()).hexdigest()[:16]
+    return _render(f"profile:{user.id}", version, 'fragments/profile_header.html',
+                   caller, user=user)
+
+
+def invalidate_profile(user_id):
+    cache.delete(_key(f"profile:{user_id}"))
+
+
+def init_app(app):
+    """Read fragment cache settings from `app.config` and register the globals."""
+
+    global cache
+    max_bytes = app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    url = app.config.setdefault('FRAGMENT_CACHE_URL', None)
+    ttl = app.config.setdefault('FRAGMENT_CACHE_SHARED_TTL', DEFAULT_SHARED_TTL)
+    cache = FragmentCache(max_bytes, RedisStorage(url) if url else None, ttl)
+
+    app.add_template_global(sneaker_card)
+    app.add_template_global(profile_header)
@@ -0,0 +1,364 @@
+"""Generate a large synthetic sneaker-closet dataset for load testing.
+
+Writes sneakers, users, follows, closets, wishlists and notifications with
+power-law activity (a few heavy collectors and grails, a long tail of
+everything else). Output is deterministic for a given --seed, and rows are
+streamed, so memory stays flat however many are asked for.
+
+    python generate_dataset.py --sneakers 1000000 --users 200000 --out generator/load
+    python generate_dataset.py --sneakers 50000 --users 5000 --load
+
+With --out, each table is written to <out>/<table>.csv. The sneakers file
+is also valid input for ingest.py. With --load, rows are inserted into the
+configured database, which should be empty; on PostgreSQL the id
+sequences are then moved past the loaded ids. Afterwards, run
+'python feed.py' to build feed inboxes and 'python recommendations.py
+rebuild' to build recommendations.
+"""
+
+import argparse
+import csv
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from faker import Faker
+
+BRANDS = {
+    'Jordan': ['Jordan 1 Retro High OG', 'Jordan 1 Retro Low OG', 'Jordan 3 Retro',
+               'Jordan 4 Retro', 'Jordan 5 Retro', 'Jordan 11 Retro', 'Jordan 12 Retro'],
+    'Nike': ['Dunk Low', 'Dunk High', 'Air Force 1 Low', 'Air Max 1', 'Air Max 90',
+             'SB Dunk Low', 'Air Max 95', 'Blazer Mid 77'],
+    'adidas': ['Yeezy Boost 350 V2', 'Samba OG', 'Gazelle', 'Campus 00s', 'Forum Low'],
+    'New Balance': ['550', '990v6', '2002R', '9060', '1906R'],
+    'ASICS': ['Gel-Kayano 14', 'Gel-1130', 'Gel-Lyte III', 'GT-2160'],
+    'Converse': ['Chuck 70 Hi', 'Chuck 70 Ox', 'Run Star Hike'],
+}
+COLORWAYS = ['Bred', 'Chicago', 'Royal', 'Shadow', 'Black Cat', 'White Oreo', 'Military Blue',
+             'Pine Green', 'University Blue', 'Panda', 'Triple White', 'Zebra', 'Cream',
+             'Infrared', 'Fire Red', 'Cement', 'Mocha', 'Pollen', 'Thunder', 'Lightning',
+             'Sail', 'Volt', 'Grey Fog', 'Concord', 'Bone', 'Sea Glass', 'Olive']
+EDITIONS = ['', '', '', ' (GS)', ' (PS)', ' (W)', ' SE', ' SP', ' Craft']
+PASSWORD = 'password'
+
+BATCH_SIZE = 5000
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative 1/rank**exponent weights for random.choices over 1..count."""
+
+    total = 0.0
+    cum_weights = []
+    for rank in range(1, count + 1):
+        total += rank ** -exponent
+        cum_weights.append(total)
+    return cum_weights
+
+
+def pareto_degree(rng, alpha, minimum, maximum):
+    """A power-law distributed count in [minimum, maximum]."""
+
+    return min(maximum, int(minimum * rng.paretovariate(alpha)))
+
+
+def distinct_choices(rng, population, cum_weights, count, exclude=()):
+    """Up to `count` distinct weighted picks, not in `exclude`."""
+
+    picked = set()
+    for _ in range(4):
+        needed = count - len(picked)
+        if needed <= 0:
+            break
+        for choice in rng.choices(population, cum_weights=cum_weights, k=needed * 2):
+            if choice not in exclude and choice not in picked:
+                picked.add(choice)
+                if len(picked) == count:
+                    break
+    return sorted(picked)
+
+
+def hash_password(password, seed):
+    """One bcrypt hash shared by every user, with a salt derived from `seed`.
+
+    Hashing per user would dominate the run time, and a random salt would
+    make the users file differ between otherwise identical runs.
+    """
+
+    import bcrypt
+
+    rng = random.Random(f"{seed}:salt")
+    alphabet = './ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+    # The last salt character only carries 4 bits; keep it canonical.
+    salt = ''.join(rng.choice(alphabet) for _ in range(21)) + rng.choice('.Oeu')
+    return bcrypt.hashpw(password.encode(), f"$2b$12${salt}".encode()).decode('UTF-8')
+
+
+class DatasetGenerator:
+    """Deterministic row streams for every table."""
+
+    def __init__(self, sneakers, users, seed=0, now=None,
+                 follows_per_user=20, closet_per_user=15, wishlist_per_user=8):
+        self.sneakers = sneakers
+        self.users = users
+        self.seed = seed
+        self.now = now or datetime(2024, 10, 1)
+        self.follows_per_user = follows_per_user
+        self.closet_per_user = closet_per_user
+        self.wishlist_per_user = wishlist_per_user
+
+    def _rng(self, stream, key=0):
+        return random.Random(f"{self.seed}:{stream}:{key}")
+
+    def _timestamp(self, rng):
+        return self.now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+    def sneaker_name(self, sneaker_id):
+        """Rebuildable from the id alone, so names never have to be stored."""
+
+        rng = self._rng('sneaker', sneaker_id)
+        brand = rng.choice(sorted(BRANDS))
+        model = rng.choice(BRANDS[brand])
+        return brand, f"{model} {rng.choice(COLORWAYS)}{rng.choice(EDITIONS)} #{sneaker_id}"
+
+    def sneaker_rows(self):
+        for sneaker_id in range(1, self.sneakers + 1):
+            brand, name = self.sneaker_name(sneaker_id)
+            rng = self._rng('price', sneaker_id)
+            slug = name.lower().replace(' ', '-').replace('#', '').replace('(', '').replace(')', '')
+            yield {
+                'id': sneaker_id,
+                'sneaker_name': name,
+                'brand': brand,
+                'sneaker_image': f"https://images.example.com/{slug}.jpg",
+                'retail_price': f"${rng.randrange(60, 260, 5)}.00",
+                'url': f"https://stockx.com/{slug}",
+            }
+
+    def user_rows(self, password_hash):
+        fake = Faker()
+        fake.seed_instance(self.seed)
+        for user_id in range(1, self.users + 1):
+            first, last = fake.first_name(), fake.last_name()
+            username = f"{first}{last}{user_id}".lower()
+            yield {
+                'id': user_id,
+                'email': f"{username}@example.com",
+                'username': username,
+                'first_name': first,
+                'last_name': last,
+                'image_url': "/static/images/default-pic.png",
+                'header_image_url': "/static/images/warbler-hero.jpg",
+                'sneaker_size': str(fake.random_element([7, 8, 8.5, 9, 9.5, 10, 10.5, 11, 12])),
+                'password': password_hash,
+            }
+
+    def activity_rows(self):
+        """Yield (table, row) for follows, closet, wishlist and notifications.
+
+        Generated one user at a time; popular users and sneakers are picked
+        far more often (Zipf weights), and how active each user is follows a
+        Pareto distribution.
+        """
+
+        from models import EventType
+
+        user_ids = range(1, self.users + 1)
+        sneaker_ids = range(1, self.sneakers + 1)
+        user_weights = zipf_cum_weights(self.users, 1.0)
+        sneaker_weights = zipf_cum_weights(self.sneakers, 0.9)
+
+        notification_id = 0
+        closet_id = 0
+        wishlist_id = 0
+        for user_id in user_ids:
+            rng = self._rng('activity', user_id)
+
+            follows = pareto_degree(rng, 1.5, self.follows_per_user // 3, self.users - 1)
+            for followed_id in distinct_choices(rng, user_ids, user_weights, follows, {user_id}):
+                notification_id += 1
+                yield 'follows', {'user_being_followed_id': followed_id,
+                                  'user_following_id': user_id}
+                yield 'notifications', {'id': notification_id,
+                                        'event_type': int(EventType.FOLLOW),
+                                        'user_id': user_id, 'target_id': followed_id,
+                                        'sneaker_id': None, 'count': 1,
+                                        'timestamp': self._timestamp(rng)}
+
+            owned = pareto_degree(rng, 1.3, self.closet_per_user // 3, self.sneakers)
+            closet = distinct_choices(rng, sneaker_ids, sneaker_weights, owned)
+            wanted = pareto_degree(rng, 1.3, self.wishlist_per_user // 3, self.sneakers)
+            wishlist = distinct_choices(rng, sneaker_ids, sneaker_weights, wanted, set(closet))
+            # About half the users have up to five closet pairs in rotation.
+            rotation = set(rng.sample(closet, min(5, len(closet)))) if rng.random() < 0.5 else set()
+
+            for table, event_type, picks in (('closet', EventType.CLOSET_ADD, closet),
+                                             ('wishlist', EventType.WISHLIST_ADD, wishlist)):
+                for sneaker_id in picks:
+                    row = {'user_id': user_id, 'sneaker_id': sneaker_id}
+                    if table == 'closet':
+                        closet_id += 1
+                        row.update(id=closet_id, is_liked=sneaker_id in rotation)
+                    else:
+                        wishlist_id += 1
+                        row['id'] = wishlist_id
+                    yield table, row
+
+                    notification_id += 1
+                    yield 'notifications', {
+                        'id': notification_id, 'event_type': int(event_type),
+                        'user_id': user_id, 'target_id': None,
+                        'sneaker_id': sneaker_id, 'count': 1,
+                        'timestamp': self._timestamp(rng)}
+
+
+##############################################################################
+# Sinks
+
+class CSVSink:
+    """One CSV file per table under `directory`."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._files = {}
+        self._writers = {}
+        self.counts = {}
+
+    def write(self, table, row):
+        writer = self._writers.get(table)
+        if writer is None:
+            handle = self._files[table] = open(
+                os.path.join(self.directory, f"{table}.csv"), 'w', newline='')
+            writer = self._writers[table] = csv.DictWriter(handle, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        self.counts[table] = self.counts.get(table, 0) + 1
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        for handle in self._files.values():
+            handle.close()
+
+
+class DatabaseSink:
+    """Batched executemany inserts straight into the app's tables."""
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        from catalog import bump_version
+        from models import db
+
+        self.db = db
+        self.bump_catalog_version = bump_version
+        self.batch_size = batch_size
+        self._pending = {}
+        self.counts = {}
+
+    def write(self, table, row):
+        if table == 'sneakers':
+            row = dict(row, retail_price=float(row['retail_price'].strip('$')))
+        batch = self._pending.setdefault(table, [])
+        batch.append(row)
+        self.counts[table] = self.counts.get(table, 0) + 1
+        if len(batch) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table):
+        batch = self._pending.pop(table, None)
+        if batch:
+            with self.db.engine.begin() as connection:
+                connection.execute(self.db.metadata.tables[table].insert(), batch)
+                if table == 'sneakers':
+                    self.bump_catalog_version(connection)
+
+    def checkpoint(self):
+        """Flush everything pending, e.g. parent rows before their children."""
+
+        for table in list(self._pending):
+            self.flush(table)
+
+    def close(self):
+        self.checkpoint()
+        if self.db.engine.dialect.name == 'postgresql':
+            self.reset_sequences()
+
+    def reset_sequences(self):
+        """Move each loaded table's id sequence past the ids written to it.
+
+        Rows are inserted with explicit ids, which PostgreSQL sequences don't
+        see; without this the app's next insert reuses id 1. (SQLite takes
+        the next id from max(id), so needs nothing.)
+        """
+
+        from sqlalchemy import text
+
+        with self.db.engine.begin() as connection:
+            for table in self.counts:
+                if 'id' in self.db.metadata.tables[table].c:
+                    connection.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"(SELECT max(id) FROM {table}))"))
+
+
+def generate(generator, sink, password_hash):
+    """Write every table to `sink`, parents first."""
+
+    for row in generator.sneaker_rows():
+        sink.write('sneakers', row)
+    for row in generator.user_rows(password_hash):
+        sink.write('users', row)
+    sink.checkpoint()
+
+    for table, row in generator.activity_rows():
+        sink.write(table, row)
+    sink.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sneakers', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--follows-per-user', type=int, default=20,
+                        help="typical follows per user (power-law tail above it)")
+    parser.add_argument('--closet-per-user', type=int, default=15)
+    parser.add_argument('--wishlist-per-user', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--out', help="directory for CSV output")
+    target.add_argument('--load', action='store_true',
+                        help="insert into DATABASE_URL instead of writing CSVs")
+    args = parser.parse_args()
+
+    generator = DatasetGenerator(args.sneakers, args.users, seed=args.seed,
+                                 follows_per_user=args.follows_per_user,
+                                 closet_per_user=args.closet_per_user,
+                                 wishlist_per_user=args.wishlist_per_user)
+
+    password_hash = hash_password(PASSWORD, args.seed)
+
+    started = time.perf_counter()
+    if args.load:
+        from app import create_app
+        from models import db
+        app = create_app()
+
+        with app.app_context():
+            db.create_all()
+            sink = DatabaseSink()
+            generate(generator, sink, password_hash)
+    else:
+        sink = CSVSink(args.out)
+        generate(generator, sink, password_hash)
+
+    elapsed = time.perf_counter() - started
+    total = sum(sink.counts.values())
+    for table, count in sink.counts.items():
+        print(f"{table:>14}: {count:,}")
+    print(f"{total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s); "
+          f"every user's password is {PASSWORD!r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""gunicorn settings: load and warm the app once in the master, then fork.
+
+Workers inherit the compiled templates, catalog snapshot, search index
+and follow graph copy-on-write instead of each building their own, and
+start serving as soon as they are forked.
+
+Notification streams (/notifications/stream) hold a request thread for as
+long as they are open. With the default threaded workers each worker
+allows at most half its threads to be streams (PUSH_MAX_STREAMS, unless
+set), so page loads always have threads left and extra streams get a 503
+and retry later. With WEB_WORKER_CLASS=gevent (needs the gevent package)
+a stream costs a greenlet, not a thread, and the cap stays at its
+default.
+"""
+
+import os
+
+wsgi_app = 'wsgi:app'
+preload_app = True
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+
+if worker_class in ('gevent', 'eventlet'):
+    worker_connections = int(os.environ.get('WEB_CONNECTIONS', 1000))
+else:
+    threads = int(os.environ.get('WEB_THREADS', 8))
+    # Read by the app (config.ENVIRONMENT), which preload_app loads after this.
+    os.environ.setdefault('PUSH_MAX_STREAMS', str(max(threads // 2, 1)))
+
+
+def post_fork(server, worker):
+    from app import after_fork
+    from wsgi import app
+
+    after_fork(app)
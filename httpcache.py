@@ -0,0 +1,159 @@
+"""HTTP caching headers.
+
+- Static files: ``url_for('static', ...)`` adds a content-hash ``v`` query
+  parameter, and requests carrying the current hash are served as
+  ``public, max-age=<1 year>, immutable``. Changing a file changes its URL.
+- Catalog pages: anonymous GETs of views wrapped in `anonymous_validators`
+  get an ETag from the catalog version and the build (BUILD_ID, else a
+  hash of the templates and static files) and a Last-Modified from the
+  catalog version, and a 304 without rendering when the client's copy is
+  current.
+- Everything else: ``private, no-cache`` for logged-in users (browsers may
+  keep a copy, shared caches may not), ``no-cache`` otherwise.
+"""
+
+import functools
+import hashlib
+import os
+
+from flask import current_app, g, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+import catalog
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+_fingerprints = {}  # filename -> (mtime_ns, digest)
+_build_id = None
+
+
+def fingerprint(filename):
+    """Short content hash of a file under static/, or None if it's missing."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _fingerprints[filename] = (mtime, digest)
+    return digest
+
+
+def build_id():
+    """What deployed code the pages come from: BUILD_ID if set, else a hash
+    of every template and static file, computed once per process."""
+
+    global _build_id
+    if _build_id is None:
+        configured = current_app.config['BUILD_ID']
+        if configured:
+            _build_id = configured
+        else:
+            digest = hashlib.sha256()
+            env = current_app.jinja_env
+            for name in sorted(env.list_templates()):
+                source, _, _ = env.loader.get_source(env, name)
+                digest.update(f"{name}\0{source}\0".encode())
+            for folder, folders, files in os.walk(current_app.static_folder):
+                folders.sort()
+                for name in sorted(files):
+                    filename = os.path.relpath(os.path.join(folder, name),
+                                               current_app.static_folder)
+                    digest.update(f"{filename}\0{fingerprint(filename)}\0".encode())
+            _build_id = digest.hexdigest()[:12]
+    return _build_id
+
+
+def _fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = fingerprint(values['filename'])
+        if digest:
+            values['v'] = digest
+
+
+##############################################################################
+# Conditional requests for catalog pages
+
+def is_cacheable():
+    """Is this request's page the same for everyone?
+
+    True for anonymous GETs with no flash messages waiting to be shown.
+    """
+
+    return (g.user is None
+            and request.method in ('GET', 'HEAD')
+            and '_flashes' not in session)
+
+
+def anonymous_validators(extra=None):
+    """Decorate a catalog view with validators for anonymous requests.
+
+    The ETag is the catalog version and the build, plus whatever
+    `extra(**view_args)` returns for data the page depends on beyond the
+    catalog itself. The build is in it so a deploy that changes the page
+    markup doesn't leave clients revalidating old pages as current.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            if not is_cacheable():
+                return view(**view_args)
+
+            version, updated_at = catalog.version()
+            parts = [version, build_id(), *(extra(**view_args) if extra else ())]
+            etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=updated_at):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**view_args))
+
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                response.last_modified = updated_at
+                response.cache_control.public = True
+                response.cache_control.no_cache = True
+                response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+##############################################################################
+# Cache-Control for every response
+
+def _cache_headers(response):
+    if request.endpoint == 'static':
+        filename = (request.view_args or {}).get('filename')
+        if filename and request.args.get('v') == fingerprint(filename):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    if 'Cache-Control' in response.headers:
+        return response
+
+    if g.get('user'):
+        response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def init_app(app):
+    """Fingerprint static URLs and set Cache-Control on every response."""
+
+    app.config.setdefault('BUILD_ID', None)
+    app.url_defaults(_fingerprint_static_urls)
+    app.after_request(_cache_headers)
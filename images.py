@@ -0,0 +1,398 @@
+"""Sneaker image proxy: `/img/<sneaker_id>/<size>` thumbnails.
+
+Catalog images are large third-party originals. Templates ask for a named
+size instead:
+
+    <img src="{{ sneaker_image_url(sneaker, 'card') }}"
+         srcset="{{ sneaker_image_srcset(sneaker, 'card') }}">
+
+The URL carries ``v``, a hash of the sneaker's source image URL. Each
+original is fetched from the origin once, resized to the size's bounding
+box, and stored as WebP in a disk cache keyed by that hash (so sneakers
+sharing an image share files). A request carrying a ``v`` whose file is
+already cached is served straight from disk without touching the
+database, as ``public, max-age=<1 year>, immutable``: a new source image
+means a new ``v`` and a new URL.
+
+The cache is bounded by IMAGE_CACHE_MAX_BYTES; when it grows past that the
+least recently used files are removed down to 90%. Originals come from
+IMAGE_ORIGIN: unset fetches the catalog URLs over HTTP; a directory path
+serves ``<sneaker_id>.<ext>`` files from it instead (for tests and
+offline use). Resizing needs Pillow.
+
+Fill the cache ahead of traffic with:
+
+    python images.py warm [--sizes thumb,card] [--concurrency 8]
+    python images.py stats
+"""
+
+import argparse
+import glob
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, current_app, redirect, request, send_file, url_for
+
+import catalog
+from models import db, Sneaker
+
+# Bounding boxes (width, height); thumbnails keep the original's aspect
+# ratio and are never upscaled.
+SIZES = {
+    'thumb': (192, 128),
+    'card': (384, 256),
+    'large': (768, 512),
+    'xlarge': (1152, 768),
+}
+
+# Which size serves as the 2x variant of each size in a srcset.
+RETINA = {'thumb': 'card', 'card': 'large', 'large': 'xlarge'}
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_FETCH_TIMEOUT = 10
+MAX_ORIGINAL_BYTES = 20 * 1024 * 1024
+QUALITY = 80
+MAX_AGE = 365 * 24 * 60 * 60
+
+_VERSION = re.compile(r'^[0-9a-f]{16}$')
+
+
+def version(source):
+    """Cache key for a source image URL."""
+
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+##############################################################################
+# Origins
+
+class HttpOrigin:
+    """Fetches the sneaker's own image URL; /static/ paths read from disk."""
+
+    def __init__(self, timeout=DEFAULT_FETCH_TIMEOUT):
+        self.timeout = timeout
+
+    def fetch(self, sneaker_id, source):
+        if source.startswith('/static/'):
+            path = os.path.join(current_app.static_folder, source[len('/static/'):])
+            with open(path, 'rb') as f:
+                return f.read()
+
+        if not source.startswith(('http://', 'https://')):
+            raise ValueError(f"can't fetch image {source!r}")
+        fetch = urllib.request.Request(source, headers={'User-Agent': 'sneaker-closet/1.0'})
+        with urllib.request.urlopen(fetch, timeout=self.timeout) as response:
+            data = response.read(MAX_ORIGINAL_BYTES + 1)
+        if len(data) > MAX_ORIGINAL_BYTES:
+            raise ValueError(f"image {source!r} is larger than {MAX_ORIGINAL_BYTES} bytes")
+        return data
+
+
+class DirectoryOrigin:
+    """Reads originals from `<path>/<sneaker_id>.<ext>`."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, sneaker_id, source):
+        matches = sorted(glob.glob(os.path.join(self.path, f"{sneaker_id}.*")))
+        if not matches:
+            raise FileNotFoundError(f"no image for sneaker {sneaker_id} in {self.path}")
+        with open(matches[0], 'rb') as f:
+            return f.read()
+
+
+##############################################################################
+# Disk cache
+
+class DiskCache:
+    """Files under `root`, evicted least recently used first once their
+    total size passes `max_bytes`. Hits refresh the file's mtime."""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def get(self, name):
+        """Path of a cached file, or None."""
+
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def read(self, name):
+        path = self.get(name)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def put(self, name, data):
+        """Store `data` atomically; returns its path."""
+
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan()[1]
+            else:
+                self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+        return path
+
+    def _scan(self):
+        files = []
+        total = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return files, total
+
+    def evict(self, target=0.9):
+        """Remove least recently used files until under `target` of the limit.
+
+        Re-reads sizes from disk, so other processes' writes are counted.
+        """
+
+        with self._lock:
+            files, total = self._scan()
+            removed = 0
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes * target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self._bytes = total
+            return removed
+
+    def stats(self):
+        files, total = self._scan()
+        return {'files': len(files), 'bytes': total, 'max_bytes': self.max_bytes}
+
+
+##############################################################################
+# Thumbnails
+
+origin = HttpOrigin()
+cache = None
+
+# Striped so memory doesn't grow with the number of images.
+_locks = [threading.Lock() for _ in range(64)]
+
+
+def _key_lock(key):
+    return _locks[int(key[:4], 16) % len(_locks)]
+
+
+def resize(data, size):
+    """`data` scaled down to fit `size`, as WebP bytes."""
+
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("The image proxy needs the Pillow package installed")
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(SIZES[size], Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=QUALITY, method=4)
+    return out.getvalue()
+
+
+def thumbnail(sneaker_id, source, size):
+    """Path of the cached `size` thumbnail of `source`, creating it (and
+    fetching the original) if needed."""
+
+    key = version(source)
+    name = f"{key}-{size}.webp"
+    path = cache.get(name)
+    if path:
+        return path
+
+    # One fetch / resize per image at a time in this process.
+    with _key_lock(key):
+        path = cache.get(name)
+        if path:
+            return path
+        original = cache.read(f"{key}-original")
+        if original is None:
+            original = origin.fetch(sneaker_id, source)
+            cache.put(f"{key}-original", original)
+        return cache.put(name, resize(original, size))
+
+
+def sneaker_image_url(sneaker, size='card'):
+    """Versioned proxy URL for a sneaker's image (template global)."""
+
+    return url_for('sneaker_image', sneaker_id=sneaker.id, size=size,
+                   v=version(sneaker.sneaker_image or ''))
+
+
+def sneaker_image_srcset(sneaker, size='card'):
+    """``srcset`` with the 1x and 2x variants of `size` (template global)."""
+
+    srcset = f"{sneaker_image_url(sneaker, size)} 1x"
+    if size in RETINA:
+        srcset += f", {sneaker_image_url(sneaker, RETINA[size])} 2x"
+    return srcset
+
+
+def _serve(path):
+    # The file name is content-addressed, unlike the mtime an LRU hit bumps.
+    response = send_file(path, mimetype='image/webp', conditional=True,
+                         etag=os.path.basename(path))
+    del response.headers['Last-Modified']
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def serve(sneaker_id, size):
+    """The `/img/<sneaker_id>/<size>` view."""
+
+    if size not in SIZES:
+        return "Unknown image size", 404
+
+    # The fast path: a versioned URL whose file is cached needs no database.
+    requested = request.args.get('v', '')
+    if _VERSION.match(requested):
+        path = cache.get(f"{requested}-{size}.webp")
+        if path:
+            return _serve(path)
+
+    sneaker = catalog.snapshot().get(sneaker_id)
+    if sneaker is None:
+        abort(404)
+    source = sneaker.sneaker_image or ''
+    if requested != version(source):
+        return redirect(sneaker_image_url(sneaker, size))
+
+    try:
+        path = thumbnail(sneaker.id, source, size)
+    except Exception:
+        current_app.logger.exception("image proxy failed for sneaker %s", sneaker.id)
+        # Fall back to the original rather than a broken image.
+        response = redirect(source or url_for('static', filename='images/default-pic.png'))
+        response.cache_control.no_store = True
+        return response
+    return _serve(path)
+
+
+##############################################################################
+# Pre-warming
+
+def warm(sizes=tuple(SIZES), concurrency=8, batch_size=1000, progress=None):
+    """Make sure every catalog image has its `sizes` cached, walking the
+    catalog in id order. Returns (sneakers, failures)."""
+
+    app = current_app._get_current_object()
+
+    def one(sneaker_id, source):
+        with app.app_context():
+            for size in sizes:
+                thumbnail(sneaker_id, source, size)
+
+    images = failures = 0
+    last_id = 0
+    with ThreadPoolExecutor(concurrency) as executor:
+        while True:
+            rows = db.session.execute(
+                db.select(Sneaker.id, Sneaker.sneaker_image)
+                .where(Sneaker.id > last_id).order_by(Sneaker.id).limit(batch_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            # Sneakers sharing an image find it cached after the first.
+            batch = [(sneaker_id, source) for sneaker_id, source in rows if source]
+            for future in [executor.submit(one, *row) for row in batch]:
+                try:
+                    future.result()
+                except Exception as exc:
+                    failures += 1
+                    current_app.logger.warning("warming failed: %s", exc)
+            images += len(batch)
+            if progress:
+                progress(images, failures)
+    return images, failures
+
+
+def init_app(app):
+    """Read image proxy settings from `app.config` and add the route."""
+
+    global origin, cache
+    root = app.config.setdefault('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'image-cache'))
+    max_bytes = app.config.setdefault('IMAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    source = app.config.setdefault('IMAGE_ORIGIN', None)
+    timeout = app.config.setdefault('IMAGE_FETCH_TIMEOUT', DEFAULT_FETCH_TIMEOUT)
+
+    origin = DirectoryOrigin(source) if source else HttpOrigin(timeout)
+    cache = DiskCache(root, max_bytes)
+
+    app.add_url_rule('/img/<int:sneaker_id>/<size>', 'sneaker_image', serve)
+    app.add_template_global(sneaker_image_url)
+    app.add_template_global(sneaker_image_srcset)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the sneaker image cache.")
+    parser.add_argument('command', choices=['warm', 'stats'])
+    parser.add_argument('--sizes', default=','.join(SIZES),
+                        help="comma separated sizes to warm (default: all)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    from app import create_app
+    import images
+    app = create_app()
+
+    with app.app_context():
+        if args.command == 'stats':
+            print(images.cache.stats())
+        else:
+            sizes = [size for size in args.sizes.split(',') if size]
+            unknown = set(sizes) - set(SIZES)
+            if unknown:
+                parser.error(f"unknown sizes: {', '.join(sorted(unknown))}")
+            started = time.perf_counter()
+            count, failed = images.warm(
+                sizes, args.concurrency,
+                progress=lambda done, failed: print(f"\r{done} sneakers, {failed} failed",
+                                                    end='', flush=True))
+            print(f"\nWarmed images for {count} sneakers ({failed} failed) in "
+                  f"{time.perf_counter() - started:.1f}s")
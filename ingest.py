@@ -0,0 +1,225 @@
+"""Streaming, idempotent sneaker catalog ingest.
+
+Reads catalog CSVs row by row, cleans and validates each row, and upserts
+them in batches keyed on ``url``. Existing sneakers are updated in place,
+so their ids (and any Closet / Wishlist rows pointing at them) survive a
+re-run. On PostgreSQL each batch is COPY'd into a temporary staging table
+and merged with INSERT ... ON CONFLICT; elsewhere it is an executemany of
+the same upsert.
+
+    python ingest.py generator/sneakers.csv --batch-size 5000
+"""
+
+import argparse
+import csv
+import io
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+import catalog
+from models import db, Sneaker
+
+DEFAULT_BATCH_SIZE = 1000
+COLUMNS = ('sneaker_name', 'brand', 'sneaker_image', 'retail_price', 'url')
+UPDATE_COLUMNS = ('sneaker_name', 'brand', 'sneaker_image', 'retail_price')
+
+# Older generator output calls the image column "images".
+COLUMN_ALIASES = {'images': 'sneaker_image'}
+
+NAME_LENGTH = Sneaker.__table__.c.sneaker_name.type.length
+BRAND_LENGTH = Sneaker.__table__.c.brand.type.length
+
+
+class RowError(ValueError):
+    """A catalog row that can't be ingested."""
+
+
+class IngestReport:
+    """Counts, timing and rejected rows for one ingest run."""
+
+    MAX_REJECTS_KEPT = 100
+
+    def __init__(self):
+        self.read = 0
+        self.upserted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.rejects = []
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def reject(self, source, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < self.MAX_REJECTS_KEPT:
+            self.rejects.append((source, line, reason))
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.upserted / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.read} rows read, {self.upserted} upserted in {self.batches} batches, "
+                f"{self.rejected} rejected; {self.elapsed:.2f}s "
+                f"({self.rows_per_second:,.0f} rows/s)")
+
+
+def clean_price(price):
+    """Convert price string to a float after removing '$'."""
+    return float(price.replace('$', '').replace(',', '')) if price else None
+
+
+def clean_row(row):
+    """Normalize one CSV row into Sneaker column values, or raise RowError."""
+
+    row = {COLUMN_ALIASES.get(key, key): (value or '').strip()
+           for key, value in row.items() if key}
+
+    name, brand, url = row.get('sneaker_name'), row.get('brand'), row.get('url')
+    if not name:
+        raise RowError("missing sneaker_name")
+    if len(name) > NAME_LENGTH:
+        raise RowError(f"sneaker_name longer than {NAME_LENGTH} characters")
+    if not brand:
+        raise RowError("missing brand")
+    if len(brand) > BRAND_LENGTH:
+        raise RowError(f"brand longer than {BRAND_LENGTH} characters")
+    if not url or not url.startswith(('http://', 'https://')):
+        raise RowError("missing or invalid url")
+
+    try:
+        price = clean_price(row.get('retail_price'))
+    except ValueError:
+        raise RowError(f"unparseable retail_price {row.get('retail_price')!r}")
+    if price is not None and price < 0:
+        raise RowError("negative retail_price")
+
+    return {
+        'sneaker_name': name,
+        'brand': brand,
+        'sneaker_image': row.get('sneaker_image') or Sneaker.sneaker_image.default.arg,
+        'retail_price': price,
+        'url': url,
+    }
+
+
+def read_rows(path, report):
+    """Yield cleaned rows from the CSV at `path`, recording rejects."""
+
+    with open(path, newline='') as source:
+        reader = csv.DictReader(source)
+        for row in reader:
+            report.read += 1
+            try:
+                yield clean_row(row)
+            except RowError as e:
+                report.reject(path, reader.line_num, str(e))
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+##############################################################################
+# Upserts
+
+def ensure_url_index(connection):
+    """Upserts key on url, which needs a unique index to conflict on."""
+
+    for index in Sneaker.__table__.indexes:
+        if index.name == 'ix_sneakers_url':
+            index.create(connection, checkfirst=True)
+
+
+def upsert_executemany(connection, batch):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(Sneaker.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['url'],
+        set_={column: stmt.excluded[column] for column in UPDATE_COLUMNS})
+    connection.execute(stmt, batch)
+
+
+def upsert_copy(connection, batch):
+    """COPY the batch into a staging table, then merge it into sneakers."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([row[column] for column in COLUMNS])
+    buffer.seek(0)
+
+    columns = ', '.join(COLUMNS)
+    connection.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS sneakers_staging "
+        "(LIKE sneakers INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"))
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY sneakers_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in UPDATE_COLUMNS)
+    connection.execute(text(
+        f"INSERT INTO sneakers ({columns}) "
+        f"SELECT DISTINCT ON (url) {columns} FROM sneakers_staging "
+        f"ORDER BY url "
+        f"ON CONFLICT (url) DO UPDATE SET {updates}"))
+
+
+def ingest(paths, batch_size=DEFAULT_BATCH_SIZE, report=None):
+    """Stream `paths` into the sneakers table; returns an IngestReport.
+
+    Each batch commits on its own, so an interrupted run keeps its progress
+    and can simply be re-run.
+    """
+
+    report = report or IngestReport()
+    engine = db.engine
+    upsert = upsert_copy if engine.dialect.name == 'postgresql' else upsert_executemany
+
+    with engine.begin() as connection:
+        ensure_url_index(connection)
+
+    for path in paths:
+        for batch in batches(read_rows(path, report), batch_size):
+            with engine.begin() as connection:
+                upsert(connection, batch)
+                catalog.bump_version(connection)
+            report.upserted += len(batch)
+            report.batches += 1
+
+    report.finished = time.perf_counter()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingest sneaker catalog CSVs.")
+    parser.add_argument('paths', nargs='*', default=['generator/sneakers.csv'])
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        report = ingest(args.paths, args.batch_size)
+
+    for source, line, reason in report.rejects:
+        print(f"rejected {source}:{line}: {reason}", file=sys.stderr)
+    print(report)
@@ -0,0 +1,244 @@
+"""Lightweight per-request instrumentation, cheap enough to leave on.
+
+For every request this records the SQL query count and time (from engine
+events), template render time (from Flask's template signals) and any
+statement repeated often enough to look like an N+1. Each response gets a
+``Server-Timing`` header and one structured log line on the
+``sneaker_closet.requests`` logger, and the numbers feed rolling per-route
+latency histograms that `/admin/metrics` reports.
+
+Queries made while a streamed template renders happen after the response
+headers are sent, so they aren't counted.
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from flask import before_render_template, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+DEFAULT_WINDOW = 600
+SLICES = 10
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open ended.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+logger = logging.getLogger('sneaker_closet.requests')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one request spent, filled in by the hooks below."""
+
+    __slots__ = ('started', 'queries', 'db_time', 'template_time', 'template_started',
+                 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_started = []
+        self.statements = Counter()
+
+    def repeated(self, threshold):
+        """Statements run at least `threshold` times: likely N+1 patterns."""
+
+        return [(statement, count) for statement, count in self.statements.items()
+                if count >= threshold]
+
+
+##############################################################################
+# Rolling per-route histograms
+
+class RouteStats:
+    """Latency histogram and totals for one route within one time slice."""
+
+    __slots__ = ('buckets', 'requests', 'total_ms', 'queries', 'db_ms', 'n_plus_one')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.requests = 0
+        self.total_ms = 0.0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.n_plus_one = 0
+
+    def merge(self, other):
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.requests += other.requests
+        self.total_ms += other.total_ms
+        self.queries += other.queries
+        self.db_ms += other.db_ms
+        self.n_plus_one += other.n_plus_one
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the `fraction` percentile."""
+
+        rank = fraction * self.requests
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None  # beyond the largest bucket
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'mean_ms': round(self.total_ms / self.requests, 2),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'queries_per_request': round(self.queries / self.requests, 2),
+            'db_ms_per_request': round(self.db_ms / self.requests, 2),
+            'n_plus_one_requests': self.n_plus_one,
+            'histogram': [[f"<={bound}ms" if bound != 'slower' else bound, count]
+                          for bound, count in zip(BUCKETS + ('slower',), self.buckets)],
+        }
+
+
+class RouteHistograms:
+    """Per-route stats over a rolling window, kept as SLICES time slices.
+
+    Recording touches only the current slice; old slices are dropped as the
+    window moves on, so memory stays at routes x SLICES.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.slice_length = window / SLICES
+        self.slices = {}  # slice number -> {route: RouteStats}
+        self.lock = threading.Lock()
+
+    def record(self, route, elapsed_ms, metrics, n_plus_one):
+        number = int(time.time() // self.slice_length)
+        with self.lock:
+            routes = self.slices.get(number)
+            if routes is None:
+                routes = self.slices[number] = {}
+                for old in [old for old in self.slices if old <= number - SLICES]:
+                    del self.slices[old]
+            stats = routes.get(route)
+            if stats is None:
+                stats = routes[route] = RouteStats()
+            stats.buckets[bisect.bisect_left(BUCKETS, elapsed_ms)] += 1
+            stats.requests += 1
+            stats.total_ms += elapsed_ms
+            stats.queries += metrics.queries
+            stats.db_ms += metrics.db_time * 1000
+            stats.n_plus_one += bool(n_plus_one)
+
+    def summary(self):
+        """{route: summary} over the current window, busiest route first."""
+
+        oldest = int(time.time() // self.slice_length) - SLICES + 1
+        totals = {}
+        with self.lock:
+            for number, routes in self.slices.items():
+                if number < oldest:
+                    continue
+                for route, stats in routes.items():
+                    totals.setdefault(route, RouteStats()).merge(stats)
+
+        return {route: stats.summary() for route, stats in
+                sorted(totals.items(), key=lambda item: -item[1].requests)}
+
+
+histograms = RouteHistograms()
+
+
+##############################################################################
+# Hooks
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current.get()
+    if metrics is None or not conn.info.get('query_started'):
+        return
+    metrics.db_time += time.perf_counter() - conn.info['query_started'].pop()
+    metrics.queries += 1
+    metrics.statements[statement] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.template_started.append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    metrics = _current.get()
+    if metrics is not None and metrics.template_started:
+        metrics.template_time += time.perf_counter() - metrics.template_started.pop()
+
+
+def _start_request():
+    _current.set(RequestMetrics())
+
+
+def _finish_request(response, app):
+    metrics = _current.get()
+    if metrics is None:
+        return response
+    _current.set(None)
+
+    elapsed_ms = (time.perf_counter() - metrics.started) * 1000
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    n_plus_one = metrics.repeated(app.config['N_PLUS_ONE_THRESHOLD'])
+
+    histograms.record(f"{request.method} {route}", elapsed_ms, metrics, n_plus_one)
+
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = (
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+            f'tpl;dur={metrics.template_time * 1000:.1f}, '
+            f'total;dur={elapsed_ms:.1f}')
+
+    if n_plus_one:
+        logger.warning(json.dumps({
+            'event': 'n_plus_one', 'method': request.method, 'route': route,
+            'statements': [{'count': count, 'sql': statement}
+                           for statement, count in n_plus_one],
+        }))
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            'event': 'request', 'method': request.method, 'route': route,
+            'status': response.status_code, 'duration_ms': round(elapsed_ms, 2),
+            'queries': metrics.queries, 'db_ms': round(metrics.db_time * 1000, 2),
+            'template_ms': round(metrics.template_time * 1000, 2),
+        }))
+    return response
+
+
+def init_app(app):
+    """Read instrumentation settings from `app.config` and install the hooks."""
+
+    global histograms
+    app.config.setdefault('INSTRUMENTATION', True)
+    app.config.setdefault('SERVER_TIMING', True)
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+    app.config.setdefault('METRICS_WINDOW', DEFAULT_WINDOW)
+    app.config.setdefault('METRICS_ADMINS', frozenset())
+    if not app.config['INSTRUMENTATION']:
+        return
+
+    histograms = RouteHistograms(app.config['METRICS_WINDOW'])
+    app.before_request(_start_request)
+    app.after_request(lambda response: _finish_request(response, app))
+    app.teardown_request(lambda exc: _current.set(None))
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
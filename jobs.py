@@ -0,0 +1,382 @@
+"""Background jobs: side effects that don't need to finish before the
+response does.
+
+Tasks are registered by name with the `task` decorator, and route
+handlers `enqueue` them:
+
+    jobs.enqueue('notifications.fan_out', {'notification_id': 7},
+                 key='fan-out:7')
+
+and `enqueue_many` queues one task for a batch of payloads in one INSERT.
+
+The job is a row in the ``jobs`` table, inserted in the caller's
+transaction: it runs only if the request commits, and a crash after the
+commit can't lose it. A job with an idempotency `key` is enqueued at most
+once while its row is kept (see `purge`).
+
+Workers claim due jobs with one atomic UPDATE, run each task in its own
+transaction, and on failure retry it with exponential backoff (with
+jitter) until `max_attempts`; after that the job is left 'dead' for
+inspection and `retry_dead`. A job whose worker died is reclaimed once
+its lease (JOBS_LEASE) runs out, so tasks must be safe to run twice.
+
+Workers are JOBS_WORKERS threads in each web process, started on the first
+request, or separate processes:
+
+    python jobs.py work [--concurrency 4]
+    python jobs.py stats
+    python jobs.py retry-dead
+    python jobs.py purge [--days 7]
+    python jobs.py migrate     # create the jobs table on an existing database
+
+With JOBS_EAGER set, `enqueue` runs the task right away in the caller's
+transaction, which is what tests want.
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Job
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 2
+DEFAULT_MAX_BACKOFF = 10 * 60
+DEFAULT_LEASE = 5 * 60
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_RETENTION = timedelta(days=7)
+
+logger = logging.getLogger('sneaker_closet.jobs')
+
+_tasks = {}  # name -> (function, max_attempts)
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register a function as the task `name`.
+
+    Its keyword arguments come from the job payload, so they must be JSON
+    serializable. It runs inside a transaction the worker commits; it
+    shouldn't commit itself.
+    """
+
+    def decorator(function):
+        _tasks[name] = (function, max_attempts)
+        return function
+    return decorator
+
+
+##############################################################################
+# After-commit callbacks
+
+def on_commit(callback):
+    """Call `callback` once the current transaction commits.
+
+    For things outside the database (pushes, caches) that mustn't happen
+    if the transaction rolls back.
+    """
+
+    db.session.info.setdefault('jobs_on_commit', []).append(callback)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _run_on_commit(session):
+    for callback in session.info.pop('jobs_on_commit', ()):
+        try:
+            callback()
+        except Exception:
+            logger.exception("after-commit callback failed")
+    if session.info.pop('jobs_enqueued', False) and pool is not None:
+        pool.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_on_commit(session):
+    session.info.pop('jobs_on_commit', None)
+    session.info.pop('jobs_enqueued', None)
+
+
+##############################################################################
+# Enqueueing
+
+def _insert(connection):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(Job).on_conflict_do_nothing(index_elements=['idempotency_key'])
+
+
+def _row(name, payload, key, delay, now):
+    row = {'name': name, 'payload': payload, 'idempotency_key': key,
+           'max_attempts': _tasks[name][1], 'created_at': now,
+           'run_at': now + timedelta(seconds=delay) if delay else now}
+    if current_app.config['JOBS_EAGER']:
+        row.update(status=Job.DONE, attempts=1, finished_at=now)
+    return row
+
+
+def enqueue(name, payload=None, key=None, delay=None):
+    """Queue task `name` in the caller's transaction.
+
+    Returns False if a job with the same idempotency `key` already exists.
+    """
+
+    function, _ = _tasks[name]
+    payload = payload or {}
+    row = _row(name, payload, key, delay, datetime.utcnow())
+
+    connection = db.session.connection()
+    if not connection.execute(_insert(connection), row).rowcount:
+        return False
+
+    if current_app.config['JOBS_EAGER']:
+        function(**payload)
+    else:
+        db.session.info['jobs_enqueued'] = True
+    return True
+
+
+def enqueue_many(name, payloads, delay=None):
+    """Queue task `name` once per payload, with a single INSERT.
+
+    For fan-outs like refreshing every sneaker a request touched. The jobs
+    have no idempotency keys; returns how many were queued.
+    """
+
+    function, _ = _tasks[name]
+    now = datetime.utcnow()
+    payloads = list(payloads)
+    if not payloads:
+        return 0
+
+    db.session.execute(Job.__table__.insert().values(
+        [_row(name, payload, None, delay, now) for payload in payloads]))
+
+    if current_app.config['JOBS_EAGER']:
+        for payload in payloads:
+            function(**payload)
+    else:
+        db.session.info['jobs_enqueued'] = True
+    return len(payloads)
+
+
+##############################################################################
+# Running
+
+def backoff(attempts, base=DEFAULT_BACKOFF, cap=DEFAULT_MAX_BACKOFF):
+    """Seconds to wait before retry number `attempts`: exponential, capped,
+    with full jitter so failed jobs don't retry in lockstep."""
+
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+def claim(lease=DEFAULT_LEASE):
+    """Atomically take the oldest due job; returns its row or None."""
+
+    now = datetime.utcnow()
+    claimable = or_(and_(Job.status == Job.QUEUED, Job.run_at <= now),
+                    and_(Job.status == Job.RUNNING, Job.locked_until < now))
+    candidate = select(Job.id).where(claimable).order_by(Job.run_at).limit(1)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        candidate = candidate.with_for_update(skip_locked=True)
+
+    row = db.session.execute(
+        update(Job)
+        .where(Job.id == candidate.scalar_subquery(), claimable)
+        .values(status=Job.RUNNING, attempts=Job.attempts + 1,
+                locked_until=now + timedelta(seconds=lease))
+        .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)).first()
+    db.session.commit()
+    return row
+
+
+def _finish(job, **values):
+    # Guard on attempts: if our lease ran out and another worker reclaimed
+    # the job, its outcome is the one that counts.
+    db.session.execute(
+        update(Job).where(Job.id == job.id, Job.attempts == job.attempts)
+        .values(locked_until=None, **values)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def run(job):
+    """Run a claimed job and record the outcome.
+
+    A successful task commits together with its job being marked done.
+    """
+
+    config = current_app.config
+    try:
+        function, _ = _tasks[job.name]
+        function(**job.payload)
+        _finish(job, status=Job.DONE, finished_at=datetime.utcnow())
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error("job %s (%s) is dead after %s attempts:\n%s",
+                         job.id, job.name, job.attempts, error)
+            _finish(job, status=Job.DEAD, last_error=error, finished_at=datetime.utcnow())
+        else:
+            delay = backoff(job.attempts, config['JOBS_BACKOFF'], config['JOBS_MAX_BACKOFF'])
+            logger.warning("job %s (%s) failed, retrying in %.0fs", job.id, job.name, delay)
+            _finish(job, status=Job.QUEUED, last_error=error,
+                    run_at=datetime.utcnow() + timedelta(seconds=delay))
+        return False
+    return True
+
+
+def work_once():
+    """Claim and run one job; False if none was due."""
+
+    job = claim(current_app.config['JOBS_LEASE'])
+    if job is None:
+        return False
+    run(job)
+    return True
+
+
+class WorkerPool:
+    """`concurrency` threads claiming and running jobs until stopped."""
+
+    def __init__(self, app, concurrency=DEFAULT_WORKERS, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, name=f"jobs-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        """Jobs were enqueued; check now instead of at the next poll."""
+
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    found = work_once()
+            except Exception:
+                logger.exception("job worker error")
+                found = False
+            if not found:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+pool = None
+
+
+def _start_pool(app):
+    global pool
+    if pool is None:
+        pool = WorkerPool(app, app.config['JOBS_WORKERS'], app.config['JOBS_POLL_INTERVAL'])
+        pool.start()
+
+
+##############################################################################
+# Maintenance
+
+def stats():
+    """Job counts by status, and how overdue the oldest due job is."""
+
+    counts = dict(db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+    oldest = db.session.scalar(select(func.min(Job.run_at)).where(Job.status == Job.QUEUED,
+                                                                  Job.run_at <= datetime.utcnow()))
+    return {'counts': counts,
+            'oldest_due_seconds': (datetime.utcnow() - oldest).total_seconds() if oldest else 0}
+
+
+def retry_dead():
+    """Requeue every dead job with a fresh set of attempts."""
+
+    retried = db.session.execute(
+        update(Job).where(Job.status == Job.DEAD)
+        .values(status=Job.QUEUED, attempts=0, run_at=datetime.utcnow(), finished_at=None)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return retried
+
+
+def purge(older_than=DEFAULT_RETENTION):
+    """Delete finished jobs (and with them their idempotency keys)."""
+
+    purged = db.session.execute(
+        delete(Job).where(Job.status == Job.DONE, Job.finished_at < datetime.utcnow() - older_than)
+        .execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return purged
+
+
+def init_app(app):
+    """Read job settings from `app.config`; start in-process workers on the
+    first request (after any fork) unless JOBS_EAGER is set or JOBS_WORKERS is 0."""
+
+    app.config.setdefault('JOBS_EAGER', False)
+    app.config.setdefault('JOBS_WORKERS', DEFAULT_WORKERS)
+    app.config.setdefault('JOBS_BACKOFF', DEFAULT_BACKOFF)
+    app.config.setdefault('JOBS_MAX_BACKOFF', DEFAULT_MAX_BACKOFF)
+    app.config.setdefault('JOBS_LEASE', DEFAULT_LEASE)
+    app.config.setdefault('JOBS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+
+    @app.before_request
+    def _start_workers():
+        if pool is None and not app.config['JOBS_EAGER'] and app.config['JOBS_WORKERS'] > 0:
+            _start_pool(app)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run and maintain background jobs.")
+    parser.add_argument('command', choices=['work', 'stats', 'retry-dead', 'purge', 'migrate'])
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--days', type=int, default=DEFAULT_RETENTION.days)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Tasks register themselves with the imported `jobs` module, not this
+    # __main__ copy, so work through that.
+    from app import create_app
+    import jobs
+    app = create_app()
+
+    with app.app_context():
+        if args.command == 'work':
+            workers = jobs.WorkerPool(app, args.concurrency, app.config['JOBS_POLL_INTERVAL'])
+            workers.start()
+            print(f"Running {args.concurrency} job workers; Ctrl-C to stop.")
+            try:
+                while True:
+                    time.sleep(60)
+            except KeyboardInterrupt:
+                workers.stop(timeout=30)
+        elif args.command == 'stats':
+            print(jobs.stats())
+        elif args.command == 'retry-dead':
+            print(f"Requeued {jobs.retry_dead()} dead jobs.")
+        elif args.command == 'purge':
+            print(f"Purged {jobs.purge(timedelta(days=args.days))} finished jobs.")
+        else:
+            Job.__table__.create(db.engine, checkfirst=True)
+            print("Jobs table ready.")
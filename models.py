@@ -1,9 +1,12 @@
+import enum
 from datetime import datetime
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import passwords
+from database import RoutingSession
+
+# Reads can go to a replica; see database.py.
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
@@ -22,6 +25,11 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key covers "who follows X"; this covers "who X follows".
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -75,6 +83,13 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Set when the account is deleted; its rows are purged in the
+    # background (see accounts.py) and the user row goes last.
+    deleted_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
     """Relationships"""
 
     sneakers_in_closet = db.relationship(
@@ -111,14 +126,12 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.get(Follows, (self.id, other_user.id)) is not None
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.get(Follows, (other_user.id, self.id)) is not None
 
 
 
@@ -126,10 +139,11 @@ class User(db.Model):
     def signup(cls, username, first_name, last_name, email, password, image_url):
         """Sign up user.
 
-        Hashes password and adds user to system.
+        Hashes password (in the hashing pool; may raise passwords.Busy) and
+        adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -154,13 +168,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made with an outdated cost is replaced, for the caller to
+        commit. Raises passwords.Busy if the hashing pool is saturated.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -186,6 +205,11 @@ class Sneaker(db.Model):
 
     # Other sneaker-specific details can be added as needed
 
+    # Catalog ingest upserts on url.
+    __table_args__ = (
+        db.Index('ix_sneakers_url', 'url', unique=True),
+    )
+
 
 class Closet(db.Model):
     """Sneaker Closet associated with a user."""
@@ -199,6 +223,11 @@ class Closet(db.Model):
 
     user = db.relationship('User', back_populates='sneakers_in_closet')
     sneaker = db.relationship('Sneaker', lazy=True)
+
+    # A sneaker is in a closet at most once; also serves per-user lookups.
+    __table_args__ = (
+        db.Index('ix_closet_user_id_sneaker_id', 'user_id', 'sneaker_id', unique=True),
+    )
     
 
 class Wishlist(db.Model):
@@ -213,20 +242,184 @@ class Wishlist(db.Model):
     user = db.relationship('User', back_populates='sneakers_in_wishlist')
     sneaker = db.relationship('Sneaker', lazy=True)
 
+    __table_args__ = (
+        db.Index('ix_wishlist_user_id_sneaker_id', 'user_id', 'sneaker_id', unique=True),
+    )
+
+
+class SneakerRecommendation(db.Model):
+    """Precomputed "collectors who own this also want..." similarity."""
+
+    __tablename__ = 'sneaker_recommendations'
+
+    sneaker_id = db.Column(db.Integer, db.ForeignKey('sneakers.id', ondelete="cascade"), primary_key=True)
+    recommended_id = db.Column(db.Integer, db.ForeignKey('sneakers.id', ondelete="cascade"), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    recommended = db.relationship('Sneaker', foreign_keys=[recommended_id], lazy=True)
+
+
+class CatalogVersion(db.Model):
+    """Single-row counter bumped whenever the sneaker catalog changes.
+
+    HTTP validators (ETag / Last-Modified) for catalog pages derive from it,
+    so every worker agrees on when cached copies go stale.
+    """
+
+    __tablename__ = 'catalog_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class EventType(enum.IntEnum):
+    """What a notification records; stored as a small integer."""
+
+    FOLLOW = 1
+    CLOSET_ADD = 2
+    WISHLIST_ADD = 3
+    COLLECTION_ADD = 4  # one bulk import into both closet and wishlist
+
 
 class Notification(db.Model):
+    """One activity event; its message is rendered when it is read.
+
+    `user_id` is the actor, whose followers' feeds sneaker events fan out
+    to; `target_id` is the user a follow is about. Compaction folds bursts
+    of adds into one event with a `count`.
+    """
+
     __tablename__ = 'notifications'
 
     id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.SmallInteger, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    message = db.Column(db.String, nullable=False)
-    sneaker_image = db.Column(db.String, nullable=True)  # Add this line for the image URL
+    target_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     sneaker_id = db.Column(db.Integer, db.ForeignKey('sneakers.id'), nullable=True)
+    count = db.Column(db.Integer, nullable=False, default=1)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    user = db.relationship('User', backref=db.backref('notifications', order_by='Notification.timestamp.desc()'))
 
+    actor = db.relationship('User', foreign_keys=[user_id],
+                            backref=db.backref('notifications', order_by='Notification.timestamp.desc()'))
+    target = db.relationship('User', foreign_keys=[target_id])
+    sneaker = db.relationship('Sneaker', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_notifications_user_id_timestamp', 'user_id', 'timestamp'),
+        # Retention purges by age.
+        db.Index('ix_notifications_timestamp', 'timestamp'),
+        # Account deletion finds the follows about a user.
+        db.Index('ix_notifications_target_id', 'target_id'),
+    )
+
+    ADDED_TO = {
+        EventType.CLOSET_ADD: 'Closet',
+        EventType.WISHLIST_ADD: 'Wishlist',
+        EventType.COLLECTION_ADD: 'their collection',
+    }
+
+    @property
+    def message(self):
+        """Render the notification text from the event."""
+
+        actor = f"@{self.actor.username}"
+        if self.event_type == EventType.FOLLOW:
+            return f"{actor} followed you"
+
+        if self.count == 1 and self.sneaker:
+            sneakers = self.sneaker.sneaker_name
+        else:
+            sneakers = f"{self.count} sneakers"
+        return f"{actor} added {sneakers} to {self.ADDED_TO[self.event_type]}"
+
+    @property
+    def sneaker_image(self):
+        return self.sneaker.sneaker_image if self.sneaker else None
+
+
+class FeedEntry(db.Model):
+    """A notification delivered to one user's feed inbox (fan-out-on-write)."""
+
+    __tablename__ = 'feed_entries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete="cascade"), nullable=False)
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete="cascade"), nullable=False)
+
+    notification = db.relationship('Notification', lazy=True)
+
+    # Every feed read is "newest entries for this inbox", so (user_id, id)
+    # serves both the page query and cursor seeks.
+    __table_args__ = (
+        db.Index('ix_feed_entries_user_id_id', 'user_id', 'id'),
+        # A notification reaches each inbox once, even if its fan-out job
+        # runs twice; deleting notifications finds their copies by it too.
+        db.Index('uq_feed_entries_notification_id_user_id', 'notification_id', 'user_id',
+                 unique=True),
+    )
+
+
+class FeedCursor(db.Model):
+    """How far into their feed inbox a user has read.
+
+    Entries with an id above `seen_id` are unread.
+    """
+
+    __tablename__ = 'feed_cursors'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete="cascade"), primary_key=True)
+    seen_id = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    """A queued background job (see jobs.py).
+
+    Jobs that run out of attempts stay behind as 'dead' for inspection
+    and retry.
+    """
+
+    __tablename__ = 'jobs'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    DEAD = 'dead'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    idempotency_key = db.Column(db.String(200), unique=True)
+    status = db.Column(db.String(10), nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    # Workers claim the oldest due job in a status.
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+class AccountDeletion(db.Model):
+    """Progress purging a deleted account (see accounts.py).
+
+    Kept after the user row is gone, so no foreign key.
+    """
+
+    __tablename__ = 'account_deletions'
 
+    user_id = db.Column(db.Integer, primary_key=True)
+    requested_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    step = db.Column(db.String(20))
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    passes = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
 
 
 def connect_db(app):
@@ -0,0 +1,77 @@
+"""Which sneakers the logged-in user has in their closet / wishlist.
+
+Templates ask this for every sneaker card; answering from the ORM
+relationships means scanning the user's Closet / Wishlist rows per card.
+Instead each set of sneaker ids is loaded with one query, at most once per
+request, and membership checks are O(1).
+"""
+
+from functools import cached_property
+
+from flask import g
+
+from models import db, Closet, Wishlist
+
+
+class OwnershipIndex:
+    """Sneaker-id sets for one user, loaded on first use."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    @cached_property
+    def closet_ids(self):
+        return frozenset(db.session.scalars(
+            db.select(Closet.sneaker_id).where(Closet.user_id == self.user_id)))
+
+    @cached_property
+    def wishlist_ids(self):
+        return frozenset(db.session.scalars(
+            db.select(Wishlist.sneaker_id).where(Wishlist.user_id == self.user_id)))
+
+    def owns(self, sneaker_id):
+        """Is this sneaker in the user's closet?"""
+
+        return sneaker_id in self.closet_ids
+
+    def wants(self, sneaker_id):
+        """Is this sneaker on the user's wishlist?"""
+
+        return sneaker_id in self.wishlist_ids
+
+
+class _Anonymous:
+    def owns(self, sneaker_id):
+        return False
+
+    def wants(self, sneaker_id):
+        return False
+
+
+ANONYMOUS = _Anonymous()
+
+
+def current():
+    """The ownership index for `g.user`, built once per request."""
+
+    if not getattr(g, 'user', None):
+        return ANONYMOUS
+
+    index = g.get('ownership')
+    if index is None or index.user_id != g.user.id:
+        index = g.ownership = OwnershipIndex(g.user.id)
+    return index
+
+
+def invalidate():
+    """Forget the current request's sets after a closet/wishlist change."""
+
+    g.pop('ownership', None)
+
+
+def init_app(app):
+    """Expose `ownership` to templates."""
+
+    @app.context_processor
+    def inject_ownership():
+        return {'ownership': current()}
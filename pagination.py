@@ -0,0 +1,60 @@
+"""Keyset (seek) pagination for ORM queries."""
+
+
+class KeysetPage:
+    """One page of `query` ordered by the unique, indexed column `key`.
+
+    `after` / `before` are key values from a previous page's `next_cursor` /
+    `prev_cursor`, so every page is an index seek however deep it is.
+    `key_of` reads the key from a result row (its `id` by default).
+
+    Forward pages are fetched lazily while being iterated, so a streamed
+    template can send the first rows before the last one is read; the
+    cursors are only final once iteration has finished.
+    """
+
+    def __init__(self, query, key, after=None, before=None, limit=50,
+                 key_of=lambda row: row.id):
+        self.query = query
+        self.key = key
+        self.key_of = key_of
+        self.after = after
+        self.before = before
+        self.limit = limit
+        self.next_cursor = None
+        self.prev_cursor = None
+
+    def __iter__(self):
+        if self.before is not None:
+            return iter(self._backward())
+        return self._forward()
+
+    def _forward(self):
+        query = self.query.order_by(self.key.asc())
+        if self.after is not None:
+            query = query.filter(self.key > self.after)
+
+        last_key = None
+        for count, row in enumerate(query.limit(self.limit + 1).yield_per(self.limit)):
+            if count == self.limit:
+                self.next_cursor = last_key
+                break
+            if count == 0 and self.after is not None:
+                self.prev_cursor = self.key_of(row)
+            last_key = self.key_of(row)
+            yield row
+
+    def _backward(self):
+        rows = (self.query
+                .filter(self.key < self.before)
+                .order_by(self.key.desc())
+                .limit(self.limit + 1)
+                .all())
+
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self.prev_cursor = self.key_of(rows[-1])
+        rows.reverse()
+        if rows:
+            self.next_cursor = self.key_of(rows[-1])
+        return rows
@@ -0,0 +1,186 @@
+"""Password hashing and verification in a bounded worker pool.
+
+bcrypt is deliberately slow, so a burst of logins (a release drop) could
+otherwise tie up every request thread hashing. Instead hashing runs on
+PASSWORD_WORKERS threads (bcrypt releases the GIL, so they use real
+cores), with at most PASSWORD_MAX_QUEUE calls waiting behind them. Past
+that, or after waiting PASSWORD_WAIT_TIMEOUT seconds, callers get `Busy`
+at once and the route answers 503 instead of piling on.
+
+The cost factor is PASSWORD_BCRYPT_ROUNDS. Pick it with
+
+    python passwords.py calibrate [--target-ms 250]
+
+Stored hashes with a lower cost are rehashed when their owner next
+logs in (see `User.authenticate`).
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+# More hashing threads than cores only adds latency.
+DEFAULT_WORKERS = os.cpu_count() or 2
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_WAIT_TIMEOUT = 5
+
+# bcrypt only looks at the first 72 bytes; older bcrypt releases dropped
+# the rest silently and newer ones refuse, so truncate to keep old hashes
+# verifying.
+MAX_PASSWORD_BYTES = 72
+
+
+class Busy(Exception):
+    """The hashing pool is saturated; try again shortly."""
+
+
+def _encode(password):
+    return password.encode('UTF-8')[:MAX_PASSWORD_BYTES]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    try:
+        return bcrypt.checkpw(_encode(password), hashed.encode('UTF-8'))
+    except ValueError:  # not a bcrypt hash
+        return False
+
+
+def cost(hashed):
+    """The cost factor a bcrypt hash was made with."""
+
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """`workers` hashing threads, admitting at most `max_queue` waiting
+    calls and waiting at most `timeout` seconds for a result."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=DEFAULT_WORKERS,
+                 max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_WAIT_TIMEOUT):
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='passwords')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Busy()
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            result = future.result(self.timeout)
+        except TimeoutError:
+            # If it hasn't started, don't spend a core on an answer nobody
+            # is waiting for.
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise Busy()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, hashed, password):
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        return cost(hashed) < self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {'rounds': self.rounds, 'completed': self.completed,
+                    'rejected': self.rejected, 'timed_out': self.timed_out}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hasher = PasswordHasher()
+
+
+def hash_password(password):
+    """A bcrypt hash of `password` at the configured cost. Raises Busy."""
+
+    return hasher.hash(password)
+
+
+def check_password(hashed, password):
+    """Does `password` match `hashed`? Raises Busy."""
+
+    return hasher.verify(hashed, password)
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a lower cost than the configured one?
+
+    Higher-cost hashes are kept as they are: lowering the setting must not
+    weaken stored passwords.
+    """
+
+    return hasher.needs_rehash(hashed)
+
+
+def stats():
+    return hasher.stats()
+
+
+def calibrate(target_ms, samples=3, rounds=range(10, 16)):
+    """(rounds, ms) for each cost, timed on this machine, and the highest
+    cost whose hash takes at most `target_ms`."""
+
+    timings = []
+    for candidate in rounds:
+        start = time.perf_counter()
+        for _ in range(samples):
+            _hash('calibration password', candidate)
+        timings.append((candidate, (time.perf_counter() - start) * 1000 / samples))
+    fitting = [candidate for candidate, ms in timings if ms <= target_ms]
+    return timings, max(fitting) if fitting else min(rounds)
+
+
+def init_app(app):
+    """Read password settings from `app.config` and set up the pool."""
+
+    global hasher
+    rounds = app.config.setdefault('PASSWORD_BCRYPT_ROUNDS', DEFAULT_ROUNDS)
+    workers = app.config.setdefault('PASSWORD_WORKERS', DEFAULT_WORKERS)
+    max_queue = app.config.setdefault('PASSWORD_MAX_QUEUE', DEFAULT_MAX_QUEUE)
+    timeout = app.config.setdefault('PASSWORD_WAIT_TIMEOUT', DEFAULT_WAIT_TIMEOUT)
+    hasher.shutdown()
+    hasher = PasswordHasher(rounds, workers, max_queue, timeout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pick a bcrypt cost for this machine.")
+    parser.add_argument('command', choices=['calibrate'])
+    parser.add_argument('--target-ms', type=float, default=250,
+                        help="longest acceptable time for one hash")
+    args = parser.parse_args()
+
+    timings, best = calibrate(args.target_ms)
+    for candidate, ms in timings:
+        print(f"rounds={candidate:<3} {ms:8.1f} ms")
+    print(f"PASSWORD_BCRYPT_ROUNDS={best}")
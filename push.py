@@ -0,0 +1,208 @@
+"""Live notification push over Server-Sent Events.
+
+Browsers keep ``/notifications/stream`` open; routes that create
+notifications call `publish` after committing, and every open stream of a
+recipient gets the event. Events are small JSON objects:
+
+    {"type": "notification", "message": "...", ...}   one new unread entry
+    {"type": "unread", "count": 3}                    the absolute count
+
+Each stream starts with an ``unread`` event, so a reconnecting client
+always resyncs. Streams are fed from memory only: the unread count is read
+before the response starts and the request's DB session is released, so an
+open stream never holds a database connection.
+
+Backpressure: each stream buffers at most PUSH_QUEUE_SIZE events. A client
+that falls that far behind is disconnected and resyncs when EventSource
+reconnects. Streams also close after PUSH_STREAM_TIMEOUT so worker threads
+get recycled, and past PUSH_MAX_STREAMS per process new streams get a 503.
+Each open stream holds a request thread, so under threaded workers keep
+PUSH_MAX_STREAMS below the thread count (gunicorn.conf.py does).
+
+The in-process broker only reaches streams in the publishing process.
+Setting PUSH_BROKER_URL (``redis://...``, needs the redis package) relays
+events through Redis so every worker sees them.
+"""
+
+import json
+import queue
+import threading
+
+from flask import current_app, g
+
+import feed
+
+DEFAULT_HEARTBEAT = 15
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_MAX_STREAMS = 200
+DEFAULT_STREAM_TIMEOUT = 5 * 60
+RETRY_MS = 5000
+
+_OVERFLOW = object()
+
+
+class Subscription:
+    """One open stream's bounded event buffer."""
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Too far behind: leave the stream a marker to close on.
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next event, None after `timeout` seconds of quiet, or _OVERFLOW."""
+
+        if self.overflowed:
+            return _OVERFLOW
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return _OVERFLOW if self.overflowed else None
+
+
+class LocalBroker:
+    """In-process pub/sub: user id -> that user's open subscriptions."""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_ids, event):
+        self.deliver(user_ids, event)
+
+    def deliver(self, user_ids, event):
+        """Hand `event` to the local subscriptions of `user_ids`."""
+
+        with self._lock:
+            targets = [subscription for user_id in user_ids
+                       for subscription in self._subscriptions.get(user_id, ())]
+        for subscription in targets:
+            subscription.put(event)
+
+    def stream_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class RedisBroker(LocalBroker):
+    """Relays events through one Redis channel so every worker delivers
+    them to its own subscriptions."""
+
+    def __init__(self, url, queue_size=DEFAULT_QUEUE_SIZE, channel='push'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("PUSH_BROKER_URL needs the redis package installed")
+        super().__init__(queue_size)
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._listener = None
+
+    def subscribe(self, user_id):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, daemon=True)
+                    self._listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids, event):
+        self.client.publish(self.channel, json.dumps({'to': list(user_ids), 'event': event}))
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            data = json.loads(message['data'])
+            self.deliver(data['to'], data['event'])
+
+
+broker = LocalBroker()
+
+
+def publish(user_ids, event):
+    """Send `event` to the open streams of `user_ids`. Call after commit."""
+
+    if user_ids:
+        broker.publish(user_ids, event)
+
+
+def notification_event(notification):
+    return {'type': 'notification', 'message': notification.message,
+            'sneaker_id': notification.sneaker_id,
+            'timestamp': notification.timestamp.isoformat()}
+
+
+##############################################################################
+# Streaming
+
+def _format(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream(subscription, unread, heartbeat=DEFAULT_HEARTBEAT, timeout=DEFAULT_STREAM_TIMEOUT):
+    """SSE body for one subscription; unsubscribes when the client leaves,
+    falls behind or `timeout` seconds pass.
+
+    A generator's cleanup only runs once it has been started, so whoever
+    subscribes must also unsubscribe when the response is closed
+    (unsubscribing twice is harmless).
+    """
+
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        yield _format({'type': 'unread', 'count': unread})
+        for _ in range(max(1, int(timeout // heartbeat))):
+            event = subscription.get(heartbeat)
+            if event is _OVERFLOW:
+                return
+            # A comment line keeps proxies from timing out an idle stream.
+            yield ": heartbeat\n\n" if event is None else _format(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def unread_notifications():
+    """Unread count for the navbar badge (template global)."""
+
+    return feed.unread_count(g.user.id) if g.get('user') else 0
+
+
+def at_capacity():
+    return broker.stream_count() >= current_app.config['PUSH_MAX_STREAMS']
+
+
+def init_app(app):
+    """Read push settings from `app.config` and set up the broker."""
+
+    global broker
+    queue_size = app.config.setdefault('PUSH_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+    url = app.config.setdefault('PUSH_BROKER_URL', None)
+    app.config.setdefault('PUSH_HEARTBEAT', DEFAULT_HEARTBEAT)
+    app.config.setdefault('PUSH_MAX_STREAMS', DEFAULT_MAX_STREAMS)
+    app.config.setdefault('PUSH_STREAM_TIMEOUT', DEFAULT_STREAM_TIMEOUT)
+    broker = RedisBroker(url, queue_size) if url else LocalBroker(queue_size)
+
+    app.add_template_global(unread_notifications)
@@ -0,0 +1,173 @@
+"""Item-to-item sneaker recommendations from closet and wishlist co-occurrence.
+
+Every (user, sneaker) pair in a closet or wishlist is one interaction. Two
+sneakers are similar when the same collectors have both; the score is the
+cosine of their user vectors, co / sqrt(n_a * n_b). The top K neighbours of
+every sneaker are stored in ``sneaker_recommendations`` so ``/sneakers/<id>``
+only reads a handful of precomputed rows.
+
+Closet / wishlist changes recompute the touched sneaker's row with one
+aggregate query; the batch rebuild refreshes everything:
+
+    python recommendations.py rebuild [--k 20]
+"""
+
+import argparse
+import heapq
+import math
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from sqlalchemy import delete, func, insert, select, union
+
+import catalog
+from models import db, Closet, Wishlist, SneakerRecommendation
+
+DEFAULT_K = 20
+INSERT_BATCH_SIZE = 10_000
+
+
+def interactions():
+    """Distinct (user_id, sneaker_id) pairs from closets and wishlists."""
+
+    return union(select(Closet.user_id, Closet.sneaker_id),
+                 select(Wishlist.user_id, Wishlist.sneaker_id))
+
+
+##############################################################################
+# Batch computation
+
+def build_matrix(pairs):
+    """Sparse sneaker x user matrix, stored both ways as id -> array('i')."""
+
+    sneaker_users = defaultdict(set)
+    for user_id, sneaker_id in pairs:
+        sneaker_users[sneaker_id].add(user_id)
+
+    user_sneakers = defaultdict(lambda: array('i'))
+    for sneaker_id, users in sneaker_users.items():
+        for user_id in users:
+            user_sneakers[user_id].append(sneaker_id)
+
+    return ({sneaker_id: array('i', users) for sneaker_id, users in sneaker_users.items()},
+            dict(user_sneakers))
+
+
+def similar_sneakers(sneaker_users, user_sneakers, k=DEFAULT_K):
+    """Yield (sneaker_id, [(similar_id, score), ...]) for every sneaker.
+
+    Co-occurrence counts for one sneaker at a time come from adding up the
+    rows of its collectors (Counter.update over arrays runs in C), so memory
+    stays at one sparse row rather than the full item x item matrix.
+    """
+
+    for sneaker_id, users in sneaker_users.items():
+        co = Counter()
+        for user_id in users:
+            co.update(user_sneakers[user_id])
+        del co[sneaker_id]
+
+        norm = len(users)
+        yield sneaker_id, heapq.nlargest(
+            k,
+            ((other_id, count / math.sqrt(norm * len(sneaker_users[other_id])))
+             for other_id, count in co.items()),
+            key=lambda item: (item[1], -item[0]))
+
+
+def rebuild(k=DEFAULT_K):
+    """Recompute and store recommendations for the whole catalog."""
+
+    pairs = db.session.execute(interactions()).yield_per(50_000)
+    sneaker_users, user_sneakers = build_matrix(pairs)
+
+    db.session.execute(delete(SneakerRecommendation))
+    batch = []
+    written = 0
+    for sneaker_id, similar in similar_sneakers(sneaker_users, user_sneakers, k):
+        batch.extend({'sneaker_id': sneaker_id, 'recommended_id': other_id, 'score': score}
+                     for other_id, score in similar)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(insert(SneakerRecommendation), batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(SneakerRecommendation), batch)
+        written += len(batch)
+
+    db.session.commit()
+    return written
+
+
+##############################################################################
+# Incremental updates and reads
+
+def refresh_sneaker(sneaker_id, k=DEFAULT_K):
+    """Recompute one sneaker's stored neighbours after its collectors change.
+
+    Neighbours' own rows pick the change up on the next batch rebuild.
+    """
+
+    pairs = interactions().subquery()
+    mine = pairs.alias('mine')
+    theirs = pairs.alias('theirs')
+
+    co = (select(theirs.c.sneaker_id, func.count().label('co'))
+          .select_from(mine.join(theirs, mine.c.user_id == theirs.c.user_id))
+          .where(mine.c.sneaker_id == sneaker_id, theirs.c.sneaker_id != sneaker_id)
+          .group_by(theirs.c.sneaker_id)
+          .subquery())
+
+    norm = db.session.scalar(
+        select(func.count()).select_from(pairs).where(pairs.c.sneaker_id == sneaker_id))
+    # Collector counts only for the co-occurring sneakers, not the catalog.
+    rows = db.session.execute(
+        select(co.c.sneaker_id, co.c.co, func.count().label('users'))
+        .join(pairs, pairs.c.sneaker_id == co.c.sneaker_id)
+        .group_by(co.c.sneaker_id, co.c.co))
+
+    similar = heapq.nlargest(
+        k,
+        ((other_id, count / math.sqrt(norm * users)) for other_id, count, users in rows),
+        key=lambda item: (item[1], -item[0]))
+
+    db.session.execute(delete(SneakerRecommendation)
+                       .where(SneakerRecommendation.sneaker_id == sneaker_id))
+    if similar:
+        db.session.execute(insert(SneakerRecommendation), [
+            {'sneaker_id': sneaker_id, 'recommended_id': other_id, 'score': score}
+            for other_id, score in similar])
+
+
+def ids_for_sneaker(sneaker_id, limit=6):
+    """Ids of the stored recommendations for a sneaker, best first."""
+
+    return db.session.scalars(
+        select(SneakerRecommendation.recommended_id)
+        .where(SneakerRecommendation.sneaker_id == sneaker_id)
+        .order_by(SneakerRecommendation.score.desc(), SneakerRecommendation.recommended_id)
+        .limit(limit)).all()
+
+
+def for_sneaker(sneaker_id, limit=6):
+    """Stored recommendations for a sneaker, best first, from the catalog
+    snapshot."""
+
+    return catalog.snapshot().get_many(ids_for_sneaker(sneaker_id, limit))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild sneaker recommendations.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--k', type=int, default=DEFAULT_K,
+                        help="neighbours stored per sneaker")
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        started = time.perf_counter()
+        written = rebuild(args.k)
+        print(f"Stored {written} recommendations in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,272 @@
+"""Sneaker name/brand search.
+
+On PostgreSQL searches go through pg_trgm: a GIN trigram index over
+``sneaker_name || ' ' || brand`` serves both substring (ILIKE) and
+typo-tolerant (word similarity) queries. Everywhere else (SQLite in
+development and tests) an in-process trigram inverted index is kept
+instead, rebuilt whenever the catalog version changes.
+
+Both backends return sneaker ids ranked by relevance.
+"""
+
+import heapq
+import re
+import threading
+from array import array
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import DDL, event, func, literal, select
+
+import catalog
+from models import db, Sneaker
+
+DEFAULT_MAX_RESULTS = 1000
+DEFAULT_FUZZY_THRESHOLD = 0.5
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Lowercase `text` and split it into alphanumeric words."""
+
+    return _WORD_RE.findall(text.lower()) if text else []
+
+
+def word_trigrams(word):
+    """Trigrams of a single word, padded like pg_trgm ('  w', ' wo', ...)."""
+
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def inner_trigrams(word):
+    """Unpadded trigrams of `word`: what any string containing it must have."""
+
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+def document_trigrams(words):
+    trigrams = set()
+    for word in words:
+        trigrams |= word_trigrams(word)
+    return trigrams
+
+
+class TrigramIndex:
+    """In-process trigram inverted index over sneaker name + brand.
+
+    Postings are compact ``array('i')`` lists of sneaker ids per trigram.
+    An index is built once and then only read: catalog changes build a new
+    one (see `ensure_index`), so searches need no lock.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self._postings = {}
+        self._docs = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    @classmethod
+    def load(cls, version):
+        """An index of every sneaker in the database, as of `version`."""
+
+        index = cls(version)
+        index.build(db.session.execute(
+            select(Sneaker.id, Sneaker.sneaker_name, Sneaker.brand)))
+        return index
+
+    def add(self, sneaker_id, name, brand):
+        """Index one sneaker; ids are added once each, while building."""
+
+        words = normalize(name) + normalize(brand)
+        text = " ".join(words)
+        trigrams = document_trigrams(words)
+        self._docs[sneaker_id] = (text, len(trigrams))
+        for trigram in trigrams:
+            postings = self._postings.get(trigram)
+            if postings is None:
+                postings = self._postings[trigram] = array('i')
+            postings.append(sneaker_id)
+
+    def build(self, rows):
+        """Fill an empty index with `rows` of (id, name, brand)."""
+
+        for sneaker_id, name, brand in rows:
+            self.add(sneaker_id, name, brand)
+
+    def search(self, query, fuzzy=False, limit=DEFAULT_MAX_RESULTS,
+               threshold=DEFAULT_FUZZY_THRESHOLD):
+        """Return up to `limit` sneaker ids matching `query`, best first.
+
+        Exact mode requires every query word to appear as a substring of the
+        sneaker's name or brand. Fuzzy mode ranks by the share of the query's
+        trigrams found in the sneaker and keeps those above `threshold`, which
+        tolerates dropped or swapped letters ("jordn 4 oreo").
+        """
+
+        words = normalize(query)
+        if not words:
+            return []
+
+        if fuzzy:
+            return self._search_fuzzy(words, limit, threshold)
+        return self._search_exact(words, limit)
+
+    def _score(self, trigrams):
+        scores = Counter()
+        for trigram in trigrams:
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                scores.update(postings)
+        return scores
+
+    def _rank(self, scores, query_size, limit):
+        # Higher overlap first, then the tighter (shorter) document, then id.
+        docs = self._docs
+        return heapq.nsmallest(
+            limit, scores,
+            key=lambda sneaker_id: (-scores[sneaker_id] / query_size,
+                                    docs[sneaker_id][1], sneaker_id))
+
+    def _search_exact(self, words, limit):
+        # Seek on the rarest trigram any match must contain, then verify.
+        rarest = None
+        for word in words:
+            for trigram in inner_trigrams(word):
+                postings = self._postings.get(trigram)
+                if postings is None:
+                    return []
+                if rarest is None or len(postings) < len(rarest):
+                    rarest = postings
+
+        # Only one- and two-letter words leave nothing to seek on.
+        candidates = self._docs.keys() if rarest is None else rarest
+
+        docs = self._docs
+        matches = (sneaker_id for sneaker_id in candidates
+                   if all(word in docs[sneaker_id][0] for word in words))
+
+        # Every match contains the whole query, so the tightest (shortest)
+        # names rank first.
+        return heapq.nsmallest(
+            limit, matches, key=lambda sneaker_id: (docs[sneaker_id][1], sneaker_id))
+
+    def _search_fuzzy(self, words, limit, threshold):
+        query_trigrams = document_trigrams(words)
+        minimum = threshold * len(query_trigrams)
+        scores = self._score(query_trigrams)
+        scores = {sneaker_id: score for sneaker_id, score in scores.items()
+                  if score >= minimum}
+        return self._rank(scores, len(query_trigrams), limit)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def uses_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def ensure_index():
+    """This worker's index at the current catalog version.
+
+    The first call builds it. After that, a new catalog version is built
+    in a background thread and swapped in whole, while searches carry on
+    against the old index instead of waiting.
+    """
+
+    current, _ = catalog.version()
+    built = _index
+    if built is not None and built.version == current:
+        return built
+
+    if not _index_lock.acquire(blocking=built is None):
+        return built
+    if built is None:
+        _rebuild(None, current)
+        return _index
+
+    app = current_app._get_current_object()
+    threading.Thread(target=_rebuild, args=(app, current),
+                     name='search-index', daemon=True).start()
+    return built
+
+
+def _rebuild(app, version):
+    """Build the index for `version` and swap it in; releases the lock."""
+
+    global _index
+    try:
+        if app is None:
+            _index = TrigramIndex.load(version)
+        else:
+            with app.app_context():
+                _index = TrigramIndex.load(version)
+    finally:
+        _index_lock.release()
+
+
+def search_ids(query, fuzzy=False, limit=DEFAULT_MAX_RESULTS,
+               threshold=DEFAULT_FUZZY_THRESHOLD):
+    """Return ids of sneakers matching `query`, most relevant first."""
+
+    if uses_postgres():
+        return _search_postgres(query, fuzzy, limit, threshold)
+    return ensure_index().search(query, fuzzy=fuzzy, limit=limit, threshold=threshold)
+
+
+def search(query, limit=DEFAULT_MAX_RESULTS, threshold=DEFAULT_FUZZY_THRESHOLD):
+    """Exact search, falling back to typo-tolerant search on no results."""
+
+    ids = search_ids(query, limit=limit, threshold=threshold)
+    if not ids:
+        ids = search_ids(query, fuzzy=True, limit=limit, threshold=threshold)
+    return ids
+
+
+def _search_postgres(query, fuzzy, limit, threshold):
+    words = normalize(query)
+    if not words:
+        return []
+
+    document = Sneaker.sneaker_name + ' ' + Sneaker.brand
+    text = " ".join(words)
+    rank = func.word_similarity(text, document)
+
+    stmt = select(Sneaker.id)
+    if fuzzy:
+        stmt = stmt.where(rank >= threshold, literal(text).op('<%')(document))
+    else:
+        stmt = stmt.where(*[document.ilike(f"%{word}%") for word in words])
+
+    stmt = (stmt.order_by(rank.desc(), func.length(document), Sneaker.id)
+            .limit(limit))
+    return list(db.session.scalars(stmt))
+
+
+##############################################################################
+# PostgreSQL trigram index
+
+event.listen(
+    Sneaker.__table__,
+    'after_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'),
+)
+event.listen(
+    Sneaker.__table__,
+    'after_create',
+    DDL("CREATE INDEX IF NOT EXISTS ix_sneakers_search_trgm ON sneakers "
+        "USING gin ((sneaker_name || ' ' || brand) gin_trgm_ops)"
+        ).execute_if(dialect='postgresql'),
+)
+
+
+def init_app(app):
+    """Read search settings from `app.config`."""
+
+    app.config.setdefault('SEARCH_FUZZY_THRESHOLD', DEFAULT_FUZZY_THRESHOLD)
+    app.config.setdefault('SEARCH_MAX_RESULTS', DEFAULT_MAX_RESULTS)
@@ -1,30 +1,22 @@
-"""Seed database with sneaker data from CSV Files."""
+"""Seed database with sneaker data from CSV Files.
 
-from csv import DictReader
-from app import app, db
-from models import Sneaker
+Safe to re-run: sneakers are upserted by url (see ingest.py), so users'
+closets and wishlists are left alone.
+"""
 
-def clean_price(price):
-    """Convert price string to a float after removing '$'."""
-    return float(price.replace('$', '').replace(',', '')) if price else None
+import sys
+
+from app import create_app
+from ingest import ingest, clean_price  # noqa: F401 (clean_price used to live here)
+from models import db
+
+app = create_app()
 
 with app.app_context():
-    db.drop_all()
     db.create_all()
 
-    # Open the CSV file and read the data
-    with open('generator/sneakers.csv') as sneakers:
-        reader = DictReader(sneakers)
-        
-        # Clean data before inserting
-        data = []
-        for row in reader:
-            row['retail_price'] = clean_price(row['retail_price'])  # Clean price
-            print(f"Inserting: {row}")  # Log each row for debugging
-            data.append(row)
-        
-        # Insert data in bulk
-        db.session.bulk_insert_mappings(Sneaker, data)
+    report = ingest(['generator/sneakers.csv'])
 
-    db.session.commit()
-    print("Data has been successfully seeded!")
+    for source, line, reason in report.rejects:
+        print(f"Rejected {source}:{line}: {reason}", file=sys.stderr)
+    print(f"Data has been successfully seeded! {report}")
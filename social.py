@@ -0,0 +1,98 @@
+"""Following and unfollowing, follower / following listings and batched
+follow-state lookups."""
+
+from datetime import datetime
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+import follow_graph
+import jobs
+import usercache
+from models import db, EventType, Follows, Notification, User
+from pagination import KeysetPage
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def followed_ids(follower_id, user_ids):
+    """Return the subset of `user_ids` that `follower_id` follows.
+
+    One query against the follows primary key, however many users are on
+    the page.
+    """
+
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+
+    return set(db.session.scalars(
+        db.select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == follower_id,
+               Follows.user_being_followed_id.in_(user_ids))))
+
+
+def follow(follower_id, followed_id):
+    """Make `follower_id` follow `followed_id`, notifying them, in the
+    caller's transaction. Returns False if they already did."""
+
+    connection = db.session.connection()
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    inserted = connection.execute(
+        dialect.insert(Follows).on_conflict_do_nothing(
+            index_elements=['user_being_followed_id', 'user_following_id']),
+        {'user_being_followed_id': followed_id, 'user_following_id': follower_id}).rowcount
+    if not inserted:
+        return False
+
+    # Create a notification for the followed user only
+    notification = Notification(event_type=EventType.FOLLOW, user_id=follower_id,
+                                target_id=followed_id, timestamp=datetime.utcnow())
+    db.session.add(notification)
+    db.session.flush()
+    jobs.enqueue('notifications.deliver', {'notification_id': notification.id},
+                 key=f"deliver:{notification.id}")
+
+    def committed():
+        usercache.invalidate(follower_id, followed_id)
+        follow_graph.add_follow(follower_id, followed_id)
+    jobs.on_commit(committed)
+    return True
+
+
+def unfollow(follower_id, followed_id):
+    """Stop `follower_id` following `followed_id`; False if they didn't."""
+
+    deleted = db.session.execute(
+        delete(Follows).where(Follows.user_being_followed_id == followed_id,
+                              Follows.user_following_id == follower_id)).rowcount
+    if not deleted:
+        return False
+
+    def committed():
+        usercache.invalidate(follower_id, followed_id)
+        follow_graph.remove_follow(follower_id, followed_id)
+    jobs.on_commit(committed)
+    return True
+
+
+def followers_page(user_id, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """Keyset page of the users following `user_id`, by user id."""
+
+    query = (User.query
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id)
+             .filter(User.deleted_at.is_(None)))
+    return KeysetPage(query, Follows.user_following_id,
+                      after=after, before=before, limit=limit)
+
+
+def following_page(user_id, after=None, before=None, limit=DEFAULT_PAGE_SIZE):
+    """Keyset page of the users `user_id` follows, by user id."""
+
+    query = (User.query
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id)
+             .filter(User.deleted_at.is_(None)))
+    return KeysetPage(query, Follows.user_being_followed_id,
+                      after=after, before=before, limit=limit)
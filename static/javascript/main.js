@@ -8,3 +8,113 @@ document.getElementById("search-icon").addEventListener("click", function () {
     searchInput.focus();
   }
 });
+
+// Live unread-notification count, pushed over Server-Sent Events.
+const unreadBadge = document.getElementById("unread-badge");
+
+if (unreadBadge && window.EventSource) {
+  function showUnread(count) {
+    unreadBadge.textContent = count;
+    unreadBadge.hidden = count === 0;
+  }
+
+  function connect() {
+    const source = new EventSource(unreadBadge.dataset.stream);
+
+    source.addEventListener("unread", function (event) {
+      showUnread(JSON.parse(event.data).count);
+    });
+
+    source.addEventListener("notification", function () {
+      showUnread(Number(unreadBadge.textContent) + 1);
+    });
+
+    source.addEventListener("error", function () {
+      // EventSource retries dropped connections itself, but gives up on
+      // error responses (e.g. the server is at its stream limit).
+      if (source.readyState === EventSource.CLOSED) {
+        setTimeout(connect, 30000);
+      }
+    });
+  }
+
+  connect();
+}
+
+// Closet, wishlist, rotation and follow forms carry data-api="METHOD url"
+// (or "rotation" with a data-url); they go through the JSON API and the
+// page is updated in place. Without JS, or if the call fails, the form
+// posts as usual.
+function showRotation(rotation) {
+  document.querySelectorAll('form[data-api="rotation"]').forEach(function (form) {
+    const inRotation = rotation.includes(Number(form.dataset.sneakerId));
+    const button = form.querySelector("button");
+    form.dataset.inRotation = inRotation;
+    button.textContent = inRotation ? "Unlike" : "Rotation";
+    button.disabled =
+      !inRotation && rotation.length >= Number(form.dataset.rotationLimit);
+  });
+}
+
+function applyResult(form, result) {
+  const then = form.dataset.apiThen;
+
+  if (then === "remove-card") {
+    form.closest(".sneaker-card").remove();
+  } else if ("rotation" in result) {
+    showRotation(result.rotation);
+  } else if ("list" in result) {
+    form
+      .closest("[data-collection]")
+      .querySelectorAll("[data-list]")
+      .forEach(function (state) {
+        state.hidden = state.dataset.list !== (result.list || "");
+      });
+  } else if ("following" in result) {
+    form
+      .closest("[data-follow]")
+      .querySelectorAll("form")
+      .forEach(function (other) {
+        other.hidden = other === form;
+      });
+  }
+}
+
+document.addEventListener("submit", function (event) {
+  const form = event.target;
+  if (!form.dataset.api || !window.fetch) {
+    return;
+  }
+  event.preventDefault();
+
+  let method, url;
+  if (form.dataset.api === "rotation") {
+    method = form.dataset.inRotation === "true" ? "DELETE" : "PUT";
+    url = form.dataset.url;
+  } else {
+    [method, url] = form.dataset.api.split(" ");
+  }
+
+  const button = form.querySelector("button");
+  button.disabled = true;
+
+  fetch(url, {
+    method: method,
+    headers: { "X-Requested-With": "fetch", Accept: "application/json" },
+    credentials: "same-origin",
+  })
+    .then(function (response) {
+      // A full rotation is a 409 that still carries the rotation.
+      if (!response.ok && response.status !== 409) {
+        throw new Error(response.statusText);
+      }
+      return response.json();
+    })
+    .then(function (result) {
+      button.disabled = false;
+      applyResult(form, result);
+    })
+    .catch(function () {
+      form.submit();
+    });
+});
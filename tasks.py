@@ -0,0 +1,51 @@
+"""Background tasks run by jobs.py for the request handlers in app.py."""
+
+from flask import current_app
+
+import accounts
+import feed
+import jobs
+import push
+import recommendations
+from models import db, Notification
+
+
+@jobs.task('notifications.fan_out')
+def fan_out(notification_id):
+    """Deliver a sneaker notification to its author's followers and push it."""
+
+    notification = db.session.get(Notification, notification_id)
+    if notification is None:  # compacted or deleted since
+        return
+    recipients = feed.fan_out_to_followers(notification, current_app.config['FEED_INBOX_LIMIT'])
+    event = push.notification_event(notification)
+    jobs.on_commit(lambda: push.publish(recipients, event))
+
+
+@jobs.task('notifications.deliver')
+def deliver(notification_id):
+    """Deliver a follow notification to the followed user and push it."""
+
+    notification = db.session.get(Notification, notification_id)
+    if notification is None:
+        return
+    target_id = notification.target_id
+    feed.deliver(notification, target_id, current_app.config['FEED_INBOX_LIMIT'])
+    event = push.notification_event(notification)
+    jobs.on_commit(lambda: push.publish([target_id], event))
+
+
+@jobs.task('recommendations.refresh')
+def refresh_recommendations(sneaker_id):
+    """Recompute one sneaker's "also want" neighbours."""
+
+    recommendations.refresh_sneaker(sneaker_id, current_app.config['RECOMMENDATIONS_K'])
+
+
+@jobs.task('accounts.purge')
+def purge_account(user_id):
+    """One bounded pass of purging a deleted account's rows."""
+
+    config = current_app.config
+    accounts.purge_pass(user_id, config['ACCOUNT_PURGE_BATCH_SIZE'],
+                        config['ACCOUNT_PURGE_BATCHES'], config['ACCOUNT_PURGE_PAUSE'])
@@ -0,0 +1,145 @@
+"""Cached snapshots of logged-in users.
+
+`add_user_to_g` runs on every request. Rather than loading the full ORM
+User each time, it takes a small read-only UserSnapshot from a bounded,
+TTL'd LRU cache. Routes that change the user load the real User with
+`snapshot.load()`, and anything that changes what a snapshot holds calls
+`invalidate()`.
+
+The cache is per process; the TTL bounds how long another worker's
+changes can go unseen.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from models import db, User, Follows
+
+DEFAULT_MAX_SIZE = 10_000
+DEFAULT_TTL = 30
+
+
+class UserSnapshot:
+    """Read-only view of a user's profile fields."""
+
+    __slots__ = ('id', 'username', 'first_name', 'last_name', 'email', 'image_url')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot is read-only; use load() to change the user")
+
+    def __repr__(self):
+        return f"<UserSnapshot #{self.id}: {self.username}>"
+
+    @property
+    def full_name(self):
+        """Return full name of user."""
+
+        return f"{self.first_name} {self.last_name}"
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return db.session.get(Follows, (other_user.id, self.id)) is not None
+
+    def load(self):
+        """Load the full ORM User, for routes that modify it."""
+
+        return db.session.get(User, self.id)
+
+
+def fetch_snapshot(user_id):
+    """Build a UserSnapshot with a single query; None if the user is gone
+    or deleted."""
+
+    row = db.session.execute(
+        select(User.id, User.username, User.first_name, User.last_name,
+               User.email, User.image_url)
+        .where(User.id == user_id, User.deleted_at.is_(None))
+    ).one_or_none()
+
+    return UserSnapshot(**row._mapping) if row else None
+
+
+class UserCache:
+    """Bounded LRU of UserSnapshots with a time-to-live."""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Return the snapshot for `user_id`, fetching it on a miss."""
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        snapshot = fetch_snapshot(user_id)
+        if snapshot is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return snapshot
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit rate and DB round-trips saved (one user query per hit)."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'db_round_trips_saved': self.hits,
+            }
+
+
+cache = UserCache()
+
+
+def get(user_id):
+    return cache.get(user_id)
+
+
+def invalidate(*user_ids):
+    """Drop cached snapshots after a change to these users."""
+
+    cache.invalidate(*user_ids)
+
+
+def init_app(app):
+    """Size the cache from `app.config`."""
+
+    cache.max_size = app.config.setdefault('USER_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+    cache.ttl = app.config.setdefault('USER_CACHE_TTL', DEFAULT_TTL)
@@ -0,0 +1,732 @@
+"""The HTML pages: signup / login, the catalog, closets, wishlists and
+rotations, following, notifications and the admin metrics page.
+
+Registered on the app by `app.create_app`; endpoints are ``views.<name>``.
+"""
+
+from datetime import datetime
+
+from flask import (Blueprint, current_app, render_template, stream_template, request, flash,
+                   redirect, session, g, abort, jsonify)
+from sqlalchemy.exc import IntegrityError
+
+from forms import UserAddForm, UserEditForm, LoginForm
+from models import db, User, Sneaker, Closet, Wishlist, Notification, EventType
+import accounts
+import catalog
+import closets
+import database
+import feed
+import follow_graph
+import fragments
+import httpcache
+import instrumentation
+import jobs
+import ownership
+import passwords
+import push
+import recommendations
+import search as sneaker_search
+import social
+import usercache
+
+CURR_USER_KEY = "curr_user"
+
+views = Blueprint('views', __name__)
+
+
+##############################################################################
+# User signup/login/logout
+
+
+@views.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a cached read-only UserSnapshot; routes that modify the user
+    load the ORM User with g.user.load().
+    """
+
+    if CURR_USER_KEY in session:
+        g.user = usercache.get(session[CURR_USER_KEY])
+
+    else:
+        g.user = None
+
+
+def do_login(user):
+    """Log in user."""
+
+    session[CURR_USER_KEY] = user.id
+
+
+def busy(template, **context):
+    """Re-show a form when the password hashing pool is saturated."""
+
+    db.session.rollback()
+    flash("We're getting a lot of sign-ins right now. Please try again in a moment.", 'warning')
+    return render_template(template, **context), 503, {'Retry-After': '5'}
+
+
+def do_logout():
+    """Logout user."""
+
+    if CURR_USER_KEY in session:
+        del session[CURR_USER_KEY]
+
+
+@views.route('/signup', methods=["GET", "POST"])
+def signup():
+    """Handle user signup.
+
+    Create new user and add to DB. Redirect to home page.
+
+    If form not valid, present form.
+
+    If the there already is a user with that username: flash message
+    and re-present form.
+    """
+    if CURR_USER_KEY in session:
+        del session[CURR_USER_KEY]
+    form = UserAddForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.signup(
+                username=form.username.data,
+                first_name=form.first_name.data,
+                last_name=form.last_name.data,
+                password=form.password.data,
+                email=form.email.data,
+                image_url=form.image_url.data or User.image_url.default.arg,
+            )
+            db.session.commit()
+
+        except passwords.Busy:
+            return busy('users/signup.html', form=form)
+
+        except IntegrityError as e:
+            db.session.rollback()  # Roll back to keep the session clean
+            flash("Username or email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+
+        do_login(user)
+
+        """CHANGE THIS WHEN YOU HAVE ("/") FIGURED OUT"""
+        return redirect("/sneakers")
+
+    else:
+        return render_template('users/signup.html', form=form)
+    
+
+@views.route('/login', methods=["GET", "POST"])
+def login():
+    """Handle user login."""
+
+    form = LoginForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except passwords.Busy:
+            return busy('users/login.html', form=form)
+
+        if user:
+            # Saves a rehashed password, if authenticate upgraded it
+            db.session.commit()
+            do_login(user)
+            flash(f"Hello, {user.username}!", "success")
+            return redirect("/sneakers")
+
+        flash("Invalid credentials.", 'danger')
+
+    return render_template('users/login.html', form=form)
+
+
+@views.route('/logout')
+def logout():
+    """Handle logout of user."""
+
+    do_logout()
+
+    flash("You have successfully logged out.", 'success')
+    return redirect("/login")
+
+
+##############################################################################
+# General sneaker related routes:
+
+@views.route('/sneakers')
+@httpcache.anonymous_validators()
+def list_sneakers():
+    """Page with listing of sneakers.
+
+    Can take a 'q' param in querystring to search by that sneaker; results
+    are ranked by relevance, falling back to typo-tolerant matching when
+    nothing matches exactly.
+
+    Listings are keyset-paginated by sneaker id ('after' / 'before' cursors,
+    which are positions in the ranking for searches) with an optional
+    'limit' in the querystring. With 'stream=1' (or the
+    CATALOG_STREAM setting) the page is rendered in chunks as rows arrive.
+    """
+
+    search = request.args.get('q')
+
+    limit = catalog.page_size(request.args.get('limit', type=int),
+                              current_app.config['CATALOG_PAGE_SIZE'],
+                              current_app.config['CATALOG_MAX_PAGE_SIZE'])
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    if search:
+        ranked_ids = sneaker_search.search(search,
+                                           limit=current_app.config['SEARCH_MAX_RESULTS'],
+                                           threshold=current_app.config['SEARCH_FUZZY_THRESHOLD'])
+        page = catalog.RankedPage(ranked_ids, after=after, before=before, limit=limit)
+    else:
+        page = catalog.snapshot().page(after=after, before=before, limit=limit)
+
+    stream = request.args.get('stream', type=int)
+    if stream is None:
+        stream = current_app.config['CATALOG_STREAM']
+
+    render = stream_template if stream else render_template
+    return render('users/sneaker_index.html', sneakers=page, page=page, search=search)
+
+
+@views.route('/sneakers/<int:sneaker_id>')
+@httpcache.anonymous_validators(
+    lambda sneaker_id: recommendations.ids_for_sneaker(sneaker_id))
+def sneaker_show(sneaker_id):
+    """Show sneaker info page, with precomputed similar sneakers."""
+
+    sneaker = catalog.snapshot().get(sneaker_id)
+    if sneaker is None:
+        abort(404)
+    # # snagging messages in order from the database;
+    # # user.messages won't be in order by default
+    # messages = (Message
+    #             .query
+    #             .filter(Message.sneaker_id == sneaker_id)
+    #             .order_by(Message.timestamp.desc())
+    #             .limit(100)
+    #             .all())
+    # likes = [message.id for message in user.likes]
+    similar = recommendations.for_sneaker(sneaker.id)
+    return render_template('users/sneakers/show.html', sneaker=sneaker, recommendations=similar)
+
+
+@views.route('/users/<int:user_id>/rotation')
+def current_rotation(user_id):
+    """Show user's current rotation (top five favored sneakers)."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = accounts.get_active_or_404(user_id)
+    return render_template('users/sneakers/rotation.html', user=user,
+                           sneakers=rotation_sneakers(user.id))
+
+
+
+def rotation_sneakers(user_id):
+    """The sneakers in a user's rotation."""
+
+    return catalog.snapshot().get_many(closets.rotation_ids(user_id))
+
+
+@views.route('/sneakers/<int:sneaker_id>/rotation', methods=['POST'])
+def adding_sneaker_rotation(sneaker_id):
+    """Add or remove sneaker from current rotation (top five liked sneakers)."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    sneaker_entry = Closet.query.filter_by(user_id=g.user.id, sneaker_id=sneaker_id).first()
+    if not sneaker_entry:
+        flash("Sneaker not found in your closet.", "danger")
+        return redirect(f"/users/{g.user.id}/closet")
+
+    # Toggle like status, ensuring max of 5 sneakers are liked
+    if closets.set_rotation(g.user.id, sneaker_id, not sneaker_entry.is_liked) == 'full':
+        flash(f"You can only like up to {closets.ROTATION_LIMIT} sneakers.", "warning")
+
+    db.session.commit()
+
+    return render_template('users/sneakers/rotation.html', user=g.user,
+                           sneakers=rotation_sneakers(g.user.id))
+
+
+@views.route('/users/<int:user_id>/rotation/remove/<int:sneaker_id>', methods=['POST'])
+def remove_from_rotation(user_id, sneaker_id):
+    """Remove sneaker from user's rotation without leaving the page."""
+    
+    if not g.user or g.user.id != user_id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    
+    # Take it out of the rotation; a no-op if it wasn't there
+    closets.set_rotation(user_id, sneaker_id, False)
+    db.session.commit()
+    
+    return render_template('users/sneakers/rotation.html', user=g.user,
+                           sneakers=rotation_sneakers(user_id))
+
+
+@views.route('/users/<int:user_id>/closet')
+def show_closet(user_id):
+    """Show list of sneakers that the user owns."""
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    
+    user = accounts.get_active_or_404(user_id) 
+
+    # The user's Closet entries, with their sneakers from the catalog snapshot
+    entries = user.sneakers_in_closet
+    closet_sneakers = catalog.snapshot().get_many([entry.sneaker_id for entry in entries])
+    rotation_ids = {entry.sneaker_id for entry in entries if entry.is_liked}
+    
+    return render_template('users/sneakers/closet.html', sneakers=closet_sneakers, user=user,
+                           rotation_ids=rotation_ids, rotation_limit=closets.ROTATION_LIMIT)
+
+@views.route('/users/<int:user_id>/wishlist')
+def show_wishlist(user_id):
+    """Show list of sneakers on the user's wishlist."""
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    
+    user = accounts.get_active_or_404(user_id) 
+
+    # The user's Wishlist entries' sneakers, from the catalog snapshot
+    wishlist_sneakers = catalog.snapshot().get_many(
+        [entry.sneaker_id for entry in user.sneakers_in_wishlist])
+    
+    return render_template('users/sneakers/wishlist.html', sneakers=wishlist_sneakers, user=user)
+
+
+# Update closet route
+@views.route('/users/add_own/<int:closet_id>', methods=['POST'])
+def add_to_closet(closet_id):
+    """Add a sneaker to the user's closet if it's not already there, and remove it from the wishlist if present."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    
+    added_sneaker = Sneaker.query.get_or_404(closet_id)
+
+    # Add it to the Closet (moving it out of the Wishlist) and
+    # notify followers
+    if not closets.add_and_notify(g.user.id, added_sneaker.id, Closet):
+        db.session.rollback()
+        flash("Sneaker is already in your closet.", "info")
+        return redirect(f"/users/{g.user.id}/closet")
+
+    # Commit all changes to the database
+    db.session.commit()
+    
+    flash("Sneaker added to closet!", "success")
+    return redirect(f"/users/{g.user.id}/closet")
+
+# Remove from closet route
+@views.route('/users/remove_own/<int:closet_id>', methods=['POST'])
+def remove_from_closet(closet_id):
+    """Remove sneaker from user's closet."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if closets.remove_and_refresh(g.user.id, closet_id, Closet):
+        db.session.commit()
+
+    return redirect(f"/users/{g.user.id}/closet")
+
+# Update wishlist route
+@views.route('/users/add_wishlist/<int:wishlist_id>', methods=['POST'])
+def add_to_wishlist(wishlist_id):
+    """Add a sneaker to the user's wishlist if it's not already there, and remove it from the closet if present."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+    
+    added_sneaker = Sneaker.query.get_or_404(wishlist_id)
+
+    # Add it to the Wishlist (moving it out of the Closet) and
+    # notify followers
+    if not closets.add_and_notify(g.user.id, added_sneaker.id, Wishlist):
+        db.session.rollback()
+        flash("Sneaker is already in your wishlist.", "info")
+        return redirect(f"/users/{g.user.id}/wishlist")
+
+    # Commit all changes to the database
+    db.session.commit()
+    
+    flash("Sneaker added to wishlist!", "success")
+    return redirect(f"/users/{g.user.id}/wishlist")
+
+# Remove from wishlist route
+@views.route('/users/remove_wishlist/<int:wishlist_id>', methods=['POST'])
+def remove_from_wishlist(wishlist_id):
+    """Remove sneaker from user's wishlist."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if closets.remove_and_refresh(g.user.id, wishlist_id, Wishlist):
+        db.session.commit()
+
+    return redirect(f"/users/{g.user.id}/wishlist")
+
+# Bulk closet / wishlist update route
+@views.route('/users/collection', methods=['POST'])
+def bulk_update_collection():
+    """Add, move or remove many sneakers at once, e.g. to import a collection.
+
+    Takes JSON {"closet": [ids], "wishlist": [ids], "remove": [ids]}: ids
+    in "closet" / "wishlist" are added there (moving out of the other
+    list), ids in "remove" leave both; an id in more than one list is a
+    400. Everything happens in one
+    transaction with one notification for followers; returns what changed.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        lists = {name: [int(sneaker_id) for sneaker_id in data.get(name, [])]
+                 for name in ('closet', 'wishlist', 'remove')}
+    except (TypeError, ValueError):
+        return jsonify(error="Sneaker ids must be integers."), 400
+    if sum(len(ids) for ids in lists.values()) > closets.BULK_MAX_ITEMS:
+        return jsonify(error=f"At most {closets.BULK_MAX_ITEMS} sneakers per request."), 400
+    overlap = ((set(lists['closet']) & set(lists['wishlist']))
+               | (set(lists['remove']) & {*lists['closet'], *lists['wishlist']}))
+    if overlap:
+        return jsonify(error="Each sneaker may be in only one list.",
+                       sneaker_ids=sorted(overlap)), 400
+
+    result = closets.bulk(g.user.id, lists['closet'], lists['wishlist'], lists['remove'])
+
+    # One notification for the whole import
+    added = result.closet_added + result.wishlist_added
+    if added:
+        if not result.wishlist_added:
+            event_type = EventType.CLOSET_ADD
+        elif not result.closet_added:
+            event_type = EventType.WISHLIST_ADD
+        else:
+            event_type = EventType.COLLECTION_ADD
+        notification = Notification(event_type=event_type, user_id=g.user.id, sneaker_id=added[0],
+                                    count=len(added), timestamp=datetime.utcnow())
+        db.session.add(notification)
+        db.session.flush()
+        jobs.enqueue('notifications.fan_out', {'notification_id': notification.id},
+                     key=f"fan-out:{notification.id}")
+
+    # Large imports leave recommendations to the batch rebuild
+    if len(result.touched) <= closets.BULK_REFRESH_LIMIT:
+        jobs.enqueue_many('recommendations.refresh',
+                          [{'sneaker_id': sneaker_id} for sneaker_id in result.touched])
+
+    db.session.commit()
+    ownership.invalidate()
+    usercache.invalidate(g.user.id)
+
+    return jsonify(result.to_dict())
+
+
+##############################################################################
+# General User related routes:
+
+@views.route('/users')
+def list_users():
+    """Page with listing of users.
+
+    Only show users if a search query ('q') is provided.
+    """
+    search = request.args.get('q')
+
+    if search:
+        # Search for users based on the username, case-insensitive
+        users = accounts.active_users().filter(User.username.ilike(f"%{search}%"), User.id != g.user.id).all()
+    else:
+        # No search query provided, return an empty list
+        users = []
+
+    followed = social.followed_ids(g.user.id, [user.id for user in users]) if g.user else set()
+    return render_template('users/users_index.html', users=users, followed_ids=followed)
+
+
+
+
+@views.route('/users/<int:user_id>/following')
+def show_following(user_id):
+    """Show list of people this user is following.
+
+    Keyset-paginated by user id with 'after' / 'before' in the querystring.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = accounts.get_active_or_404(user_id)
+    page = social.following_page(user.id,
+                                 after=request.args.get('after', type=int),
+                                 before=request.args.get('before', type=int),
+                                 limit=current_app.config['FOLLOW_PAGE_SIZE'])
+    users = list(page)
+    followed = social.followed_ids(g.user.id, [followed_user.id for followed_user in users])
+    return render_template('users/social/following.html', user=user, users=users,
+                           page=page, followed_ids=followed)
+
+
+@views.route('/users/<int:user_id>/followers')
+def users_followers(user_id):
+    """Show list of followers of this user.
+
+    Keyset-paginated by user id with 'after' / 'before' in the querystring.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = accounts.get_active_or_404(user_id)
+    page = social.followers_page(user.id,
+                                 after=request.args.get('after', type=int),
+                                 before=request.args.get('before', type=int),
+                                 limit=current_app.config['FOLLOW_PAGE_SIZE'])
+    users = list(page)
+    followed = social.followed_ids(g.user.id, [follower.id for follower in users])
+    return render_template('users/social/followers.html', user=user, users=users,
+                           page=page, followed_ids=followed)
+
+@views.route('/users/follow/<int:follow_id>', methods=['POST'])
+def add_follow(follow_id):
+    """Add a follow for the currently-logged-in user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followed_user = accounts.get_active_or_404(follow_id)
+    social.follow(g.user.id, followed_user.id)
+    db.session.commit()
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+
+@views.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+def stop_following(follow_id):
+    """Have currently-logged-in-user stop following this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    social.unfollow(g.user.id, follow_id)
+    db.session.commit()
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@views.route('/users/<int:user_id>')
+def users_show(user_id):
+    """Show user profile.
+
+    Logged-in viewers see how many people they follow also follow this
+    user; on their own profile, suggested collectors from the follow graph.
+    """
+
+    user = accounts.get_active_or_404(user_id)
+
+    mutual_count = 0
+    suggestions = similar = []
+    if g.user:
+        graph = follow_graph.get_graph()
+        if g.user.id == user.id:
+            suggestions = users_by_id([user_id for user_id, _ in graph.suggested(user.id, 5)])
+            similar = users_by_id([user_id for user_id, _ in graph.similar_closets(user.id, 5)])
+        else:
+            mutual_count = len(graph.mutuals(g.user.id, user.id))
+
+    return render_template('users/profile.html', user=user, mutual_count=mutual_count,
+                           suggestions=suggestions, similar_closets=similar)
+
+
+def users_by_id(user_ids):
+    """Load users, keeping the order of `user_ids`."""
+
+    users = {user.id: user for user in accounts.active_users().filter(User.id.in_(user_ids))}
+    return [users[user_id] for user_id in user_ids if user_id in users]
+
+@views.route('/users/profile', methods=["GET", "POST"])
+def edit_profile():
+    """Update profile for current user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = g.user.load()
+    form = UserEditForm(obj=user)
+
+    if form.validate_on_submit():
+        try:
+            authenticated = User.authenticate(user.username, form.password.data)
+        except passwords.Busy:
+            return busy('users/edit.html', form=form, user_id=user.id)
+
+        if authenticated:
+            user.username = form.username.data
+            user.first_name = form.first_name.data
+            user.last_name = form.last_name.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data or "/static/images/default-pic.png"
+
+            db.session.commit()
+            usercache.invalidate(user.id)
+            fragments.invalidate_profile(user.id)
+            flash("Profile updated successfully!", "success")
+            return redirect(f"/users/{user.id}")
+
+        flash("Wrong password, please try again.", 'danger')
+
+    return render_template('users/edit.html', form=form, user_id=user.id)
+
+
+@views.route('/users/delete', methods=["POST"])
+def delete_user():
+    """Delete user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    do_logout()
+
+    # Hidden from now on; the rows are purged in the background
+    accounts.request_deletion(g.user.id)
+    db.session.commit()
+
+    return redirect("/signup")
+
+@views.route('/notifications')
+def notifications():
+    """Page for sneaker and follow related notifications.
+
+    Served from the user's materialized feed inbox; takes 'before' / 'after'
+    cursors in the querystring for older / newer pages.
+    """
+
+    if g.user:
+        # Opening the newest page marks everything read, in every open tab
+        if request.args.get('before') is None and request.args.get('after') is None:
+            feed.mark_read(g.user.id)
+            db.session.commit()
+            push.publish([g.user.id], {'type': 'unread', 'count': 0})
+
+        page = feed.get_page(g.user.id,
+                             before=request.args.get('before', type=int),
+                             after=request.args.get('after', type=int),
+                             limit=current_app.config['FEED_PAGE_SIZE'])
+        return render_template('users/notifications.html', notifications=page.notifications,
+                               older=page.older, newer=page.newer)
+
+    else:
+        flash("You need to log in to view notifications.", "danger")
+        return redirect("/login")
+
+
+@views.route('/notifications/stream')
+def notifications_stream():
+    """Server-Sent Events stream of new notifications and unread counts."""
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+    if push.at_capacity():
+        return jsonify(error="Too many open streams."), 503, {'Retry-After': '30'}
+
+    subscription = push.broker.subscribe(g.user.id)
+    try:
+        unread = feed.unread_count(g.user.id)
+    except Exception:
+        push.broker.unsubscribe(subscription)
+        raise
+
+    # The stream only reads from memory; give the connection back now.
+    db.session.remove()
+
+    response = current_app.response_class(
+        push.stream(subscription, unread, current_app.config['PUSH_HEARTBEAT'],
+                    current_app.config['PUSH_STREAM_TIMEOUT']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    # The stream's own cleanup only runs once it has started; a client that
+    # leaves before the first chunk still gets the response closed.
+    response.call_on_close(lambda: push.broker.unsubscribe(subscription))
+    return response
+
+
+
+##############################################################################
+# Admin
+
+@views.route('/admin/metrics')
+def admin_metrics():
+    """Rolling per-route latency, query and N+1 stats, plus fragment cache,
+    user cache, catalog snapshot, connection pool and password hashing
+    stats, for this worker; and the background job queue and account purges
+    in progress."""
+
+    if not g.user or g.user.username not in current_app.config['METRICS_ADMINS']:
+        abort(404)
+
+    return jsonify(window_seconds=current_app.config['METRICS_WINDOW'],
+                   routes=instrumentation.histograms.summary(),
+                   fragment_cache=fragments.cache.stats(),
+                   user_cache=usercache.cache.stats(),
+                   pools=database.pool_status(db),
+                   catalog=catalog.snapshot_stats(),
+                   passwords=passwords.stats(),
+                   account_deletions=accounts.progress()['pending'],
+                   jobs=jobs.stats())
+
+
+@views.route('/test-notifications')
+def test_notifications():
+    try:
+        return render_template('users/notifications.html')
+    except Exception as e:
+        print(e)
+        return "Error rendering template"
+
+
+##############################################################################
+# Homepage and error pages
+
+@views.route('/')
+def homepage():
+    """Redirect to the sneakers listing page."""
+    return redirect('/sneakers')
+
+
+@views.app_errorhandler(404)
+def page_not_found(e):
+    """404 NOT FOUND page."""
+
+    return render_template('404.html'), 404
+
@@ -0,0 +1,14 @@
+"""Entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py
+
+Builds the app (APP_PROFILE, else 'production') and warms it up at import,
+which gunicorn's preload_app does once in the master.
+"""
+
+import os
+
+from app import create_app, warmup
+
+app = create_app(os.environ.get('APP_PROFILE', 'production'))
+warmup(app)